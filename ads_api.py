@@ -0,0 +1,417 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from datetime import datetime, timedelta
+
+from rate_limiter import RateLimiter, parse_retry_after
+from location_filter import default_filter
+
+# Общий клиент ads-api.ru: одна keep-alive сессия, ретраи и постраничный обход
+# для всех ингестеров (main.py, ads_from_date.py, ads_from_maxdate.py, ads_godays.py)
+load_dotenv()
+ADS_API_USER = os.getenv("ADS_API_USER")
+ADS_API_TOKEN = os.getenv("ADS_API_TOKEN")
+ADS_API_URL = os.getenv("ADS_API_URL", "https://ads-api.ru/main/api")
+
+# Через .env задаются:
+# BATCH_LIMIT: размер страницы (limit)
+# MAX_RETRIES: число повторных попыток при 429/5xx/сетевых ошибках
+# темп запросов и паузы backoff — см. rate_limiter.py
+# ADS_API_CONNECT_TIMEOUT / ADS_API_READ_TIMEOUT: таймауты запроса в секундах
+# ADS_API_POOL_SIZE: размер пула соединений сессии
+# PARTITION_WORKERS: >0 — запрос с несколькими source/nedvigimost_type режется на
+#   партиции по одному значению, которые листаются параллельно (см. iter_partitioned_pages)
+BATCH_LIMIT = int(os.getenv("BATCH_LIMIT", "1000"))
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "10"))
+CONNECT_TIMEOUT = float(os.getenv("ADS_API_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("ADS_API_READ_TIMEOUT", "120"))
+POOL_SIZE = int(os.getenv("ADS_API_POOL_SIZE", "10"))
+PARTITION_WORKERS = int(os.getenv("PARTITION_WORKERS", "0"))
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+logger = logging.getLogger("ads_fetcher")
+
+try:
+    import ijson  # потоковый разбор data[] (iter_ads_streams), нужен ijson >= 3.1; без него — resp.json()
+except ImportError:
+    ijson = None
+
+try:
+    import brotli  # noqa: F401 — urllib3 распакует br, только если установлен brotli
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+_session = None
+# Общий лимитер на процесс: все потоки и все ингестеры делят одну квоту API
+limiter = RateLimiter()
+
+
+def get_session() -> requests.Session:
+    """Возвращает общую сессию с пулом keep-alive соединений."""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+        _session.headers.update({"Accept-Encoding": ACCEPT_ENCODING})
+    return _session
+
+
+def build_params(date1: str = None, date2: str = None, city: str = None, source: str = None,
+                 limit: int = BATCH_LIMIT, **filters) -> dict:
+    """
+    Параметры запроса к API.
+    По умолчанию: квартиры (category_id=2), продажа (nedvigimost_type=1), sort=asc.
+    Любой параметр API можно переопределить через filters, None — убрать из запроса.
+    """
+    params = {
+        "user": ADS_API_USER,
+        "token": ADS_API_TOKEN,
+        "format": "json",
+        "limit": limit,
+        "category_id": 2,
+        "nedvigimost_type": 1,
+        "sort": "asc",
+        "date1": date1,
+        "date2": date2,
+        "city": city,
+        "source": source,
+    }
+    params.update(filters)
+    return {k: v for k, v in params.items() if v is not None}
+
+
+def _request_page(params: dict, stream: bool = False) -> requests.Response:
+    """
+    Запрос одной страницы с ретраями. Темп задаёт общий limiter; при 429 он замедляется
+    и ждёт Retry-After или backoff, при 5xx и сетевых ошибках — jittered backoff.
+    Не более MAX_RETRIES повторов. stream=True — тело ответа ещё не прочитано.
+    """
+    session = get_session()
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            logger.info(f"Requesting ads from {params.get('date1')} to {params.get('date2')}, attempt {attempt+1}")
+            resp = session.get(ADS_API_URL, params=params, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=stream)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt < MAX_RETRIES:
+                delay = limiter.backoff_delay(attempt)
+                attempt += 1
+                logger.warning(f"Network error: {e}, retry {attempt}/{MAX_RETRIES} after {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            logger.error(f"Failed to fetch ads: {e}")
+            raise
+
+        if resp.status_code == 429 and attempt < MAX_RETRIES:
+            resp.close()
+            delay = limiter.on_throttle(attempt, parse_retry_after(resp.headers.get("Retry-After")))
+            attempt += 1
+            logger.warning(f"429 Too Many Requests, retry {attempt}/{MAX_RETRIES} after {delay:.1f}s "
+                           f"(rate now {limiter.rate:.2f} req/s)")
+            continue
+        if resp.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            resp.close()
+            delay = limiter.backoff_delay(attempt)
+            attempt += 1
+            logger.warning(f"{resp.status_code} from ads-api, retry {attempt}/{MAX_RETRIES} after {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        resp.raise_for_status()
+        limiter.on_success()
+        return resp
+
+
+def fetch_ads_batch(date1: str = None, date2: str = None, city: str = None, source: str = None,
+                    limit: int = BATCH_LIMIT, **filters):
+    """Получает одну страницу объявлений за интервал date1..date2 (параметры — build_params)."""
+    params = build_params(date1, date2, city=city, source=source, limit=limit, **filters)
+    return _request_page(params).json().get("data", [])
+
+
+def iter_response_ads(resp: requests.Response):
+    """
+    Объявления из data[] по одному, по мере чтения тела ответа (ijson).
+    Без ijson — обычный resp.json().
+    """
+    if ijson is None:
+        yield from resp.json().get("data", [])
+        return
+    resp.raw.decode_content = True
+    # use_float (ijson >= 3.1): числа как float, а не Decimal — как у resp.json()
+    yield from ijson.items(resp.raw, "data.item", use_float=True)
+
+
+class KeysetCursor:
+    """
+    Курсор постраничного обхода по паре (time, id): следующая страница запрашивается
+    с времени последнего объявления включительно, а уже отданные объявления этой
+    секунды выбрасываются. Так объявления с одинаковым time не теряются на границе страниц.
+    Если в одной секунде объявлений больше limit, дальше внутри неё листать нельзя:
+    курсор перескакивает на следующую секунду и выставляет overfull / overfull_ids.
+    """
+
+    def __init__(self, date1: str, limit: int):
+        self.next_start = date1
+        self.limit = limit
+        self.boundary_time = None
+        self.boundary_ids = set()
+        self.overfull = None
+        self.overfull_ids = set()
+
+    def is_new(self, ad) -> bool:
+        return not (ad["time"] == self.boundary_time and ad.get("id") in self.boundary_ids)
+
+    def accept(self, batch):
+        """Объявления страницы, которые ещё не были отданы."""
+        return [ad for ad in batch if self.is_new(ad)]
+
+    def advance(self, batch) -> bool:
+        """Сдвигает курсор за страницу batch. False — окно исчерпано (страница неполная)."""
+        self.overfull, self.overfull_ids = None, set()
+        if len(batch) < self.limit:
+            return False
+
+        last_time = batch[-1]["time"]
+        if last_time != self.boundary_time:
+            self.boundary_time, self.boundary_ids = last_time, set()
+        new_ids = {ad.get("id") for ad in batch if ad["time"] == last_time} - self.boundary_ids
+        if not new_ids:
+            self.overfull, self.overfull_ids = last_time, self.boundary_ids
+            skip_to = datetime.fromisoformat(last_time) + timedelta(seconds=1)
+            self.next_start = skip_to.strftime(TIME_FORMAT)
+            self.boundary_time, self.boundary_ids = None, set()
+            return True
+        self.boundary_ids |= new_ids
+        self.next_start = datetime.fromisoformat(last_time).strftime(TIME_FORMAT)
+        return True
+
+    def overfull_window(self):
+        """
+        (date1, date2) для дробления переполненной секунды: окно date1 = date2 API
+        возвращает пустым, поэтому запрашивается [секунда, секунда + 1s], а объявления
+        следующей секунды отсекает in_overfull.
+        """
+        second = datetime.fromisoformat(self.overfull)
+        return second.strftime(TIME_FORMAT), (second + timedelta(seconds=1)).strftime(TIME_FORMAT)
+
+    def in_overfull(self, ad) -> bool:
+        """Объявление переполненной секунды, которого не было на страницах до переполнения."""
+        return ad["time"] == self.overfull and ad.get("id") not in self.overfull_ids
+
+
+def _iter_query_pages(date1: str, date2: str, city: str = None, source: str = None,
+                      limit: int = BATCH_LIMIT, **filters):
+    """
+    Постранично обходит интервал date1..date2 одним запросом по KeysetCursor
+    и отдаёт непустые страницы. Переполненная секунда дробится по source
+    (каждый источник отдельным запросом по KeysetCursor.overfull_window), а если
+    источник один — её остаток пропускается с предупреждением.
+    Обход заканчивается на пустой или неполной (меньше limit) странице.
+    limit не превышает BATCH_LIMIT.
+    """
+    cursor = KeysetCursor(date1, min(limit or BATCH_LIMIT, BATCH_LIMIT))
+    while True:
+        batch = fetch_ads_batch(cursor.next_start, date2, city=city, source=source, limit=cursor.limit, **filters)
+        if not batch:
+            return
+        fresh = cursor.accept(batch)
+        if fresh:
+            yield fresh
+        if not cursor.advance(batch):
+            return
+        if cursor.overfull is None:
+            continue
+
+        sources = _split_values(source)
+        if len(sources) < 2:
+            logger.warning(f"More than {cursor.limit} ads at {cursor.overfull}, the rest of this second is skipped")
+            continue
+        logger.info(f"More than {cursor.limit} ads at {cursor.overfull}, splitting the second by source")
+        window = cursor.overfull_window()
+        for part_source in sources:
+            for part in _iter_query_pages(*window, city=city, source=part_source, limit=cursor.limit, **filters):
+                kept = [ad for ad in part if cursor.in_overfull(ad)]
+                if kept:
+                    yield kept
+                # страницы идут по времени: дальше только следующая секунда
+                if part[-1]["time"] != cursor.overfull:
+                    break
+
+
+# Поля объявления, которые StreamedPage запоминает для курсора и чекпоинтов
+PAGE_KEY_FIELDS = ("id", "time", "source_id", "nedvigimost_type_id")
+
+
+class StreamedPage:
+    """
+    Страница, разбираемая прямо из тела ответа: итерация отдаёт новые объявления
+    по одному, а от каждого прочитанного остаются только PAGE_KEY_FIELDS в keys
+    (для KeysetCursor.advance и advance_checkpoints). Объявления вне in_window
+    пропускаются целиком — их нет и в keys.
+    """
+
+    def __init__(self, ads, is_new, in_window=None):
+        self._ads = ads
+        self._is_new = is_new
+        self._in_window = in_window
+        self.keys = []
+
+    def __iter__(self):
+        for ad in self._ads:
+            if self._in_window is not None and not self._in_window(ad):
+                continue
+            self.keys.append({k: ad.get(k) for k in PAGE_KEY_FIELDS})
+            if self._is_new(ad):
+                yield ad
+
+    def drain(self):
+        for _ in self:
+            pass
+
+
+def iter_ads_streams(date1: str, date2: str, city: str = None, source: str = None,
+                     limit: int = BATCH_LIMIT, _outer=None, **filters):
+    """
+    Потоковый вариант _iter_query_pages: отдаёт StreamedPage, которую нужно прочитать
+    до запроса следующей (недочитанное дочитывается само). Так вставка страницы
+    идёт одновременно с её загрузкой, а в памяти не держится весь ответ.
+    _outer — курсор, чью переполненную секунду дробит этот обход: объявления следующей
+    секунды не попадают ни в страницу, ни в её keys, а неполная из-за этого страница
+    заканчивает обход, как break в _iter_query_pages.
+    """
+    in_window = None if _outer is None else (lambda ad: ad["time"] == _outer.overfull)
+    cursor = KeysetCursor(date1, min(limit or BATCH_LIMIT, BATCH_LIMIT))
+    while True:
+        params = build_params(cursor.next_start, date2, city=city, source=source, limit=cursor.limit, **filters)
+        resp = _request_page(params, stream=True)
+        try:
+            page = StreamedPage(iter_response_ads(resp),
+                                lambda ad: cursor.is_new(ad) and (_outer is None or _outer.in_overfull(ad)),
+                                in_window)
+            yield page
+            page.drain()
+        finally:
+            resp.close()
+        if not page.keys or not cursor.advance(page.keys):
+            return
+        if cursor.overfull is None:
+            continue
+
+        sources = _split_values(source)
+        if len(sources) < 2:
+            logger.warning(f"More than {cursor.limit} ads at {cursor.overfull}, the rest of this second is skipped")
+            continue
+        logger.info(f"More than {cursor.limit} ads at {cursor.overfull}, splitting the second by source")
+        window = cursor.overfull_window()
+        for part_source in sources:
+            yield from iter_ads_streams(*window, city=city, source=part_source,
+                                        limit=cursor.limit, _outer=cursor, **filters)
+
+
+def _split_values(value):
+    """'1,2,3' → ['1', '2', '3']; None → [None]."""
+    if value is None:
+        return [None]
+    return [v.strip() for v in str(value).split(",") if v.strip()]
+
+
+def iter_partitioned_pages(date1: str, date2: str, city: str = None, source: str = None,
+                           limit: int = BATCH_LIMIT, workers: int = PARTITION_WORKERS, **filters):
+    """
+    Режет окно на партиции по source и nedvigimost_type (по одному значению в каждой)
+    и листает их параллельно в workers потоков под общим limiter.
+    Страницы партиций отдаются по мере готовности (без общего порядка по времени),
+    объявления с уже встреченным id выбрасываются.
+    """
+    types = _split_values(filters.pop("nedvigimost_type", 1))
+    partitions = [(s, t) for s in _split_values(source) for t in types]
+    workers = max(1, min(workers, len(partitions)))
+    out = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def run_partition(part_source, part_type):
+        try:
+            for batch in _iter_query_pages(date1, date2, city=city, source=part_source, limit=limit,
+                                           nedvigimost_type=part_type, **filters):
+                if stop.is_set():
+                    return
+                put(batch)
+        finally:
+            put(done)
+
+    seen = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="partition") as executor:
+        futures = [executor.submit(run_partition, s, t) for s, t in partitions]
+        try:
+            remaining = len(futures)
+            while remaining:
+                item = out.get()
+                if item is done:
+                    remaining -= 1
+                    continue
+                page = []
+                for ad in item:
+                    ad_id = ad.get("id")
+                    if ad_id in seen:
+                        continue
+                    seen.add(ad_id)
+                    page.append(ad)
+                if page:
+                    yield page
+        finally:
+            stop.set()
+    # Пробрасываем ошибку партиции, если была
+    for future in futures:
+        future.result()
+    logger.info(f"Partitioned fetch: {len(partitions)} partitions, {len(seen)} unique ads")
+
+
+def iter_ads_pages(date1: str, date2: str, city: str = None, source: str = None,
+                   limit: int = BATCH_LIMIT, **filters):
+    """
+    Постранично обходит интервал date1..date2 и отдаёт непустые страницы.
+    При PARTITION_WORKERS > 0 и нескольких source/nedvigimost_type листает
+    партиции параллельно (iter_partitioned_pages), иначе — одним запросом.
+    """
+    partitioned = (len(_split_values(source)) > 1
+                   or len(_split_values(filters.get("nedvigimost_type"))) > 1)
+    if PARTITION_WORKERS > 0 and partitioned:
+        yield from iter_partitioned_pages(date1, date2, city=city, source=source, limit=limit, **filters)
+    else:
+        yield from _iter_query_pages(date1, date2, city=city, source=source, limit=limit, **filters)
+
+
+def iter_filtered_ads(ads, location_filter=None):
+    """Отбрасывает объявления из нежелательных локаций (location_rules.json), не собирая их в список."""
+    return (location_filter or default_filter()).iter(ads)
+
+
+def filter_ads(ads, location_filter=None):
+    """Список объявлений страницы без нежелательных локаций (см. location_filter.py)."""
+    return (location_filter or default_filter()).filter(ads)
+
+
+def api_stats() -> dict:
+    """Счётчики лимитера: запросы, 429, суммарное ожидание и текущая скорость."""
+    return limiter.stats()
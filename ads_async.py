@@ -0,0 +1,224 @@
+import io
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import aiohttp
+import asyncpg
+
+from ads_api import (
+    ADS_API_URL, ACCEPT_ENCODING, BATCH_LIMIT, MAX_RETRIES, CONNECT_TIMEOUT, READ_TIMEOUT,
+    POOL_SIZE, RETRY_STATUSES, TIME_FORMAT, KeysetCursor, build_params, limiter, _split_values,
+)
+from ads_writer import ADS_COLUMNS, STAGE_DDL, STAGE_INSERT_SQL, ads_to_csv
+from checkpoints import UPSERT_SQL, checkpoint_rows, merge_checkpoint_rows
+from rate_limiter import parse_retry_after
+
+# Асинхронный вариант дневного цикла ads_godays.py (флаг --async): один процесс,
+# один event loop, aiohttp для ads-api и пул asyncpg для Postgres.
+# Дни периода выгружаются одновременно, страницы пишутся по мере прихода,
+# а обработка (CALL process_all_ads()) идёт отдельной задачей и схлопывает
+# накопившиеся страницы в один вызов. Темп запросов — общий ads_api.limiter.
+# Через .env задаются:
+# ASYNC_CONCURRENCY: сколько дней выгружается одновременно
+# ASYNC_DB_POOL_SIZE: размер пула соединений asyncpg (плюс одно для обработки)
+ASYNC_CONCURRENCY = int(os.getenv("ASYNC_CONCURRENCY", "4"))
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "4"))
+
+logger = logging.getLogger("ads_fetcher")
+
+_CHECKPOINT_SQL = UPSERT_SQL.format(values="($1, $2, $3, $4, $5, $6)")
+
+
+async def fetch_ads_batch_async(session, date1=None, date2=None, city=None, source=None,
+                                limit=BATCH_LIMIT, **filters):
+    """Асинхронный fetch_ads_batch: те же параметры, ретраи и общий лимитер."""
+    params = {k: str(v) for k, v in build_params(date1, date2, city=city, source=source,
+                                                 limit=limit, **filters).items()}
+    attempt = 0
+    while True:
+        await limiter.acquire_async()
+        try:
+            logger.info(f"Requesting ads from {date1} to {date2}, attempt {attempt+1}")
+            async with session.get(ADS_API_URL, params=params) as resp:
+                status = resp.status
+                retry_after = resp.headers.get("Retry-After")
+                if status not in RETRY_STATUSES or attempt >= MAX_RETRIES:
+                    resp.raise_for_status()
+                    data = await resp.json(content_type=None)
+                    limiter.on_success()
+                    return data.get("data", [])
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt < MAX_RETRIES:
+                delay = limiter.backoff_delay(attempt)
+                attempt += 1
+                logger.warning(f"Network error: {e}, retry {attempt}/{MAX_RETRIES} after {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            logger.error(f"Failed to fetch ads: {e}")
+            raise
+
+        if status == 429:
+            delay = limiter.on_throttle(attempt, parse_retry_after(retry_after))
+            attempt += 1
+            logger.warning(f"429 Too Many Requests, retry {attempt}/{MAX_RETRIES} after {delay:.1f}s "
+                           f"(rate now {limiter.rate:.2f} req/s)")
+            continue
+        delay = limiter.backoff_delay(attempt)
+        attempt += 1
+        logger.warning(f"{status} from ads-api, retry {attempt}/{MAX_RETRIES} after {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+async def iter_ads_pages_async(session, date1, date2, city=None, source=None, limit=BATCH_LIMIT, **filters):
+    """Асинхронный _iter_query_pages: тот же KeysetCursor и дробление переполненной секунды по source."""
+    cursor = KeysetCursor(date1, min(limit or BATCH_LIMIT, BATCH_LIMIT))
+    while True:
+        batch = await fetch_ads_batch_async(session, cursor.next_start, date2, city=city, source=source,
+                                            limit=cursor.limit, **filters)
+        if not batch:
+            return
+        fresh = cursor.accept(batch)
+        if fresh:
+            yield fresh
+        if not cursor.advance(batch):
+            return
+        if cursor.overfull is None:
+            continue
+
+        sources = _split_values(source)
+        if len(sources) < 2:
+            logger.warning(f"More than {cursor.limit} ads at {cursor.overfull}, the rest of this second is skipped")
+            continue
+        logger.info(f"More than {cursor.limit} ads at {cursor.overfull}, splitting the second by source")
+        window = cursor.overfull_window()
+        for part_source in sources:
+            async for part in iter_ads_pages_async(session, *window, city=city,
+                                                   source=part_source, limit=cursor.limit, **filters):
+                kept = [ad for ad in part if cursor.in_overfull(ad)]
+                if kept:
+                    yield kept
+                if part[-1]["time"] != cursor.overfull:
+                    break
+
+
+async def write_page(conn, kept) -> int:
+    """
+    Пишет отфильтрованные объявления страницы одной транзакцией
+    (COPY в ads_stage → INSERT ... SELECT). Чекпоинты здесь не сдвигаются:
+    дни идут вразнобой, см. AsyncIngest.run.
+    """
+    if not kept:
+        return 0
+    async with conn.transaction():
+        await conn.execute(STAGE_DDL)
+        await conn.execute("TRUNCATE ads_stage;")
+        data = io.BytesIO(ads_to_csv(kept).getvalue().encode("utf-8"))
+        await conn.copy_to_table("ads_stage", source=data, columns=list(ADS_COLUMNS), format="csv")
+        status = await conn.execute(STAGE_INSERT_SQL)
+        return int(status.split()[-1])
+
+
+class AsyncIngest:
+    """
+    Выгружает период start_dt..end_dt по дням, до concurrency дней одновременно.
+    filter_page(ads) — какие объявления страницы писать в ads,
+    process_sql — обработка вставленного (выполняется отдельным соединением),
+    after_commit(ads) — необязательный вызов после commit страницы.
+    filter_page и after_commit синхронные (например, SQLite кэша seen_cache.py), поэтому
+    выполняются в пуле потоков, чтобы не останавливать event loop с загрузкой других дней.
+    """
+
+    def __init__(self, dsn, city, source, filter_page, process_sql="CALL process_all_ads();",
+                 concurrency=ASYNC_CONCURRENCY, pool_size=ASYNC_DB_POOL_SIZE, after_commit=None):
+        self.dsn = dsn
+        self.city = city
+        self.source = source
+        self.filter_page = filter_page
+        self.process_sql = process_sql
+        self.after_commit = after_commit
+        self.concurrency = max(1, concurrency)
+        self.pool_size = max(1, pool_size)
+        self.fetched = 0
+        self.inserted = 0
+        self.process_calls = 0
+        self._checkpoints = []
+        self._dirty = asyncio.Event()
+        self._finished = False
+
+    async def _load_day(self, session, pool, semaphore, day_start, day_end):
+        async with semaphore:
+            logger.info(f"Processing {day_start[:10]} ({day_start} — {day_end})")
+            async for batch in iter_ads_pages_async(session, day_start, day_end, city=self.city,
+                                                    source=self.source, limit=BATCH_LIMIT):
+                loop = asyncio.get_running_loop()
+                kept = await loop.run_in_executor(None, self.filter_page, batch)
+                async with pool.acquire() as conn:
+                    inserted = await write_page(conn, kept)
+                self._checkpoints = merge_checkpoint_rows(self._checkpoints + checkpoint_rows(self.city, batch))
+                if self.after_commit:
+                    await loop.run_in_executor(None, self.after_commit, batch)
+                self.fetched += len(batch)
+                self.inserted += inserted
+                self._dirty.set()
+                logger.info(f"  Inserted {inserted}/{len(batch)} ads, last time: {batch[-1]['time']}")
+
+    async def _processor(self):
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            while True:
+                await self._dirty.wait()
+                self._dirty.clear()
+                await conn.execute(self.process_sql)
+                self.process_calls += 1
+                if self._finished and not self._dirty.is_set():
+                    return
+        finally:
+            await conn.close()
+
+    async def run(self, start_dt, end_dt) -> int:
+        days = []
+        current_day = start_dt
+        while current_day < end_dt:
+            day_start = current_day.strftime('%Y-%m-%d 00:00:00')
+            if current_day == start_dt:
+                day_start = start_dt.strftime(TIME_FORMAT)
+            day_end = (current_day + timedelta(days=1)).strftime('%Y-%m-%d 00:00:00')
+            days.append((day_start, day_end))
+            current_day += timedelta(days=1)
+        logger.info(f"Async ingest: {len(days)} days, {self.concurrency} in flight, db pool {self.pool_size}")
+
+        started = time.perf_counter()
+        timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+        connector = aiohttp.TCPConnector(limit=POOL_SIZE)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.pool_size)
+        processor = asyncio.create_task(self._processor())
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                             headers={"Accept-Encoding": ACCEPT_ENCODING}) as session:
+                await asyncio.gather(*(self._load_day(session, pool, semaphore, day_start, day_end)
+                                       for day_start, day_end in days))
+            # Весь период выгружен без ошибок — чекпоинты сдвигаются разом,
+            # иначе last_time ушёл бы за упавший или недогруженный день
+            if self._checkpoints:
+                async with pool.acquire() as conn:
+                    await conn.executemany(_CHECKPOINT_SQL, self._checkpoints)
+        finally:
+            # Последний вызов обработки подберёт всё вставленное к этому моменту
+            self._finished = True
+            self._dirty.set()
+            await processor
+            await pool.close()
+
+        elapsed = time.perf_counter() - started
+        logger.info(f"Async ingest done in {elapsed:.1f}s: fetched={self.fetched} inserted={self.inserted} "
+                    f"({self.fetched / max(elapsed, 1e-9):.0f} ads/s), process calls={self.process_calls}")
+        return self.inserted
+
+
+def run_async_ingest(dsn, city, source, filter_page, start_dt: datetime, end_dt: datetime, **kwargs) -> int:
+    """Синхронная точка входа для ads_godays.py."""
+    return asyncio.run(AsyncIngest(dsn, city, source, filter_page, **kwargs).run(start_dt, end_dt))
@@ -1,207 +1,76 @@
 import os
-import sys
-import time
-import requests
+import logging
 import psycopg2
-from psycopg2.extras import Json
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from datetime import datetime
 
-# Настройки: начало отсчёта и количество дней назад
+from ads_api import iter_ads_pages, filter_ads, api_stats, TIME_FORMAT
+from ads_writer import copy_ads_batch
+from checkpoints import advance_checkpoints, resume_time
+from claims import call_procedure
+from seen_cache import open_seen_cache
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+# Настройки подключения и стартовая дата, если flats_history пуст
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
-ADS_API_USER = os.getenv("ADS_API_USER")
-ADS_API_TOKEN = os.getenv("ADS_API_TOKEN")
-ADS_API_URL = "https://ads-api.ru/main/api"
 
 # Через .env задаются:
 # DATE_START: 'YYYY-MM-DD'
-# DAYS_COUNT: число дней для обработки (можно переопределить аргументом)
-# BATCH_DELAY: задержка между пачками и между днями в секундах (по умолчанию 5)
-# MAX_RETRIES: число повторных попыток при HTTPError (429)
-# RETRY_DELAY: пауза при retry
+# MAX_RETRIES, BATCH_LIMIT — см. ads_api.py, темп запросов — rate_limiter.py
 DATE_START = os.getenv("DATE_START", datetime.now().strftime('%Y-%m-%d'))
-# Считываем DAYS_COUNT из argv при наличии
-if len(sys.argv) > 1:
-    try:
-        DAYS_COUNT = int(sys.argv[1])
-    except ValueError:
-        print(f"Invalid DAYS_COUNT argument: {sys.argv[1]}")
-        sys.exit(1)
-else:
-    DAYS_COUNT = int(os.getenv("DAYS_COUNT", "30"))
-
-BATCH_DELAY = int(os.getenv("BATCH_DELAY", "5"))
-MAX_RETRIES = int(os.getenv("MAX_RETRIES", "30"))
-RETRY_DELAY = int(os.getenv("RETRY_DELAY", "10"))
-
-
-def fetch_ads_batch(date1: str, date2: str, city: str = None, source: str = None, limit: int = 200):
-    """
-    Получает одну страницу объявлений за интервал date1..date2.
-    Фильтры: квартиры (category_id=2), продажа (nedvigimost_type=1).
-    При HTTPError 429 ретрай не более MAX_RETRIES раз с задержкой RETRY_DELAY.
-    """
-    params = {
-        "user": ADS_API_USER,
-        "token": ADS_API_TOKEN,
-        "format": "json",
-        "limit": limit,
-        "category_id": 2,
-        "nedvigimost_type": 1,
-        "sort": "asc",
-        "date1": date1,
-        "date2": date2,
-    }
-    if city:
-        params["city"] = city
-    if source:
-        params["source"] = source
-
-    attempt = 0
-    while True:
-        try:
-            print(f"Requesting ads from {date1} to {date2}, attempt {attempt+1}")
-            resp = requests.get(ADS_API_URL, params=params)
-            resp.raise_for_status()
-            return resp.json().get("data", [])
-        except requests.exceptions.HTTPError:
-            if resp.status_code == 429 and attempt < MAX_RETRIES:
-                attempt += 1
-                print(f"429 Too Many Requests, retry in {RETRY_DELAY}s (attempt {attempt}/{MAX_RETRIES})")
-                time.sleep(RETRY_DELAY)
-                continue
-            else:
-                raise
+
+# Исключаемые локации — location_rules.json, кэш записанного — SEEN_CACHE_PATH (seen_cache.py)
+CITY = "Москва"
+SOURCE = "1,2,3,4"
+SEEN = open_seen_cache()
 
 
 def insert_ads_batch(cursor, ads):
     """
     Вставляет пачку объявлений в БД, исключая ненужные поля
-    и объявления из нежелательных локаций.
+    и объявления из нежелательных локаций или уже записанные без изменений.
+    Чекпоинт сдвигается по всей странице.
     """
-    # Списки подстрок для фильтрации (в нижнем регистре)
-    exclude_city = ['зеленоград', 'новая москва', 'область']
-    exclude_district = ['нао']
-    exclude_address = ['новомосковский', 'зеленоград', 'троицк', 'красногорск' ,'обл.', 'люберцы', 'балашиха','НАО']
-
-    for ad in ads:
-        city = (ad.get("city") or "").lower()
-        district = (ad.get("district_only") or "").lower()
-        address = (ad.get("address") or "").lower()
-
-        # Пропускаем объявления из нежелательных локаций
-        if any(sub in city for sub in exclude_city):
-            continue
-        if any(sub in district for sub in exclude_district):
-            continue
-        if any(sub in address for sub in exclude_address):
-            continue
-
-        # Удаляем ненужные поля
-        for field in ["person_type", "nedvigimost_type", "cat1", "cat2", "source"]:
-            ad.pop(field, None)
-
-        # Парсим координаты и расстояние до метро
-        coords = ad.get("coords") or {}
-        try:
-            lat = float(coords.get("lat")) if coords.get("lat") else None
-            lng = float(coords.get("lng")) if coords.get("lng") else None
-        except (ValueError, TypeError):
-            lat = lng = None
-        try:
-            km = float(ad.get("km_do_metro")) if ad.get("km_do_metro") else None
-        except (ValueError, TypeError):
-            km = None
-
-        # Вставка в базу
-        cursor.execute("""
-            INSERT INTO ads (
-                id, url, price, "time", time_source_created, time_source_updated,
-                person, person_type_id, city, metro_only, district_only,
-                address, description, nedvigimost_type_id, avitoid,
-                cat1_id, cat2_id, source_id, is_actual, km_do_metro,
-                coords_lat, coords_lng, images, params, params2,
-                processed, debug
-            ) VALUES (
-                %(id)s, %(url)s, %(price)s, %(time)s, %(time_source_created)s, %(time_source_updated)s,
-                %(person)s, %(person_type_id)s, %(city)s, %(metro_only)s, %(district_only)s,
-                %(address)s, %(description)s, %(nedvigimost_type_id)s, %(avitoid)s,
-                %(cat1_id)s, %(cat2_id)s, %(source_id)s, %(is_actual)s, %(km_do_metro)s,
-                %(coords_lat)s, %(coords_lng)s, %(images)s, %(params)s, %(params2)s,
-                %(processed)s, %(debug)s
-            ) ON CONFLICT (id) DO NOTHING;
-        """, {
-            "id": ad.get("id"),
-            "url": ad.get("url"),
-            "price": ad.get("price"),
-            "time": ad.get("time"),
-            "time_source_created": ad.get("time_source_created"),
-            "time_source_updated": ad.get("time_source_updated"),
-            "person": ad.get("person"),
-            "person_type_id": ad.get("person_type_id"),
-            "city": ad.get("city"),
-            "metro_only": ad.get("metro_only"),
-            "district_only": ad.get("district_only"),
-            "address": ad.get("address"),
-            "description": ad.get("description"),
-            "nedvigimost_type_id": ad.get("nedvigimost_type_id"),
-            "avitoid": ad.get("avitoid"),
-            "cat1_id": ad.get("cat1_id"),
-            "cat2_id": ad.get("cat2_id"),
-            "source_id": ad.get("source_id"),
-            "is_actual": ad.get("is_actual"),
-            "km_do_metro": km,
-            "coords_lat": lat,
-            "coords_lng": lng,
-            "images": Json(ad.get("images", [])),
-            "params": Json(ad.get("params", {})),
-            "params2": Json(ad.get("params2", {})),
-            "processed": False,
-            "debug": Json({})
-        })
+    advance_checkpoints(cursor, CITY, ads)
+    copy_ads_batch(cursor, SEEN.check(filter_ads(ads)))
 
 
 def main():
     conn = psycopg2.connect(DATABASE_URL)
     cursor = conn.cursor()
 
-    # Получаем максимально сохранённую дату в истории
-    cursor.execute("SELECT MAX(time_source_updated) FROM flats_history;")
-    last_saved_time = cursor.fetchone()[0]
+    # Точка продолжения — из ingest_checkpoints; скан flats_history только при первом запуске
+    last_saved_time = resume_time(cursor, CITY, SOURCE)
+    if not last_saved_time:
+        cursor.execute("SELECT MAX(time_source_updated) FROM flats_history;")
+        last_saved_time = cursor.fetchone()[0]
 
     if not last_saved_time:
         print("[WARN] flats_history пуст — используем DATE_START")
         last_saved_time = datetime.strptime(DATE_START, '%Y-%m-%d')
 
-    # Интервал для загрузки
-    date1 = (last_saved_time + timedelta(seconds=1)).strftime('%Y-%m-%d %H:%M:%S')
-    date2 = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # Интервал для загрузки: последняя секунда включительно, чтобы не потерять
+    # объявления с тем же time (повторы отсечёт ON CONFLICT (id))
+    date1 = last_saved_time.strftime(TIME_FORMAT)
+    date2 = datetime.now().strftime(TIME_FORMAT)
 
     print(f"[LOG] Fetching ads from {date1} to {date2}", flush=True)
 
     total = 0
-    next_start = date1
 
     # Цикл по партиям
-    while True:
-        batch = fetch_ads_batch(date1=next_start, date2=date2, city="Москва", source="1,2,3,4")
-        if not batch:
-            break
+    for batch in iter_ads_pages(date1, date2, city=CITY, source=SOURCE):
         insert_ads_batch(cursor, batch)
         conn.commit()
-        count = len(batch)
-        total += count
-        last_time = datetime.fromisoformat(batch[-1]["time"]) + timedelta(seconds=1)
-        next_start = last_time.strftime('%Y-%m-%d %H:%M:%S')
-        print(f"  Inserted {count} ads (next start: {next_start})", flush=True)
-        if count < 1000:
-            break
-        time.sleep(BATCH_DELAY)
-
-    print(f"[DONE] Total inserted: {total}", flush=True)
+        SEEN.remember(batch)
+        total += len(batch)
+        print(f"  Inserted {len(batch)} ads (last time: {batch[-1]['time']})", flush=True)
+
+    print(f"[DONE] Total inserted: {total}, API: {api_stats()}, seen cache: {SEEN.stats()}", flush=True)
     # Вызов хранимой процедуры для обработки пачки
-    cursor.execute("CALL process_ads_batch('1000');")
+    call_procedure(cursor, "CALL process_ads_batch(1000);")
     conn.commit()
 
     cursor.close()
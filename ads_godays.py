@@ -3,12 +3,18 @@ import sys
 import time
 import logging
 from logging.handlers import TimedRotatingFileHandler
-import requests
 import psycopg2
-from psycopg2.extras import Json
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 
+from ads_api import iter_ads_pages, iter_ads_streams, filter_ads, iter_filtered_ads, api_stats, BATCH_LIMIT
+from ads_writer import copy_ads_batch, copy_ads_stream
+from checkpoints import advance_checkpoints, resume_time
+from claims import call_procedure
+from backfill import run_backfill, BACKFILL_WORKERS
+from pipeline import Pipeline
+from seen_cache import open_seen_cache
+
 # --- Настройки логирования с ротацией по дням ---
 log_dir = os.getenv("LOG_DIR", "./logs")
 os.makedirs(log_dir, exist_ok=True)
@@ -34,127 +40,78 @@ logger.addHandler(console_handler)
 # Загрузка настроек из .env
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
-ADS_API_USER = os.getenv("ADS_API_USER")
-ADS_API_TOKEN = os.getenv("ADS_API_TOKEN")
-ADS_API_URL = os.getenv("ADS_API_URL", "https://ads-api.ru/main/api")
 
-# Параметры
+# Параметры (BATCH_LIMIT, MAX_RETRIES и таймауты API — см. ads_api.py, темп запросов — rate_limiter.py)
 DATE_START = os.getenv("DATE_START", "2025-01-01")  # e.g. "2025-01-01" или None
 DAYS_COUNT = int(os.getenv("DAYS_COUNT", "0"))
-BATCH_DELAY = int(os.getenv("BATCH_DELAY", "5"))
-MAX_RETRIES = int(os.getenv("MAX_RETRIES", "30"))
-RETRY_DELAY = int(os.getenv("RETRY_DELAY", "10"))
-BATCH_LIMIT = int(os.getenv("BATCH_LIMIT", "1000"))
-
-
-def fetch_ads_batch(date1: str, date2: str, city: str = None, source: str = None, limit: int = BATCH_LIMIT):
-    params = {
-        "user": ADS_API_USER,
-        "token": ADS_API_TOKEN,
-        "format": "json",
-        "limit": limit,
-        "category_id": 2,
-        "nedvigimost_type": 1,
-        "sort": "asc",
-        "date1": date1,
-        "date2": date2,
-    }
-    if city:
-        params["city"] = city
-    if source:
-        params["source"] = source
-
-    attempt = 0
-    while True:
-        try:
-            logger.info(f"Requesting ads from {date1} to {date2}, attempt {attempt+1}")
-            resp = requests.get(ADS_API_URL, params=params)
-            resp.raise_for_status()
-            return resp.json().get("data", [])
-        except requests.exceptions.HTTPError as e:
-            if resp.status_code == 429 and attempt < MAX_RETRIES:
-                attempt += 1
-                logger.warning(f"429 Too Many Requests, retry {attempt}/{MAX_RETRIES} after {RETRY_DELAY}s")
-                time.sleep(RETRY_DELAY)
-            else:
-                logger.error(f"Failed to fetch ads: {e}")
-                raise
+# BACKFILL_WORKERS > 0 — дни выгружаются параллельно по (день, источник), см. backfill.py
+# --pipeline — выгрузка, вставка и обработка идут параллельно в конвейере, см. pipeline.py
+PIPELINE_MODE = "--pipeline" in sys.argv
+# --async — дни выгружаются одновременно в одном event loop (aiohttp + asyncpg), см. ads_async.py
+ASYNC_MODE = "--async" in sys.argv
+# --stream — страница разбирается из ответа по мере загрузки и сразу идёт в COPY (нужен ijson)
+STREAM_MODE = "--stream" in sys.argv
+
+CITY = "Москва"
+SOURCE = "1,2,3,4"
+
+# Кэш уже записанных объявлений (SEEN_CACHE_PATH, см. seen_cache.py); --stream его не использует
+SEEN = open_seen_cache()
+
+
+def keep_ads(ads):
+    """Объявления страницы, которые нужно писать в ads: допустимые локации, новые или изменившиеся."""
+    return SEEN.check(filter_ads(ads))
+
+
+def copy_kept_ads(cursor, ads):
+    """Вставка страницы без сдвига ingest_checkpoints — для бэкфилла, где дни идут вразнобой."""
+    copy_ads_batch(cursor, keep_ads(ads))
 
 
 def insert_ads_batch(cursor, ads):
-    exclude_city = ['зеленоград', 'новая москва', 'область']
-    exclude_district = ['нао', 'тао']
-    exclude_address = ['новомосковский', 'зеленоград', 'десёновское', 'троицк', 'коммунарка', 'красногорск', 'обл.', 'люберцы', 'балашиха','нао']
-
-    for ad in ads:
-        city = (ad.get("city") or "").lower()
-        district = (ad.get("district_only") or "").lower()
-        address = (ad.get("address") or "").lower()
-
-        if any(sub in city for sub in exclude_city): continue
-        if any(sub in district for sub in exclude_district): continue
-        if any(sub in address for sub in exclude_address): continue
-
-        for f in ["person_type", "nedvigimost_type", "cat1", "cat2", "source"]:
-            ad.pop(f, None)
-
-        coords = ad.get("coords") or {}
-        try:
-            lat = float(coords.get("lat")) if coords.get("lat") else None
-            lng = float(coords.get("lng")) if coords.get("lng") else None
-        except (ValueError, TypeError):
-            lat = lng = None
-
-        try:
-            km = float(ad.get("km_do_metro")) if ad.get("km_do_metro") else None
-        except (ValueError, TypeError):
-            km = None
-
-        cursor.execute("""
-            INSERT INTO ads (
-                id, url, price, "time", time_source_created, time_source_updated,
-                person, person_type_id, city, metro_only, district_only,
-                address, description, nedvigimost_type_id, avitoid,
-                cat1_id, cat2_id, source_id, is_actual, km_do_metro,
-                coords_lat, coords_lng, images, params, params2,
-                processed, debug
-            ) VALUES (
-                %(id)s, %(url)s, %(price)s, %(time)s, %(time_source_created)s, %(time_source_updated)s,
-                %(person)s, %(person_type_id)s, %(city)s, %(metro_only)s, %(district_only)s,
-                %(address)s, %(description)s, %(nedvigimost_type_id)s, %(avitoid)s,
-                %(cat1_id)s, %(cat2_id)s, %(source_id)s, %(is_actual)s, %(km_do_metro)s,
-                %(coords_lat)s, %(coords_lng)s, %(images)s, %(params)s, %(params2)s,
-                %(processed)s, %(debug)s
-            ) ON CONFLICT (id) DO NOTHING;
-        """, {
-            "id": ad.get("id"),
-            "url": ad.get("url"),
-            "price": ad.get("price"),
-            "time": ad.get("time"),
-            "time_source_created": ad.get("time_source_created"),
-            "time_source_updated": ad.get("time_source_updated"),
-            "person": ad.get("person"),
-            "person_type_id": ad.get("person_type_id"),
-            "city": ad.get("city"),
-            "metro_only": ad.get("metro_only"),
-            "district_only": ad.get("district_only"),
-            "address": ad.get("address"),
-            "description": ad.get("description"),
-            "nedvigimost_type_id": ad.get("nedvigimost_type_id"),
-            "avitoid": ad.get("avitoid"),
-            "cat1_id": ad.get("cat1_id"),
-            "cat2_id": ad.get("cat2_id"),
-            "source_id": ad.get("source_id"),
-            "is_actual": ad.get("is_actual"),
-            "km_do_metro": km,
-            "coords_lat": lat,
-            "coords_lng": lng,
-            "images": Json(ad.get("images", [])),
-            "params": Json(ad.get("params", {})),
-            "params2": Json(ad.get("params2", {})),
-            "processed": False,
-            "debug": Json({})
-        })
+    # Чекпоинт сдвигается по всей странице, включая отфильтрованные объявления
+    advance_checkpoints(cursor, CITY, ads)
+    copy_kept_ads(cursor, ads)
+
+
+def iter_period_days(start_dt, end_dt):
+    """Интервалы (day_start, day_end) по дням периода start_dt..end_dt."""
+    current_day = start_dt
+    while current_day < end_dt:
+        day_start = current_day.strftime('%Y-%m-%d 00:00:00')
+        if current_day == start_dt:
+            # Первый день начинаем с точки продолжения, а не с полуночи
+            day_start = start_dt.strftime('%Y-%m-%d %H:%M:%S')
+        day_end = (current_day + timedelta(days=1)).strftime('%Y-%m-%d 00:00:00')
+        logger.info(f"Processing {current_day.date()} ({day_start} — {day_end})")
+        yield day_start, day_end
+        current_day += timedelta(days=1)
+
+
+def iter_period_pages(start_dt, end_dt):
+    """Страницы объявлений по дням периода start_dt..end_dt."""
+    for day_start, day_end in iter_period_days(start_dt, end_dt):
+        yield from iter_ads_pages(day_start, day_end, city=CITY, source=SOURCE, limit=BATCH_LIMIT)
+
+
+def iter_period_streams(start_dt, end_dt):
+    """Потоковые страницы (StreamedPage) по дням периода start_dt..end_dt."""
+    for day_start, day_end in iter_period_days(start_dt, end_dt):
+        yield from iter_ads_streams(day_start, day_end, city=CITY, source=SOURCE, limit=BATCH_LIMIT)
+
+
+def insert_ads_stream(cursor, page):
+    """Вставка StreamedPage: COPY читает объявления по мере разбора ответа."""
+    inserted = copy_ads_stream(cursor, iter_filtered_ads(page))
+    page.drain()
+    advance_checkpoints(cursor, CITY, page.keys)
+    return inserted
+
+
+def process_all_ads(cursor):
+    # Процедура коммитит каждую пачку сама, поэтому вызывается вне транзакции
+    call_procedure(cursor, "CALL process_all_ads();")
 
 
 def main():
@@ -162,14 +119,16 @@ def main():
     cursor = conn.cursor()
 
     # Начальный процессинг любых прошлых данных
-    cursor.execute("CALL process_all_ads();")
+    process_all_ads(cursor)
     conn.commit()
 
-    # Определяем точку продолжения
-    cursor.execute("SELECT MAX(time_source_updated) FROM ads;")
-    last_saved = cursor.fetchone()[0]
+    # Определяем точку продолжения: ingest_checkpoints, скан ads — только при первом запуске
+    last_saved = resume_time(cursor, CITY, SOURCE)
+    if not last_saved:
+        cursor.execute("SELECT MAX(time_source_updated) FROM ads;")
+        last_saved = cursor.fetchone()[0]
     if last_saved:
-        start_dt = last_saved + timedelta(seconds=1)
+        start_dt = last_saved
         logger.info(f"Resuming from last saved time {start_dt}")
     else:
         if not DATE_START:
@@ -184,40 +143,59 @@ def main():
     else:
         end_dt = datetime.now()
 
-    total = 0
-    current_day = start_dt
-    while current_day < end_dt:
-        day_start = current_day.strftime('%Y-%m-%d 00:00:00')
-        day_end = (current_day + timedelta(days=1)).strftime('%Y-%m-%d 00:00:00')
-        logger.info(f"Processing {current_day.date()} ({day_start} — {day_end})")
-        next_start = day_start
-
-        while True:
-            batch = fetch_ads_batch(date1=next_start, date2=day_end, city="Москва", source="1,2,3,4", limit=BATCH_LIMIT)
-            if not batch:
-                break
+    started = time.perf_counter()
+    if ASYNC_MODE:
+        from ads_async import run_async_ingest
+        total = run_async_ingest(DATABASE_URL, CITY, SOURCE, keep_ads, start_dt, end_dt,
+                                 after_commit=SEEN.remember)
+    elif BACKFILL_WORKERS > 0:
+        # Всё выгруженное обрабатывается одним вызовом после бэкфилла; параллельные
+        # обработчики тоже допустимы — они делят очередь через claim_ads (db/migrations/010_ad_claims.sql)
+        days = []
+        current_day = start_dt
+        while current_day < end_dt:
+            days.append(current_day.date())
+            current_day += timedelta(days=1)
+        # Прогресс бэкфилла — в backfill_checkpoints; ingest_checkpoints не трогаем,
+        # иначе упавший день оказался бы позади last_time и не догрузился бы
+        total = run_backfill(DATABASE_URL, days, copy_kept_ads, city=CITY, after_commit=SEEN.remember)
+        process_all_ads(cursor)
+        conn.commit()
+    elif PIPELINE_MODE:
+        logger.info("Pipeline mode: fetcher → writer → processor")
+        total = Pipeline(DATABASE_URL, iter_period_pages(start_dt, end_dt), insert_ads_batch, process_all_ads,
+                         after_commit=SEEN.remember).run()
+    elif STREAM_MODE:
+        total = 0
+        for page in iter_period_streams(start_dt, end_dt):
+            inserted = insert_ads_stream(cursor, page)
+            conn.commit()
+            if not page.keys:
+                continue
+            process_all_ads(cursor)
+            conn.commit()
 
+            total += len(page.keys)
+            logger.info(f"  Streamed {len(page.keys)} ads ({inserted} new), processed, "
+                        f"last time: {page.keys[-1]['time']}")
+    else:
+        total = 0
+        for batch in iter_period_pages(start_dt, end_dt):
             insert_ads_batch(cursor, batch)
             conn.commit()
+            SEEN.remember(batch)
             # Обработка вставленных объявлений сразу после каждой пачки
-            cursor.execute("CALL process_all_ads();")
+            process_all_ads(cursor)
             conn.commit()
 
             cnt = len(batch)
             total += cnt
-            last_time = datetime.fromisoformat(batch[-1]["time"]) + timedelta(seconds=1)
-            next_start = last_time.strftime('%Y-%m-%d %H:%M:%S')
-            logger.info(f"  Inserted {cnt} ads, processed, next start: {next_start}")
-
-            if cnt < BATCH_LIMIT:
-                break
-
-            time.sleep(BATCH_DELAY)
-
-        current_day += timedelta(days=1)
-        time.sleep(BATCH_DELAY)
+            logger.info(f"  Inserted {cnt} ads, processed, last time: {batch[-1]['time']}")
 
-    logger.info(f"Done. Total inserted and processed for period: {total}")
+    logger.info(f"Done. Total inserted and processed for period: {total} in {time.perf_counter() - started:.1f}s")
+    logger.info(f"API stats: {api_stats()}")
+    if SEEN.stats():
+        logger.info(f"Seen cache: {SEEN.stats()}")
     cursor.close()
     conn.close()
 
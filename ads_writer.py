@@ -0,0 +1,208 @@
+import io
+import json
+
+from psycopg2.extras import Json
+
+# Колонки таблицы ads, которые заполняются ингестерами (порядок важен для COPY)
+ADS_COLUMNS = (
+    "id", "url", "price", "time", "time_source_created", "time_source_updated",
+    "person", "person_type_id", "city", "metro_only", "district_only",
+    "address", "description", "nedvigimost_type_id", "avitoid",
+    "cat1_id", "cat2_id", "source_id", "is_actual", "km_do_metro",
+    "coords_lat", "coords_lng", "images", "params", "params2",
+    "processed", "debug",
+)
+JSON_COLUMNS = {"images", "params", "params2", "debug"}
+
+# Поля ответа API, которые не сохраняем (есть *_id аналоги)
+DROP_FIELDS = ("person_type", "nedvigimost_type", "cat1", "cat2", "source")
+
+_COLUMNS_SQL = ", ".join(f'"{c}"' for c in ADS_COLUMNS)
+
+# Staging-таблица повторяет только типы нужных колонок ads, без ограничений
+STAGE_DDL = f"""
+CREATE TEMP TABLE IF NOT EXISTS ads_stage
+  ON COMMIT DELETE ROWS
+  AS SELECT {_COLUMNS_SQL} FROM ads WITH NO DATA;
+"""
+# Объявления, чей отпечаток совпадает с последним снимком в flats_history (db/migrations/004_fingerprint.sql),
+# в ads не попадают: у снимка только сдвигается time_source_updated.
+# Условия строятся для источника-объявления (stage-таблица или параметры одной строки):
+# совпадение по content_hash (index-only) и по полям для строк, которым отпечаток ещё
+# не заполнен backfill_content_hash() (частичный индекс, после заполнения пуст).
+def _unchanged_sql(avitoid, source_id, price, is_actual, description):
+    key = f"fh.avitoid = {avitoid} AND fh.source_id = {source_id}"
+    fp = f"public.ad_fingerprint({price}::numeric, {is_actual}::text, {description})"
+    return (f"{key} AND fh.content_hash = {fp}",
+            f"{key} AND fh.content_hash IS NULL"
+            f" AND public.ad_fingerprint(fh.price, fh.is_actual::text, fh.description) = {fp}")
+
+
+def _fresh_ads_sql(values_sql, from_sql, avitoid, source_id, price, is_actual, description, time_source_updated):
+    """Сдвиг time_source_updated неизменившимся и вставка в ads только остальных."""
+    by_hash, by_fields = _unchanged_sql(avitoid, source_id, price, is_actual, description)
+    return f"""
+WITH touched AS (
+  UPDATE flats_history fh
+     SET time_source_updated = {time_source_updated}
+    {from_sql}
+   WHERE (({by_hash}) OR ({by_fields}))
+     AND fh.time_source_updated < {time_source_updated}
+)
+INSERT INTO ads ({_COLUMNS_SQL})
+SELECT {values_sql} {from_sql}
+ WHERE NOT EXISTS (SELECT 1 FROM flats_history fh WHERE {by_hash})
+   AND NOT EXISTS (SELECT 1 FROM flats_history fh WHERE {by_fields})
+ON CONFLICT (id) DO NOTHING;
+"""
+
+
+STAGE_INSERT_SQL = _fresh_ads_sql(
+    ", ".join(f's."{c}"' for c in ADS_COLUMNS), "FROM ads_stage s",
+    "s.avitoid", "s.source_id", "s.price", "s.is_actual", "s.description", "s.time_source_updated",
+)
+# То же для одного объявления в параметрах — построчный путь для сравнения в bench_insert.py
+ROW_INSERT_SQL = _fresh_ads_sql(
+    ", ".join(f"%({c})s" for c in ADS_COLUMNS), "",
+    "%(avitoid)s", "%(source_id)s", "%(price)s", "%(is_actual)s", "%(description)s", "%(time_source_updated)s",
+)
+
+
+def _to_float(value):
+    try:
+        return float(value) if value else None
+    except (ValueError, TypeError):
+        return None
+
+
+def ad_to_row(ad: dict) -> dict:
+    """
+    Приводит объявление из API к набору колонок таблицы ads.
+    Координаты и расстояние до метро парсятся в float, мусор → NULL.
+    """
+    for field in DROP_FIELDS:
+        ad.pop(field, None)
+    coords = ad.get("coords") or {}
+    try:
+        lat = float(coords.get("lat")) if coords.get("lat") else None
+        lng = float(coords.get("lng")) if coords.get("lng") else None
+    except (ValueError, TypeError):
+        lat = lng = None
+
+    row = {c: ad.get(c) for c in ADS_COLUMNS}
+    row.update({
+        "km_do_metro": _to_float(ad.get("km_do_metro")),
+        "coords_lat": lat,
+        "coords_lng": lng,
+        "images": ad.get("images", []),
+        "params": ad.get("params", {}),
+        "params2": ad.get("params2", {}),
+        "processed": False,
+        "debug": {},
+    })
+    return row
+
+
+def _csv_field(column: str, value) -> str:
+    # NULL — пустое поле без кавычек, любые строки всегда в кавычках,
+    # поэтому пустая строка не превращается в NULL
+    if value is None:
+        return ""
+    if column in JSON_COLUMNS:
+        value = json.dumps(value, ensure_ascii=False)
+    elif isinstance(value, bool):
+        return "t" if value else "f"
+    elif isinstance(value, (int, float)):
+        return repr(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def ad_to_csv_line(ad: dict) -> str:
+    row = ad_to_row(ad)
+    return ",".join(_csv_field(c, row[c]) for c in ADS_COLUMNS) + "\n"
+
+
+def ads_to_csv(ads) -> io.StringIO:
+    """Сериализует пачку объявлений в CSV-буфер для COPY ... FROM STDIN."""
+    buf = io.StringIO()
+    for ad in ads:
+        buf.write(ad_to_csv_line(ad))
+    buf.seek(0)
+    return buf
+
+
+class CsvStream:
+    """
+    Файлоподобная обёртка над итератором объявлений для copy_expert:
+    строки CSV сериализуются по мере чтения, страница целиком в памяти не собирается.
+    """
+
+    def __init__(self, ads):
+        self._ads = iter(ads)
+        self._buf = ""
+        self.rows = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            ad = next(self._ads, None)
+            if ad is None:
+                break
+            self._buf += ad_to_csv_line(ad)
+            self.rows += 1
+        if size < 0:
+            size = len(self._buf)
+        chunk, self._buf = self._buf[:size], self._buf[size:]
+        return chunk
+
+
+def copy_ads_batch(cursor, ads) -> int:
+    """
+    Вставляет пачку объявлений за два запроса:
+    COPY во временную ads_stage и один INSERT ... SELECT ... ON CONFLICT (id) DO NOTHING.
+    Возвращает число реально вставленных строк.
+    """
+    if not ads:
+        return 0
+    cursor.execute(STAGE_DDL)
+    cursor.execute("TRUNCATE ads_stage;")
+    cursor.copy_expert(
+        f"COPY ads_stage ({_COLUMNS_SQL}) FROM STDIN WITH (FORMAT csv)",
+        ads_to_csv(ads),
+    )
+    cursor.execute(STAGE_INSERT_SQL)
+    return cursor.rowcount
+
+
+def copy_ads_stream(cursor, ads) -> int:
+    """
+    То же, что copy_ads_batch, но ads — любой итератор (например, потоковый
+    разбор ответа API): COPY читает объявления по мере их поступления.
+    """
+    cursor.execute(STAGE_DDL)
+    cursor.execute("TRUNCATE ads_stage;")
+    stream = CsvStream(ads)
+    cursor.copy_expert(f"COPY ads_stage ({_COLUMNS_SQL}) FROM STDIN WITH (FORMAT csv)", stream)
+    if not stream.rows:
+        return 0
+    cursor.execute(STAGE_INSERT_SQL)
+    return cursor.rowcount
+
+
+def insert_ads_rowwise(cursor, ads) -> int:
+    """
+    Прежний путь: один INSERT на объявление, с той же проверкой отпечатка, что у COPY.
+    Оставлен для сравнения в bench_insert.py.
+    """
+    inserted = 0
+    for ad in ads:
+        row = ad_to_row(ad)
+        for c in JSON_COLUMNS:
+            row[c] = Json(row[c])
+        cursor.execute(ROW_INSERT_SQL, row)
+        inserted += cursor.rowcount
+    return inserted
+
+
+def insert_ads_batch(cursor, ads) -> int:
+    """Вставляет пачку объявлений в БД через COPY."""
+    return copy_ads_batch(cursor, ads)
@@ -0,0 +1,120 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from psycopg2.pool import ThreadedConnectionPool
+
+from ads_api import iter_ads_pages, TIME_FORMAT
+
+# Параллельный бэкфилл: диапазон дней режется на независимые единицы (день, источник),
+# N единиц выгружаются одновременно под общим лимитером ads_api.limiter.
+# Прогресс каждой единицы хранится в backfill_checkpoints (db/migrations/003_backfill_checkpoints.sql),
+# поэтому прерванный бэкфилл продолжается ровно с места остановки.
+# Через .env задаются:
+# BACKFILL_WORKERS: число одновременно выгружаемых единиц (0 — старый последовательный режим)
+# BACKFILL_SOURCES: источники, на которые режется день
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "0"))
+BACKFILL_SOURCES = [s.strip() for s in os.getenv("BACKFILL_SOURCES", "1,2,3,4").split(",") if s.strip()]
+
+logger = logging.getLogger("ads_fetcher")
+
+
+def load_checkpoint(cursor, city, day, source):
+    cursor.execute(
+        """
+        INSERT INTO backfill_checkpoints (city, day, source)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (city, day, source) DO NOTHING;
+        SELECT next_start, done FROM backfill_checkpoints
+         WHERE city = %s AND day = %s AND source = %s;
+        """,
+        (city, day, source, city, day, source)
+    )
+    return cursor.fetchone()
+
+
+def save_checkpoint(cursor, city, day, source, next_start, loaded, done=False):
+    cursor.execute(
+        """
+        UPDATE backfill_checkpoints
+           SET next_start = %s, done = %s, ads_loaded = ads_loaded + %s, updated_at = now()
+         WHERE city = %s AND day = %s AND source = %s;
+        """,
+        (next_start, done, loaded, city, day, source)
+    )
+
+
+def run_unit(pool, insert_batch, city, day, source, after_commit=None) -> int:
+    """Выгружает один день одного источника, коммитя каждую страницу вместе с чекпоинтом."""
+    conn = pool.getconn()
+    try:
+        cursor = conn.cursor()
+        next_start, done = load_checkpoint(cursor, city, day, source)
+        conn.commit()
+        if done:
+            return 0
+
+        day_start = datetime.combine(day, datetime.min.time())
+        day_end = day_start + timedelta(days=1)
+        date1 = (next_start or day_start).strftime(TIME_FORMAT)
+        total = 0
+        for batch in iter_ads_pages(date1, day_end.strftime(TIME_FORMAT), city=city, source=source):
+            insert_batch(cursor, batch)
+            # Последняя секунда перезапрашивается при возобновлении: повторы отсечёт ON CONFLICT (id)
+            last_time = datetime.fromisoformat(batch[-1]["time"])
+            save_checkpoint(cursor, city, day, source, last_time, len(batch))
+            conn.commit()
+            if after_commit:
+                after_commit(batch)
+            total += len(batch)
+
+        # Текущий день ещё пополняется — не помечаем его выгруженным
+        if day_end <= datetime.now():
+            save_checkpoint(cursor, city, day, source, day_end, 0, done=True)
+            conn.commit()
+        cursor.close()
+        return total
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def run_backfill(dsn, days, insert_batch, city="Москва", sources=None, workers=BACKFILL_WORKERS,
+                 after_commit=None) -> int:
+    """
+    Выгружает дни days по единицам (день, источник) в workers потоков.
+    insert_batch(cursor, ads) — функция вставки страницы (без commit),
+    after_commit(ads) — необязательный вызов после commit страницы.
+    Возвращает число загруженных объявлений.
+    """
+    sources = sources or BACKFILL_SOURCES
+    workers = max(1, workers)
+    units = [(day, source) for day in days for source in sources]
+    logger.info(f"Backfill: {len(days)} days × {len(sources)} sources = {len(units)} units, {workers} workers")
+
+    pool = ThreadedConnectionPool(1, workers, dsn)
+    total = 0
+    failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(run_unit, pool, insert_batch, city, day, source, after_commit): (day, source)
+                for day, source in units
+            }
+            for future in as_completed(futures):
+                day, source = futures[future]
+                try:
+                    loaded = future.result()
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"Backfill unit {day} source={source} failed: {e}")
+                    continue
+                total += loaded
+                logger.info(f"Backfill unit {day} source={source}: {loaded} ads")
+    finally:
+        pool.closeall()
+
+    logger.info(f"Backfill done: {total} ads, {failed} failed units (will resume on next run)")
+    return total
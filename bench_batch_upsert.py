@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import psycopg2
+from dotenv import load_dotenv
+
+# Стоимость batch_upsert на одну пачку в зависимости от размера flats_history.
+# История заполняется синтетикой в схеме bench_upsert (копии flats, flats_history,
+# flats_changes и ads со всеми индексами и content_hash), search_path направляет
+# туда batch_upsert; в конце всё откатывается. Копия flats_changes — обычная таблица
+# (LIKE не переносит секционирование), и проверка секций в batch_upsert её пропускает.
+# Для каждого размера истории пачка на BATCH строк (половина — изменившиеся
+# объявления, половина — новые) прогоняется REPEAT раз; отдельно замеряется прежний
+# выбор снимков через old_data (полный проход по flats_history).
+# Использование: python bench_batch_upsert.py [HISTORY_ROWS,...] [BATCH] [REPEAT]
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+SETUP_SQL = """
+CREATE SCHEMA bench_upsert;
+CREATE TABLE bench_upsert.flats (LIKE public.flats INCLUDING ALL);
+CREATE TABLE bench_upsert.flats_history (LIKE public.flats_history INCLUDING ALL);
+-- LIKE не переносит триггеры, а content_hash поддерживается триггером
+CREATE TRIGGER flats_history_content_hash
+  BEFORE INSERT OR UPDATE OF price, is_actual, description ON bench_upsert.flats_history
+  FOR EACH ROW EXECUTE FUNCTION public.flats_history_content_hash();
+CREATE TABLE bench_upsert.flats_changes (LIKE public.flats_changes INCLUDING ALL);
+CREATE TABLE bench_upsert.ads (LIKE public.ads INCLUDING ALL);
+CREATE TEMP TABLE tmp_flats_history (LIKE public.tmp_flats_history INCLUDING ALL);
+SET LOCAL search_path = bench_upsert, public;
+"""
+FILL_SQL = """
+INSERT INTO flats_history (
+  house_id, floor, rooms, source_id, object_type_id, ad_type,
+  url, person_type_id, price, time_source_created, time_source_updated,
+  avitoid, is_actual, description
+)
+SELECT 1, g %% 25 + 1, g %% 4 + 1, 1, 1, 1,
+       'https://example.org/' || g, 1, 5000000 + g %% 100000, now()::date, now() - interval '1 day',
+       g, 1, repeat('описание ', 40) || g
+  FROM generate_series(%s, %s) g;
+"""
+BATCH_SQL = """
+TRUNCATE tmp_flats_history;
+INSERT INTO tmp_flats_history (
+  house_id, floor, rooms, town, source_id, object_type_id, nedvigimost_type_id,
+  url, person_type_id, price, time_source_created, time_source_updated,
+  avitoid, is_actual, description
+)
+SELECT 1, g %% 25 + 1, g %% 4 + 1, 1, 1, 1, 1,
+       'https://example.org/' || g, 1, 6000000 + %(run)s, now()::date, now() + %(run)s * interval '1 second',
+       g, 1, repeat('описание ', 40) || g
+  FROM generate_series(%(history)s - %(batch)s / 2 + 1, %(history)s + %(batch)s / 2) g;
+"""
+LEGACY_SNAPSHOT_SQL = """
+WITH old_data AS (
+  SELECT avitoid, source_id, price AS old_price, is_actual AS old_status, description AS old_desc
+    FROM flats_history
+)
+SELECT count(*)
+  FROM tmp_flats_history tmp
+  LEFT JOIN old_data od ON od.avitoid = tmp.avitoid AND od.source_id = tmp.source_id
+ WHERE od.avitoid IS NULL
+    OR od.old_price IS DISTINCT FROM tmp.price
+    OR od.old_status IS DISTINCT FROM tmp.is_actual
+    OR od.old_desc IS DISTINCT FROM tmp.description;
+"""
+
+
+def timed(cur, sql, params=None):
+    started = time.perf_counter()
+    cur.execute(sql, params)
+    return time.perf_counter() - started
+
+
+def main():
+    sizes = [int(s) for s in sys.argv[1].split(",")] if len(sys.argv) > 1 else [1_000_000, 10_000_000]
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    conn = psycopg2.connect(DATABASE_URL)
+    cur = conn.cursor()
+    cur.execute(SETUP_SQL)
+    filled, run = 0, 0
+    try:
+        for history in sorted(sizes):
+            # История дорастает до следующего размера; пачки откатываются к точке сохранения
+            t_fill = timed(cur, FILL_SQL, (filled + 1, history))
+            filled = history
+            cur.execute("ANALYZE flats_history;")
+            print(f"History: {history} rows (filled in {t_fill:.1f}s), batch: {batch}", flush=True)
+
+            upsert, legacy = [], []
+            for _ in range(repeat):
+                run += 1
+                cur.execute("SAVEPOINT bench_batch;")
+                cur.execute(BATCH_SQL, {"run": run, "history": history, "batch": batch})
+                cur.execute("ANALYZE tmp_flats_history;")
+                legacy.append(timed(cur, LEGACY_SNAPSHOT_SQL))
+                upsert.append(timed(cur, "CALL batch_upsert();"))
+                cur.execute("ROLLBACK TO SAVEPOINT bench_batch;")
+            print(f"  batch_upsert         best={min(upsert) * 1000:.0f}ms ({batch / min(upsert):.0f} rows/s)", flush=True)
+            print(f"  old_data snapshot    best={min(legacy) * 1000:.0f}ms (selection only, before)", flush=True)
+    finally:
+        conn.rollback()
+        cur.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import copy
+import json
+import time
+import psycopg2
+from dotenv import load_dotenv
+
+from ads_writer import copy_ads_batch, insert_ads_rowwise
+
+# Сравнение построчной вставки и COPY на фикстурах sell.json/sdam.json.
+# Использование: python bench_insert.py [ROWS] [REPEAT]
+# Всё выполняется в транзакции, которая откатывается — таблица ads не меняется.
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL")
+FIXTURES = ["sell.json", "sdam.json"]
+ID_OFFSET = 2_000_000_000
+
+
+def load_fixture_ads(rows: int):
+    base = []
+    for name in FIXTURES:
+        with open(name, encoding="utf-8") as f:
+            base.extend(json.load(f).get("data", []))
+    # Размножаем фикстуры до нужного размера страницы, ids делаем уникальными
+    ads = []
+    for i in range(rows):
+        ad = copy.deepcopy(base[i % len(base)])
+        ad["id"] = ID_OFFSET + i
+        ads.append(ad)
+    return ads
+
+
+def run(conn, writer, ads):
+    cur = conn.cursor()
+    started = time.perf_counter()
+    inserted = writer(cur, copy.deepcopy(ads))
+    elapsed = time.perf_counter() - started
+    conn.rollback()
+    cur.close()
+    return inserted, elapsed
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    ads = load_fixture_ads(rows)
+
+    conn = psycopg2.connect(DATABASE_URL)
+    print(f"Page size: {rows} ads, repeat: {repeat}", flush=True)
+    results = {}
+    for name, writer in (("row-by-row", insert_ads_rowwise), ("copy", copy_ads_batch)):
+        timings = []
+        for _ in range(repeat):
+            inserted, elapsed = run(conn, writer, ads)
+            timings.append(elapsed)
+        best = min(timings)
+        results[name] = best
+        print(f"  {name:<11} inserted={inserted} best={best:.3f}s ({rows / best:.0f} rows/s)", flush=True)
+    conn.close()
+
+    print(f"Speedup: x{results['row-by-row'] / results['copy']:.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
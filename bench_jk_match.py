@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+import time
+import psycopg2
+from dotenv import load_dotenv
+
+from complex_matcher import ComplexMatcher
+from process import clean_jk_name
+
+# Задержка поиска ЖК на одно объявление: прежний find_complex_id_legacy,
+# триграммный find_complex_id (db/migrations/005_complexes_trgm.sql) и ComplexMatcher в памяти.
+# Названия ЖК берутся из ads и фикстур.
+# Использование: python bench_jk_match.py [NAMES]
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL")
+FIXTURES = ["sell.json", "sdam.json"]
+
+
+def load_jk_names(cur, limit):
+    cur.execute(
+        "SELECT params->>'Название ЖК' FROM ads WHERE params->>'Название ЖК' <> '' LIMIT %s;", (limit,)
+    )
+    names = [r[0] for r in cur.fetchall()]
+    for name in FIXTURES:
+        with open(name, encoding="utf-8") as f:
+            names.extend(ad["params"]["Название ЖК"] for ad in json.load(f).get("data", [])
+                         if (ad.get("params") or {}).get("Название ЖК"))
+    return [clean_jk_name({"Название ЖК": n}) for n in names[:limit]]
+
+
+def time_sql(cur, function, names):
+    results, started = [], time.perf_counter()
+    for name in names:
+        cur.execute(f"SELECT public.{function}(%s);", (name,))
+        results.append(cur.fetchone()[0])
+    return results, time.perf_counter() - started
+
+
+def main():
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    conn = psycopg2.connect(DATABASE_URL)
+    cur = conn.cursor()
+    names = load_jk_names(cur, limit)
+    if not names:
+        sys.exit("No ЖК names in ads or fixtures")
+    print(f"ЖК names: {len(names)} ({len(set(names))} distinct)", flush=True)
+
+    legacy, t_legacy = time_sql(cur, "find_complex_id_legacy", names)
+    trgm, t_trgm = time_sql(cur, "find_complex_id", names)
+
+    started = time.perf_counter()
+    matcher = ComplexMatcher.load(cur)
+    t_load = time.perf_counter() - started
+    started = time.perf_counter()
+    in_memory = [matcher.match(n) for n in names]
+    t_memory = time.perf_counter() - started
+    conn.rollback()
+    cur.close()
+    conn.close()
+
+    n = len(names)
+    for label, elapsed, results in (("legacy SQL", t_legacy, legacy), ("trigram SQL", t_trgm, trgm),
+                                    ("in-memory", t_memory, in_memory)):
+        found = sum(r is not None for r in results)
+        agree = sum(a == b for a, b in zip(results, legacy))
+        print(f"  {label:<12} {elapsed / n * 1000:8.3f} ms/ad  found={found}/{n}  same as legacy={agree}/{n}",
+              flush=True)
+    print(f"  (in-memory index load: {t_load:.2f}s)", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import time
+import psycopg2
+from dotenv import load_dotenv
+
+# Сравнение построчного parse_address (LATERAL на каждый адрес) и пакетного
+# parse_address_batch на корпусе адресов: сначала адреса из ads, затем из фикстур;
+# номера домов варьируются, чтобы корпус не схлопывался в горстку уникальных строк.
+# Использование: python bench_parse_address.py [ROWS] [REPEAT]
+# Корпус живёт во временной таблице, результаты обеих функций сверяются.
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL")
+FIXTURES = ["sell.json", "sdam.json", "buy.json"]
+
+ROWWISE_SQL = """
+SELECT c.address, pa.street_type, pa.norm_name, pa.house_part
+  FROM bench_addresses c
+  CROSS JOIN LATERAL public.parse_address(c.address) pa
+"""
+BATCH_SQL = """
+SELECT c.address, pa.street_type, pa.norm_name, pa.house_part
+  FROM bench_addresses c
+  JOIN public.parse_address_batch(ARRAY(SELECT address FROM bench_addresses)) pa ON pa.address = c.address
+"""
+
+
+def load_base_addresses(cur):
+    cur.execute("SELECT DISTINCT address FROM ads WHERE address IS NOT NULL LIMIT 20000;")
+    base = [r[0] for r in cur.fetchall()]
+    for name in FIXTURES:
+        with open(name, encoding="utf-8") as f:
+            base.extend(ad["address"] for ad in json.load(f).get("data", []) if ad.get("address"))
+    return base
+
+
+def build_corpus(base, rows):
+    corpus = []
+    for i in range(rows):
+        segments = base[i % len(base)].split(",")
+        if len(segments) > 1:
+            segments[1] = f" {i % 150 + 1}к{i % 4 + 1}"
+        corpus.append(",".join(segments))
+    return corpus
+
+
+def run(cur, sql, repeat):
+    timings, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cur.execute(sql)
+        result = cur.fetchall()
+        timings.append(time.perf_counter() - started)
+    return sorted(result), min(timings)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    conn = psycopg2.connect(DATABASE_URL)
+    cur = conn.cursor()
+    corpus = build_corpus(load_base_addresses(cur), rows)
+    cur.execute("CREATE TEMP TABLE bench_addresses (address text) ON COMMIT DROP;")
+    cur.execute("INSERT INTO bench_addresses SELECT unnest(%s::text[]);", (corpus,))
+    print(f"Corpus: {rows} addresses ({len(set(corpus))} distinct), repeat: {repeat}", flush=True)
+
+    rowwise, t_row = run(cur, ROWWISE_SQL, repeat)
+    print(f"  parse_address       parsed={len(rowwise)} best={t_row:.2f}s ({rows / t_row:.0f} addr/s)", flush=True)
+    batch, t_batch = run(cur, BATCH_SQL, repeat)
+    print(f"  parse_address_batch parsed={len(batch)} best={t_batch:.2f}s ({rows / t_batch:.0f} addr/s)", flush=True)
+
+    mismatches = len(set(rowwise) ^ set(batch))
+    print(f"Speedup: x{t_row / t_batch:.1f}, mismatching results: {mismatches}", flush=True)
+    conn.rollback()
+    cur.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
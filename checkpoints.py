@@ -0,0 +1,113 @@
+from datetime import datetime
+from psycopg2.extras import execute_values
+
+# Чекпоинты загрузки (таблица ingest_checkpoints, db/migrations/002_ingest_checkpoints.sql).
+# Ключ — (город, source_id, nedvigimost_type_id) из самих объявлений.
+# last_time/first_time сдвигаются через GREATEST/LEAST, поэтому страницы должны
+# приходить по порядку времени: так пишут последовательные режимы (обычный цикл,
+# --pipeline, --stream, обратный обход main.py). Режимы, где дни выгружаются
+# вразнобой (бэкфилл, --async), по страницам чекпоинты не двигают: бэкфилл хранит
+# прогресс в backfill_checkpoints, --async сдвигает их один раз после того,
+# как весь период выгружен без ошибок (merge_checkpoint_rows).
+
+
+def _source_ids(source):
+    """'1,2,3,4' → [1, 2, 3, 4]."""
+    return [int(s) for s in str(source).split(",") if s.strip()]
+
+
+UPSERT_SQL = """
+INSERT INTO ingest_checkpoints AS cp (
+  city, source_id, ad_type, last_time, first_time, first_day_last_time
+) VALUES {values}
+ON CONFLICT (city, source_id, ad_type) DO UPDATE SET
+  last_time  = GREATEST(cp.last_time, EXCLUDED.last_time),
+  first_time = LEAST(cp.first_time, EXCLUDED.first_time),
+  first_day_last_time = CASE
+    WHEN EXCLUDED.first_time::date < cp.first_time::date THEN EXCLUDED.first_day_last_time
+    WHEN EXCLUDED.first_time::date = cp.first_time::date
+      THEN GREATEST(cp.first_day_last_time, EXCLUDED.first_day_last_time)
+    ELSE cp.first_day_last_time
+  END,
+  updated_at = now();
+"""
+
+
+def checkpoint_rows(city, ads):
+    """Строки для UPSERT_SQL: по одной на (source_id, nedvigimost_type_id) страницы."""
+    groups = {}
+    for ad in ads:
+        key = (ad.get("source_id"), ad.get("nedvigimost_type_id"))
+        if None in key:
+            continue
+        groups.setdefault(key, []).append(datetime.fromisoformat(ad["time"]))
+
+    rows = []
+    for (source_id, ad_type), times in groups.items():
+        first = min(times)
+        first_day_last = max(t for t in times if t.date() == first.date())
+        rows.append((city, source_id, ad_type, max(times), first, first_day_last))
+    return rows
+
+
+def merge_checkpoint_rows(rows):
+    """Сводит строки checkpoint_rows нескольких страниц в одну на ключ (для одного UPSERT)."""
+    merged = {}
+    for city, source_id, ad_type, last, first, first_day_last in rows:
+        key = (city, source_id, ad_type)
+        if key not in merged:
+            merged[key] = [last, first, first_day_last]
+            continue
+        cur = merged[key]
+        if first.date() < cur[1].date():
+            cur[2] = first_day_last
+        elif first.date() == cur[1].date():
+            cur[2] = max(cur[2], first_day_last)
+        cur[0] = max(cur[0], last)
+        cur[1] = min(cur[1], first)
+    return [(*key, *values) for key, values in merged.items()]
+
+
+def advance_checkpoints(cursor, city, ads):
+    """
+    Сдвигает чекпоинты по загруженной странице. Вызывать до commit страницы,
+    чтобы чекпоинт и вставка попали в одну транзакцию.
+    """
+    rows = checkpoint_rows(city, ads)
+    if rows:
+        execute_values(cursor, UPSERT_SQL.format(values="%s"), rows)
+
+
+def resume_time(cursor, city, source, ad_type=1):
+    """
+    Откуда продолжать прямой обход: самое раннее из last_time по источникам запроса
+    (отстающий источник не теряет объявления). None — чекпоинтов ещё нет.
+    """
+    cursor.execute(
+        """
+        SELECT MIN(last_time) FROM ingest_checkpoints
+         WHERE city = %s AND source_id = ANY(%s) AND ad_type = %s;
+        """,
+        (city, _source_ids(source), ad_type)
+    )
+    return cursor.fetchone()[0]
+
+
+def resume_oldest(cursor, city, source, ad_type=1):
+    """
+    Откуда продолжать обратный обход: (самый ранний день, докуда он загружен).
+    None — чекпоинтов ещё нет.
+    """
+    cursor.execute(
+        """
+        SELECT first_time::date, MIN(first_day_last_time) FROM ingest_checkpoints
+         WHERE city = %s AND source_id = ANY(%s) AND ad_type = %s
+           AND first_time::date = (
+             SELECT MIN(first_time)::date FROM ingest_checkpoints
+              WHERE city = %s AND source_id = ANY(%s) AND ad_type = %s
+           )
+         GROUP BY first_time::date;
+        """,
+        (city, _source_ids(source), ad_type, city, _source_ids(source), ad_type)
+    )
+    return cursor.fetchone()
@@ -0,0 +1,50 @@
+import os
+import socket
+from dotenv import load_dotenv
+
+# Захват объявлений из очереди processed IS FALSE (db/migrations/010_ad_claims.sql) для Python-обработчиков.
+# Через .env задаются:
+#   CLAIM_LEASE — срок аренды захваченной пачки ('10 minutes'); после него пачка упавшего
+#                 обработчика снова достаётся другим, поэтому он должен быть больше
+#                 времени обработки одной пачки
+load_dotenv()
+CLAIM_LEASE = os.getenv("CLAIM_LEASE", "10 minutes")
+
+CLAIM_SQL = "SELECT id FROM public.claim_ads(%s, %s, %s::interval) AS id ORDER BY id;"
+
+
+def worker_name(prefix):
+    """
+    Имя обработчика для claimed_by: видно, кто и откуда держит строки. Его же нужно
+    передать в application_name соединения — по нему retention.py отличает живых
+    обработчиков от аренды, оставшейся после упавших.
+    """
+    # application_name сервер обрезает до 63 байт — claimed_by должен совпадать с ним
+    return f"{prefix}:{os.getpid()}:{socket.gethostname()}"[:63]
+
+
+def claim_ads(conn, worker, limit, lease=CLAIM_LEASE):
+    """
+    Захватывает до limit объявлений и сразу коммитит захват: пока он не закоммичен,
+    аренду не видят другие сессии. Возвращает id захваченных строк по возрастанию.
+    """
+    with conn.cursor() as cur:
+        cur.execute(CLAIM_SQL, (worker, limit, lease))
+        ids = [r[0] for r in cur.fetchall()]
+    conn.commit()
+    return ids
+
+
+def call_procedure(cursor, sql):
+    """
+    CALL процедуры с COMMIT внутри (process_all_ads, process_ads_batch): такой вызов
+    допустим только вне транзакции, а psycopg2 открывает её неявно — поэтому на время
+    вызова соединение переводится в autocommit.
+    """
+    conn = cursor.connection
+    conn.commit()
+    conn.autocommit = True
+    try:
+        cursor.execute(sql)
+    finally:
+        conn.autocommit = False
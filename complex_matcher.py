@@ -0,0 +1,116 @@
+import re
+import unicodedata
+
+# Поиск ЖК в памяти для Python-процессора (process.py): та же нормализация
+# и тот же порядок ранжирования, что у find_complex_id (db/migrations/005_complexes_trgm.sql),
+# без транслитерации запроса и с упрощённым word_similarity.
+# Триграммы строятся как в pg_trgm (слова с отступами '  слово '), кандидаты
+# берутся из инвертированного индекса триграмма → ЖК, поэтому сравнение идёт
+# только с ЖК, у которых есть общие триграммы с запросом.
+
+SIMILARITY_THRESHOLD = 0.4
+WORD_SIMILARITY_THRESHOLD = 0.6
+
+_DESCRIPTIVE = re.compile(r"(?:^| )(?:апарт ?комплекс|жилой ?комплекс|жилой дом|комплекс апартаментов|жк)(?= |$)")
+_NON_ALNUM = re.compile(r"[\W_]+")
+_CORP_PREFIX = re.compile(r"^\s*(корпус|корп(?:\.|ус)?|к\.?|стр\.|з/у)\s*", re.IGNORECASE)
+
+
+def normalize_title(title) -> str:
+    """Как normalize_complex_title в SQL: unaccent, нижний регистр, без пунктуации и слов «ЖК»."""
+    text = unicodedata.normalize("NFKD", (title or "").lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).replace("ё", "е")
+    text = _NON_ALNUM.sub(" ", text)
+    text = _DESCRIPTIVE.sub(" ", text)
+    return " ".join(text.split())
+
+
+def trigrams(text) -> frozenset:
+    result = set()
+    for word in text.split():
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(result)
+
+
+def similarity(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def word_similarity(query: frozenset, target: frozenset) -> float:
+    """Доля триграмм запроса, найденных в названии (упрощённый word_similarity pg_trgm)."""
+    if not query:
+        return 0.0
+    return len(query & target) / len(query)
+
+
+class ComplexMatcher:
+    """Индекс ЖК: точные нормализованные названия и триграммы всех вариантов названия."""
+
+    def __init__(self, rows):
+        self.exact = {}
+        self.names = {}
+        self.index = {}
+        for complex_id, *titles in rows:
+            variants = [(n, trigrams(n)) for n in {normalize_title(t) for t in titles if t} if n]
+            self.names[complex_id] = variants
+            for name, trgm in variants:
+                if name not in self.exact or complex_id < self.exact[name]:
+                    self.exact[name] = complex_id
+                for t in trgm:
+                    self.index.setdefault(t, set()).add(complex_id)
+
+    @classmethod
+    def load(cls, cur):
+        cur.execute("SELECT id, title, title_cian, title_lat FROM complexes;")
+        return cls(cur.fetchall())
+
+    def match(self, jk_name):
+        """id ЖК по названию из объявления или None."""
+        query = normalize_title(jk_name)
+        if not query:
+            return None
+        if query in self.exact:
+            return self.exact[query]
+
+        query_trgm = trigrams(query)
+        candidates = set()
+        for t in query_trgm:
+            candidates |= self.index.get(t, set())
+
+        best, best_rank = None, None
+        for complex_id in candidates:
+            variants = self.names[complex_id]
+            contains = any(query in name for name, _ in variants)
+            sim = max(similarity(trgm, query_trgm) for _, trgm in variants)
+            wsim = max(word_similarity(query_trgm, trgm) for _, trgm in variants)
+            if not (contains or sim >= SIMILARITY_THRESHOLD or wsim >= WORD_SIMILARITY_THRESHOLD):
+                continue
+            rank = (contains, max(sim, wsim), -complex_id)
+            if best_rank is None or rank > best_rank:
+                best, best_rank = complex_id, rank
+        return best
+
+
+def load_complex_houses(cur):
+    """co_id → [(corp, house_id)] из complex_houses."""
+    cur.execute("SELECT co_id, corp, id FROM complex_houses;")
+    houses = {}
+    for co_id, corp, house_id in cur.fetchall():
+        houses.setdefault(co_id, []).append(((corp or "").lower(), house_id))
+    return houses
+
+
+def find_complex_house(houses, complex_id, full_address):
+    """Корпус ЖК по последней части адреса, как шаг 7 get_house_id_by_jk."""
+    corp = _CORP_PREFIX.sub("", (full_address or "").split(",")[-1], count=1).strip().lower()
+    candidates = houses.get(complex_id, [])
+    for house_corp, house_id in candidates:
+        if house_corp == corp:
+            return house_id
+    for house_corp, house_id in candidates:
+        if house_corp.startswith("без к"):
+            return house_id
+    return None
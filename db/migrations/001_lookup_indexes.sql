@@ -0,0 +1,12 @@
+-- Индексы под соединения обогащения в process_all_ads / process_ads_batch
+-- (поиск улиц — 006_fias_objects_trgm.sql). Очередь необработанных объявлений уже покрыта
+-- частичным ads_pending_claim_idx (db/migrations/010_ad_claims.sql).
+-- Применяется: python migrate.py; проверка планов: python migrate.py --check-plans
+
+-- LEFT JOIN lookup_types ON category = ... AND lower(name) = lower(a.params->>'Тип дома' / 'Вид объекта')
+CREATE INDEX IF NOT EXISTS lookup_types_category_lower_name_idx
+  ON public.lookup_types (category, lower(name));
+
+-- LEFT JOIN districts ON lower(admin_okrug) = lower(a.district_only)
+CREATE INDEX IF NOT EXISTS districts_lower_admin_okrug_idx
+  ON public.districts (lower(admin_okrug));
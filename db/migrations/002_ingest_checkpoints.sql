@@ -0,0 +1,17 @@
+-- Точки продолжения загрузки вместо MIN/MAX(time) по ads и flats_history.
+-- Одна строка на (город, источник, тип объявления); обновляется в той же транзакции,
+-- что и вставка страницы в ads (checkpoints.py), поэтому не зависит от очистки ads.
+--   last_time           — самое позднее загруженное время (прямой обход: ads_godays, ads_from_maxdate)
+--   first_time          — самое раннее загруженное время (обратный обход: main.py)
+--   first_day_last_time — докуда загружен день first_time
+
+CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+  city                TEXT      NOT NULL,
+  source_id           SMALLINT  NOT NULL,
+  ad_type             SMALLINT  NOT NULL,
+  last_time           TIMESTAMP NOT NULL,
+  first_time          TIMESTAMP NOT NULL,
+  first_day_last_time TIMESTAMP NOT NULL,
+  updated_at          TIMESTAMP NOT NULL DEFAULT now(),
+  PRIMARY KEY (city, source_id, ad_type)
+);
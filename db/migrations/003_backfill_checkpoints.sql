@@ -0,0 +1,15 @@
+-- Чекпоинты параллельного бэкфилла (backfill.py).
+-- Одна строка на единицу работы (город, день, источник):
+-- next_start — откуда продолжать выгрузку дня, done — день выгружен полностью.
+-- Строка обновляется в той же транзакции, что и вставка страницы в ads.
+
+CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+  city        TEXT        NOT NULL,
+  day         DATE        NOT NULL,
+  source      TEXT        NOT NULL,
+  next_start  TIMESTAMP,
+  done        BOOLEAN     NOT NULL DEFAULT FALSE,
+  ads_loaded  INTEGER     NOT NULL DEFAULT 0,
+  updated_at  TIMESTAMP   NOT NULL DEFAULT now(),
+  PRIMARY KEY (city, day, source)
+);
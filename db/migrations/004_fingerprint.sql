@@ -0,0 +1,71 @@
+-- Отпечаток содержимого объявления: те же поля, по которым batch_upsert решает,
+-- писать ли снимок в flats_changes (price, is_actual, description).
+-- flats_history.content_hash поддерживается самой БД (триггер на вставку и изменение
+-- полей), индекс по (avitoid, source_id) с content_hash позволяет при вставке страницы
+-- (ads_writer.STAGE_INSERT_SQL) отбросить неизменившиеся объявления index-only проверкой,
+-- не пропуская их через ads → tmp_enriched → геокодирование → upsert.
+--
+-- Без перезаписи таблицы: обычная колонка добавляется мгновенно (ADD COLUMN GENERATED
+-- STORED переписал бы всю flats_history под ACCESS EXCLUSIVE), а старые строки
+-- заполняются порциями — backfill_content_hash() из retention.py. Пока заполнение не
+-- закончено, строки с content_hash IS NULL сравниваются по самим полям через частичный
+-- flats_history_content_hash_pending_idx; после него этот индекс пуст.
+-- CREATE INDEX ниже на всё время сборки блокирует запись в flats_history: на большой
+-- таблице создайте оба индекса заранее через CREATE INDEX CONCURRENTLY с теми же
+-- именами — миграция их пропустит.
+
+CREATE OR REPLACE FUNCTION public.ad_fingerprint(p_price numeric, p_is_actual text, p_description text)
+ RETURNS bigint
+ LANGUAGE sql
+ IMMUTABLE PARALLEL SAFE
+AS $function$
+  -- trim_scale: 5000000 и 5000000.00 дают один отпечаток
+  SELECT hashtextextended(
+    concat_ws(E'\x1f', coalesce(trim_scale(p_price)::text, ''), coalesce(p_is_actual, ''), coalesce(p_description, '')),
+    0
+  );
+$function$;
+
+ALTER TABLE flats_history ADD COLUMN IF NOT EXISTS content_hash bigint;
+
+CREATE OR REPLACE FUNCTION public.flats_history_content_hash()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+  NEW.content_hash := public.ad_fingerprint(NEW.price, NEW.is_actual::text, NEW.description);
+  RETURN NEW;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS flats_history_content_hash ON flats_history;
+CREATE TRIGGER flats_history_content_hash
+  BEFORE INSERT OR UPDATE OF price, is_actual, description ON flats_history
+  FOR EACH ROW EXECUTE FUNCTION public.flats_history_content_hash();
+
+CREATE INDEX IF NOT EXISTS flats_history_fingerprint_idx
+  ON flats_history (avitoid, source_id) INCLUDE (content_hash);
+CREATE INDEX IF NOT EXISTS flats_history_content_hash_pending_idx
+  ON flats_history (avitoid, source_id) WHERE content_hash IS NULL;
+
+-- Заполняет content_hash у не более чем p_limit старых строк; возвращает их число
+CREATE OR REPLACE FUNCTION public.backfill_content_hash(p_limit integer DEFAULT 10000)
+ RETURNS integer
+ LANGUAGE sql
+AS $function$
+  WITH batch AS (
+    SELECT id
+      FROM flats_history
+     WHERE content_hash IS NULL
+     LIMIT p_limit
+       FOR UPDATE SKIP LOCKED
+  ),
+  filled AS (
+    UPDATE flats_history fh
+       SET content_hash = public.ad_fingerprint(fh.price, fh.is_actual::text, fh.description)
+      FROM batch b
+     WHERE fh.id = b.id
+    RETURNING 1
+  )
+  SELECT count(*)::integer FROM filled;
+$function$;
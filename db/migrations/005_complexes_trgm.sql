@@ -0,0 +1,81 @@
+-- Поиск ЖК по триграммам вместо последовательных ILIKE/similarity по complexes.
+-- Названия нормализуются один раз (generated columns *_norm), по ним строятся
+-- GIN-индексы pg_trgm, и find_complex_id выбирает ЖК одним ранжированным запросом:
+--   1) точное совпадение нормализованного названия;
+--   2) запрос целиком входит в название;
+--   3) наибольшая триграммная похожесть (similarity / word_similarity) не ниже порогов.
+-- Та же нормализация и ранжирование — в complex_matcher.py для Python-процессора.
+-- Сравнение с прежним поиском: python bench_jk_match.py
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() не IMMUTABLE из-за выбора словаря по search_path — фиксируем словарь
+CREATE OR REPLACE FUNCTION public.immutable_unaccent(p_value text)
+ RETURNS text
+ LANGUAGE sql
+ IMMUTABLE PARALLEL SAFE STRICT
+AS $function$
+  SELECT public.unaccent('public.unaccent'::regdictionary, p_value);
+$function$;
+
+CREATE OR REPLACE FUNCTION public.normalize_complex_title(p_title text)
+ RETURNS text
+ LANGUAGE sql
+ IMMUTABLE PARALLEL SAFE
+AS $function$
+  SELECT btrim(regexp_replace(
+    regexp_replace(
+      regexp_replace(replace(lower(public.immutable_unaccent(coalesce(p_title, ''))), 'ё', 'е'),
+                     '[^[:alnum:]]+', ' ', 'g'),
+      '(^| )(апарт ?комплекс|жилой ?комплекс|жилой дом|комплекс апартаментов|жк)(?= |$)', ' ', 'g'),
+    ' +', ' ', 'g'));
+$function$;
+
+ALTER TABLE complexes
+  ADD COLUMN IF NOT EXISTS title_norm text
+    GENERATED ALWAYS AS (public.normalize_complex_title(title)) STORED,
+  ADD COLUMN IF NOT EXISTS title_cian_norm text
+    GENERATED ALWAYS AS (public.normalize_complex_title(title_cian)) STORED,
+  ADD COLUMN IF NOT EXISTS title_lat_norm text
+    GENERATED ALWAYS AS (public.normalize_complex_title(title_lat)) STORED;
+
+CREATE INDEX IF NOT EXISTS complexes_title_norm_trgm ON complexes USING gin (title_norm gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS complexes_title_cian_norm_trgm ON complexes USING gin (title_cian_norm gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS complexes_title_lat_norm_trgm ON complexes USING gin (title_lat_norm gin_trgm_ops);
+
+
+-- DROP FUNCTION public.find_complex_id(text);
+
+CREATE OR REPLACE FUNCTION public.find_complex_id(p_jk_name text)
+ RETURNS smallint
+ LANGUAGE sql
+ STABLE
+ SET pg_trgm.similarity_threshold = 0.4
+ SET pg_trgm.word_similarity_threshold = 0.6
+AS $function$
+  WITH q AS (
+    SELECT public.normalize_complex_title(p_jk_name) AS n,
+           public.normalize_complex_title(system.transliterate_to_ascii(p_jk_name)) AS n_ascii
+  )
+  SELECT c.id
+    FROM complexes c, q
+   WHERE q.n <> ''
+     AND (   c.title_norm % q.n
+          OR c.title_cian_norm % q.n
+          OR c.title_lat_norm % q.n
+          OR c.title_lat_norm % q.n_ascii
+          OR q.n <% c.title_norm
+          OR c.title_norm LIKE '%' || q.n || '%')
+   ORDER BY
+     (c.title_norm = q.n OR c.title_cian_norm = q.n OR c.title_lat_norm IN (q.n, q.n_ascii)) DESC,
+     (c.title_norm LIKE '%' || q.n || '%') DESC,
+     greatest(similarity(c.title_norm, q.n),
+              similarity(c.title_cian_norm, q.n),
+              similarity(c.title_lat_norm, q.n),
+              similarity(c.title_lat_norm, q.n_ascii),
+              word_similarity(q.n, c.title_norm)) DESC,
+     c.id
+   LIMIT 1;
+$function$
+;
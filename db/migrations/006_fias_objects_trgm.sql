@@ -0,0 +1,7 @@
+-- Поиск улиц в find_parentobjids_by_parsed: каждое слово названия проверяется как
+-- lower(f.norm_name) LIKE '%слово%' (вместе с f.typename = ...). Префиксный
+-- text_pattern_ops такой LIKE не берёт, триграммный GIN — берёт (pg_trgm — 005).
+-- Проверка плана: python migrate.py --check-plans
+
+CREATE INDEX IF NOT EXISTS fias_objects_lower_norm_name_trgm_idx
+  ON public.fias_objects USING gin (lower(norm_name) gin_trgm_ops);
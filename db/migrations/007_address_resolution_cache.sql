@@ -0,0 +1,182 @@
+-- Кэш геокодирования: (адрес, название ЖК) → house_id или причина неудачи.
+-- Ключи нормализуются (обрезка и схлопывание пробелов), поэтому повторный адрес
+-- разрешается одним поиском по первичному ключу вместо get_house_id_by_jk
+-- и get_house_id_by_address. Используется через resolve_house() в process_ads_batch
+-- и process_all_ads.
+-- Инвалидация — триггерами на справочниках, только затронутые ключи и через DELETE
+-- (TRUNCATE взял бы ACCESS EXCLUSIVE и остановил обработчики):
+--   INSERT в fias_houses — неудачи house_not_found на улицах новых домов (street_objids)
+--                          и неудачи без улицы (street_objids = '{}');
+--   UPDATE fias_houses — то же для новых значений и удачи, указывающие на изменённые дома;
+--   DELETE fias_houses — удачи, указывающие на удалённые дома;
+--   TRUNCATE fias_houses — кэш целиком;
+--   INSERT/UPDATE fias_objects — неудачи без улицы: street_not_found и house_not_found,
+--                                для которых улица не нашлась в fias_objects;
+--   любое изменение complexes — ключи с непустым названием ЖК.
+-- Дома, которые вставляет сам резолвер (parse_and_find_house внутри resolve_house),
+-- кэш не сбрасывают: иначе каждая обработка пачки чистила бы неудачи своих же улиц.
+
+CREATE TABLE IF NOT EXISTS address_resolution_cache (
+  address_key   TEXT      NOT NULL,
+  jk_key        TEXT      NOT NULL,
+  house_id      INTEGER,
+  jk_match_id   INTEGER,
+  addr_match_id INTEGER,
+  street_found  TEXT,
+  house_part    TEXT,
+  failure       TEXT,
+  street_objids INTEGER[],
+  resolved_at   TIMESTAMP NOT NULL DEFAULT now(),
+  PRIMARY KEY (address_key, jk_key)
+);
+
+-- Улицы (parentobjid в fias_houses), на которых дом не нашёлся: по ним неудача
+-- сбрасывается, когда на улице появляется дом; '{}' — улица не найдена
+ALTER TABLE address_resolution_cache ADD COLUMN IF NOT EXISTS street_objids INTEGER[];
+
+-- Неудачи из прежней версии кэша не знают своих улиц — разрешаем их заново
+DELETE FROM address_resolution_cache WHERE house_id IS NULL AND street_objids IS NULL;
+
+DROP INDEX IF EXISTS address_resolution_cache_failed_idx;
+CREATE INDEX IF NOT EXISTS address_resolution_cache_street_objids_idx
+  ON address_resolution_cache USING gin (street_objids) WHERE house_id IS NULL;
+CREATE INDEX IF NOT EXISTS address_resolution_cache_house_id_idx
+  ON address_resolution_cache (house_id) WHERE house_id IS NOT NULL;
+
+
+CREATE OR REPLACE FUNCTION public.resolution_key(p_value text)
+ RETURNS text
+ LANGUAGE sql
+ IMMUTABLE PARALLEL SAFE
+AS $function$
+  SELECT coalesce(regexp_replace(btrim(p_value), '\s+', ' ', 'g'), '');
+$function$;
+
+
+-- DROP FUNCTION public.resolve_house(text, text);
+
+CREATE OR REPLACE FUNCTION public.resolve_house(p_address text, p_jk_name text)
+ RETURNS TABLE(house_id integer, jk_match_id integer, addr_match_id integer,
+               street_found text, house_part text, failure text)
+ LANGUAGE plpgsql
+AS $function$
+DECLARE
+  v_address_key TEXT := public.resolution_key(p_address);
+  v_jk_key      TEXT := public.resolution_key(p_jk_name);
+  v_street_objids INTEGER[];
+BEGIN
+  RETURN QUERY
+  SELECT c.house_id, c.jk_match_id, c.addr_match_id, c.street_found, c.house_part, c.failure
+    FROM address_resolution_cache c
+   WHERE c.address_key = v_address_key AND c.jk_key = v_jk_key;
+  IF FOUND THEN
+    RETURN;
+  END IF;
+
+  -- Дома, вставленные резолверами по ходу поиска, кэш не инвалидируют
+  PERFORM set_config('address_resolution_cache.resolving', 'on', true);
+  jk_match_id := get_house_id_by_jk(p_jk_name, p_address);
+  SELECT gha.result_id, gha.street_found::text, gha.house_part::text
+    INTO addr_match_id, street_found, house_part
+    FROM get_house_id_by_address(p_address) AS gha(result_id, street_found, house_part);
+  PERFORM set_config('address_resolution_cache.resolving', '', true);
+  house_id := COALESCE(jk_match_id, addr_match_id);
+  failure := CASE
+    WHEN house_id IS NOT NULL THEN NULL
+    WHEN street_found IS NULL THEN 'street_not_found'
+    ELSE 'house_not_found'
+  END;
+  IF failure = 'house_not_found' THEN
+    SELECT coalesce(public.find_parentobjids_by_parsed(pa.street_type, pa.norm_name), '{}')
+      INTO v_street_objids
+      FROM public.parse_address(p_address) pa
+     LIMIT 1;
+  END IF;
+  IF failure IS NOT NULL THEN
+    v_street_objids := coalesce(v_street_objids, '{}');
+  END IF;
+
+  INSERT INTO address_resolution_cache AS c (
+    address_key, jk_key, house_id, jk_match_id, addr_match_id, street_found, house_part, failure,
+    street_objids
+  ) VALUES (
+    v_address_key, v_jk_key, house_id, jk_match_id, addr_match_id, street_found, house_part, failure,
+    v_street_objids
+  )
+  ON CONFLICT (address_key, jk_key) DO NOTHING;
+  RETURN NEXT;
+END;
+$function$
+;
+
+
+-- Транзитные таблицы нельзя объявить у триггера на несколько событий,
+-- поэтому у fias_houses по триггеру на событие и общая функция.
+CREATE OR REPLACE FUNCTION public.invalidate_address_resolution_cache()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+  IF current_setting('address_resolution_cache.resolving', true) = 'on' THEN
+    RETURN NULL;
+  END IF;
+
+  IF TG_TABLE_NAME = 'complexes' THEN
+    DELETE FROM address_resolution_cache WHERE jk_key <> '';
+  ELSIF TG_TABLE_NAME = 'fias_objects' THEN
+    -- новая или переименованная улица: неудачи, не знающие своей улицы
+    DELETE FROM address_resolution_cache c
+     WHERE c.house_id IS NULL AND c.street_objids = '{}';
+  ELSIF TG_OP = 'TRUNCATE' THEN
+    DELETE FROM address_resolution_cache;
+  ELSE
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+      DELETE FROM address_resolution_cache c
+       WHERE c.house_id IN (SELECT o.id FROM old_houses o);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+      DELETE FROM address_resolution_cache c
+       WHERE c.house_id IS NULL
+         AND (c.street_objids = '{}'
+              OR c.street_objids && ARRAY(SELECT DISTINCT n.parentobjid FROM new_houses n
+                                           WHERE n.parentobjid IS NOT NULL));
+    END IF;
+  END IF;
+  RETURN NULL;
+END;
+$function$
+;
+
+DROP TRIGGER IF EXISTS fias_houses_resolution_cache ON fias_houses;
+DROP TRIGGER IF EXISTS fias_houses_resolution_cache_insert ON fias_houses;
+CREATE TRIGGER fias_houses_resolution_cache_insert
+  AFTER INSERT ON fias_houses
+  REFERENCING NEW TABLE AS new_houses
+  FOR EACH STATEMENT EXECUTE FUNCTION public.invalidate_address_resolution_cache();
+
+DROP TRIGGER IF EXISTS fias_houses_resolution_cache_update ON fias_houses;
+CREATE TRIGGER fias_houses_resolution_cache_update
+  AFTER UPDATE ON fias_houses
+  REFERENCING OLD TABLE AS old_houses NEW TABLE AS new_houses
+  FOR EACH STATEMENT EXECUTE FUNCTION public.invalidate_address_resolution_cache();
+
+DROP TRIGGER IF EXISTS fias_houses_resolution_cache_delete ON fias_houses;
+CREATE TRIGGER fias_houses_resolution_cache_delete
+  AFTER DELETE ON fias_houses
+  REFERENCING OLD TABLE AS old_houses
+  FOR EACH STATEMENT EXECUTE FUNCTION public.invalidate_address_resolution_cache();
+
+DROP TRIGGER IF EXISTS fias_houses_resolution_cache_truncate ON fias_houses;
+CREATE TRIGGER fias_houses_resolution_cache_truncate
+  AFTER TRUNCATE ON fias_houses
+  FOR EACH STATEMENT EXECUTE FUNCTION public.invalidate_address_resolution_cache();
+
+DROP TRIGGER IF EXISTS complexes_resolution_cache ON complexes;
+CREATE TRIGGER complexes_resolution_cache
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON complexes
+  FOR EACH STATEMENT EXECUTE FUNCTION public.invalidate_address_resolution_cache();
+
+DROP TRIGGER IF EXISTS fias_objects_resolution_cache ON fias_objects;
+CREATE TRIGGER fias_objects_resolution_cache
+  AFTER INSERT OR UPDATE ON fias_objects
+  FOR EACH STATEMENT EXECUTE FUNCTION public.invalidate_address_resolution_cache();
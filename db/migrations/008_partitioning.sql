@@ -0,0 +1,191 @@
+-- Помесячное секционирование flats_changes по updated.
+-- Секции называются flats_changes_YYYY_MM и создаются заранее плановым заданием
+-- (retention.py → maintain_month_partitions): на текущий и два следующих месяца, плюс
+-- месяцы, строки которых уже лежат в DEFAULT-секции (бэкфилл старых дней). batch_upsert
+-- секции не создаёт — DDL в горячей транзакции брал бы ACCESS EXCLUSIVE на flats_changes
+-- и мог бы сцепиться с параллельными обработчиками в deadlock; он только проверяет
+-- (missing_month_partitions), что секции есть, и предупреждает, если строки уйдут в DEFAULT.
+-- Новая секция создаётся отдельной таблицей, в неё переносятся её строки из DEFAULT,
+-- затем она подключается через ATTACH PARTITION (на родителе — SHARE UPDATE EXCLUSIVE).
+-- Старый месяц отключается без перезаписи таблицы:
+--   ALTER TABLE flats_changes DETACH PARTITION flats_changes_2025_01 CONCURRENTLY;
+--
+-- flats_history не секционируется: ON CONFLICT (avitoid, source_id) в batch_upsert
+-- требует уникального индекса по объявлению, а у секционированной таблицы уникальный
+-- индекс обязан включать ключ секционирования. С ключом time_source_updated одно
+-- объявление переезжало бы между секциями при каждом обновлении, а уникальность
+-- (avitoid, source_id) перестала бы соблюдаться. Для MAX(time_source_updated)
+-- в ads_from_maxdate.py достаточно индекса по time_source_updated.
+
+-- Функции принимают имя таблицы как есть (с учётом search_path) и работают в её
+-- схеме; для несекционированной таблицы (например, копия в bench_batch_upsert.py)
+-- ничего не делают.
+CREATE OR REPLACE FUNCTION public.missing_month_partitions(p_table text, p_from date, p_to date)
+ RETURNS text[]
+ LANGUAGE plpgsql
+ STABLE
+AS $function$
+DECLARE
+  v_parent  regclass := to_regclass(p_table);
+  v_schema  text;
+  v_relname text;
+  v_month   date := date_trunc('month', p_from)::date;
+  v_missing text[] := '{}';
+BEGIN
+  IF p_from IS NULL OR p_to IS NULL OR v_parent IS NULL
+     OR NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = v_parent) THEN
+    RETURN v_missing;
+  END IF;
+  SELECT n.nspname, c.relname INTO v_schema, v_relname
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+   WHERE c.oid = v_parent;
+
+  WHILE v_month <= p_to LOOP
+    IF to_regclass(format('%I.%I', v_schema, v_relname || '_' || to_char(v_month, 'YYYY_MM'))) IS NULL THEN
+      v_missing := v_missing || (v_relname || '_' || to_char(v_month, 'YYYY_MM'));
+    END IF;
+    v_month := (v_month + interval '1 month')::date;
+  END LOOP;
+  RETURN v_missing;
+END;
+$function$;
+
+CREATE OR REPLACE FUNCTION public.ensure_month_partitions(p_table text, p_from date, p_to date)
+ RETURNS integer
+ LANGUAGE plpgsql
+AS $function$
+DECLARE
+  v_parent  regclass := to_regclass(p_table);
+  v_schema  text;
+  v_relname text;
+  v_key     text;
+  v_default regclass;
+  v_month   date := date_trunc('month', p_from)::date;
+  v_name    text;
+  v_created integer := 0;
+BEGIN
+  IF p_from IS NULL OR p_to IS NULL OR v_parent IS NULL
+     OR NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = v_parent) THEN
+    RETURN 0;
+  END IF;
+  SELECT n.nspname, c.relname, a.attname INTO v_schema, v_relname, v_key
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_partitioned_table p ON p.partrelid = c.oid
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = p.partattrs[0]
+   WHERE c.oid = v_parent;
+  v_default := to_regclass(format('%I.%I', v_schema, v_relname || '_default'));
+
+  WHILE v_month <= p_to LOOP
+    v_name := v_relname || '_' || to_char(v_month, 'YYYY_MM');
+    IF to_regclass(format('%I.%I', v_schema, v_name)) IS NULL THEN
+      -- два задания не должны создавать одну секцию дважды
+      PERFORM pg_advisory_xact_lock(hashtext(v_schema || '.' || v_name));
+      IF to_regclass(format('%I.%I', v_schema, v_name)) IS NULL THEN
+        EXECUTE format('CREATE TABLE %I.%I (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                       v_schema, v_name, v_parent);
+        -- строки месяца, попавшие в DEFAULT до появления секции, иначе ATTACH откажет
+        IF v_default IS NOT NULL THEN
+          EXECUTE format('WITH moved AS (DELETE FROM %s WHERE %I >= %L AND %I < %L RETURNING *) '
+                         'INSERT INTO %I.%I SELECT * FROM moved',
+                         v_default, v_key, v_month, v_key, (v_month + interval '1 month')::date,
+                         v_schema, v_name);
+        END IF;
+        EXECUTE format('ALTER TABLE %s ATTACH PARTITION %I.%I FOR VALUES FROM (%L) TO (%L)',
+                       v_parent, v_schema, v_name, v_month, (v_month + interval '1 month')::date);
+        v_created := v_created + 1;
+      END IF;
+    END IF;
+    v_month := (v_month + interval '1 month')::date;
+  END LOOP;
+  RETURN v_created;
+END;
+$function$;
+
+-- Плановое обслуживание (retention.py): месяцы из DEFAULT-секции и p_months_ahead вперёд
+CREATE OR REPLACE FUNCTION public.maintain_month_partitions(p_table text, p_months_ahead integer DEFAULT 2)
+ RETURNS integer
+ LANGUAGE plpgsql
+AS $function$
+DECLARE
+  v_default regclass := to_regclass(p_table || '_default');
+  v_key     text;
+  v_from    date;
+BEGIN
+  IF v_default IS NOT NULL THEN
+    SELECT a.attname INTO v_key
+      FROM pg_partitioned_table p
+      JOIN pg_attribute a ON a.attrelid = p.partrelid AND a.attnum = p.partattrs[0]
+     WHERE p.partrelid = to_regclass(p_table);
+    IF v_key IS NOT NULL THEN
+      EXECUTE format('SELECT min(%I)::date FROM %s', v_key, v_default) INTO v_from;
+    END IF;
+  END IF;
+  RETURN public.ensure_month_partitions(
+    p_table, least(v_from, current_date),
+    (current_date + make_interval(months => p_months_ahead))::date);
+END;
+$function$;
+
+-- Перевод существующей flats_changes: данные копируются в секционированную таблицу,
+-- прежняя остаётся как flats_changes_unpartitioned до ручной проверки и DROP.
+-- Что переносится с прежней таблицы, а что нет:
+--   последовательность id — переходит во владение новой таблицы (OWNED BY), иначе
+--     DROP flats_changes_unpartitioned удалил бы её вместе с DEFAULT новой таблицы;
+--   обычные индексы — пересоздаются на новой таблице;
+--   первичный ключ и уникальные индексы — только как обычные индексы: уникальный
+--     индекс секционированной таблицы обязан включать updated, а он бывает NULL;
+--     уникальность id обеспечивает последовательность;
+--   внешние ключи из flats_changes (flats_history_id → flats_history) — пересоздаются;
+--   внешние ключи на flats_changes из других таблиц — остаются на прежней таблице
+--     и должны быть удалены вручную перед её DROP.
+DO $$
+DECLARE
+  r record;
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'public.flats_changes'::regclass) THEN
+    ALTER TABLE public.flats_changes RENAME TO flats_changes_unpartitioned;
+    CREATE TABLE public.flats_changes (
+      LIKE public.flats_changes_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS
+    ) PARTITION BY RANGE (updated);
+    CREATE TABLE public.flats_changes_default PARTITION OF public.flats_changes DEFAULT;
+
+    FOR r IN
+      SELECT s.oid::regclass AS seq, a.attname
+        FROM pg_depend d
+        JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+        JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+       WHERE d.refobjid = 'public.flats_changes_unpartitioned'::regclass
+         AND d.classid = 'pg_class'::regclass AND d.deptype = 'a'
+    LOOP
+      EXECUTE format('ALTER SEQUENCE %s OWNED BY public.flats_changes.%I', r.seq, r.attname);
+    END LOOP;
+
+    FOR r IN
+      SELECT pg_get_indexdef(i.indexrelid) AS def
+        FROM pg_index i
+       WHERE i.indrelid = 'public.flats_changes_unpartitioned'::regclass
+    LOOP
+      EXECUTE regexp_replace(r.def, '^CREATE (UNIQUE )?INDEX \S+ ON public\.flats_changes_unpartitioned ',
+                             'CREATE INDEX ON public.flats_changes ');
+    END LOOP;
+
+    FOR r IN
+      SELECT conname, pg_get_constraintdef(oid) AS def
+        FROM pg_constraint
+       WHERE conrelid = 'public.flats_changes_unpartitioned'::regclass AND contype = 'f'
+    LOOP
+      EXECUTE format('ALTER TABLE public.flats_changes ADD CONSTRAINT %I %s', r.conname, r.def);
+    END LOOP;
+
+    PERFORM public.ensure_month_partitions('public.flats_changes', min(updated)::date, max(updated)::date)
+       FROM public.flats_changes_unpartitioned;
+    INSERT INTO public.flats_changes SELECT * FROM public.flats_changes_unpartitioned;
+  END IF;
+END $$;
+
+-- Текущий и два следующих месяца — заранее; дальше их поддерживает retention.py
+SELECT public.maintain_month_partitions('public.flats_changes');
+
+CREATE INDEX IF NOT EXISTS flats_changes_history_idx ON public.flats_changes (flats_history_id, updated);
+CREATE INDEX IF NOT EXISTS flats_history_updated_idx ON public.flats_history (time_source_updated);
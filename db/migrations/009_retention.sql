@@ -0,0 +1,75 @@
+-- Очистка ads вне горячей транзакции обработки (retention.py).
+-- batch_upsert больше не удаляет обработанные объявления: этим занимается
+-- purge_ads_chunk, который за вызов трогает не больше p_limit строк каждого вида:
+--   processed IS TRUE  — удаляются, когда proc_at старше p_processed_keep;
+--   processed IS NULL  — неудачные, переносятся в ads_failed_archive
+--                        (адрес, params и debug для разбора), когда старше p_failed_keep.
+-- Строки без proc_at (размеченные до появления колонки) считаются старыми.
+-- Строки, заблокированные обработкой, пропускаются (SKIP LOCKED).
+-- ads не секционирована, поэтому удаление идёт ограниченными порциями, а не DROP секции.
+
+CREATE TABLE IF NOT EXISTS public.ads_failed_archive (
+  id          bigint PRIMARY KEY,
+  avitoid     text,
+  source_id   smallint,
+  url         text,
+  address     text,
+  city        text,
+  params      jsonb,
+  debug       jsonb,
+  proc_at     timestamp,
+  archived_at timestamp NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS ads_processed_proc_at_idx ON public.ads (proc_at) WHERE processed IS TRUE;
+CREATE INDEX IF NOT EXISTS ads_failed_proc_at_idx ON public.ads (proc_at) WHERE processed IS NULL;
+
+CREATE OR REPLACE FUNCTION public.purge_ads_chunk(
+  p_processed_keep interval,
+  p_failed_keep    interval,
+  p_limit          integer DEFAULT 5000
+)
+ RETURNS TABLE(deleted_processed integer, archived_failed integer)
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+  WITH victims AS (
+    SELECT id
+      FROM public.ads
+     WHERE processed IS TRUE
+       AND (proc_at IS NULL OR proc_at < now() - p_processed_keep)
+     LIMIT p_limit
+       FOR UPDATE SKIP LOCKED
+  )
+  DELETE FROM public.ads a
+   USING victims v
+   WHERE a.id = v.id;
+  GET DIAGNOSTICS deleted_processed = ROW_COUNT;
+
+  WITH victims AS (
+    SELECT id
+      FROM public.ads
+     WHERE processed IS NULL
+       AND (proc_at IS NULL OR proc_at < now() - p_failed_keep)
+     LIMIT p_limit
+       FOR UPDATE SKIP LOCKED
+  ),
+  moved AS (
+    DELETE FROM public.ads a
+     USING victims v
+     WHERE a.id = v.id
+    RETURNING a.id, a.avitoid, a.source_id, a.url, a.address, a.city, a.params, a.debug, a.proc_at
+  ),
+  archived AS (
+    INSERT INTO public.ads_failed_archive (id, avitoid, source_id, url, address, city, params, debug, proc_at)
+    SELECT id, avitoid, source_id, url, address, city, params, debug, proc_at
+      FROM moved
+    ON CONFLICT (id) DO NOTHING
+  )
+  -- ушедшие из ads, а не вставленные в архив: уже архивированный id (повторный
+  -- перенос) при ON CONFLICT не считается, и retention.py закончил бы раньше времени
+  SELECT count(*) INTO archived_failed FROM moved;
+
+  RETURN NEXT;
+END;
+$function$;
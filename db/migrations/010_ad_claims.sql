@@ -0,0 +1,68 @@
+-- Очередь необработанных объявлений для нескольких обработчиков одновременно.
+-- claim_ads забирает пачку processed IS FALSE через FOR UPDATE SKIP LOCKED
+-- и проставляет аренду claimed_by/claimed_at. Захват коммитится отдельной
+-- транзакцией до обработки: только тогда аренда видна другим сессиям, а
+-- блокировки строк отпускаются. Обработчик дальше берёт свои строки по
+-- возвращённым id (process_all_ads, process_ads_batch, process.py через claims.py);
+-- если он упал, через p_lease строки снова достаются другим. Поэтому p_lease
+-- должна быть заметно больше времени обработки одной пачки.
+
+ALTER TABLE public.ads
+  ADD COLUMN IF NOT EXISTS claimed_by text,
+  ADD COLUMN IF NOT EXISTS claimed_at timestamp;
+
+-- Необработанные объявления в порядке id: частичный индекс для выбора пачки
+CREATE INDEX IF NOT EXISTS ads_pending_claim_idx ON public.ads (id) INCLUDE (claimed_at)
+  WHERE processed IS FALSE;
+
+CREATE OR REPLACE FUNCTION public.claim_ads(
+  p_worker         text,
+  p_limit          integer  DEFAULT NULL,
+  p_lease          interval DEFAULT '10 minutes',
+  p_skip_excluded  boolean  DEFAULT FALSE
+)
+ RETURNS SETOF bigint
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+  IF p_skip_excluded THEN
+    -- правила из location_rules.json: условие повторяет предикат ads_pending_location_idx
+    -- (db/migrations/R__location_rules.sql), иначе планировщик этот индекс не возьмёт
+    RETURN QUERY
+    WITH claimable AS (
+      SELECT a.id
+        FROM public.ads a
+       WHERE a.processed IS FALSE
+         AND NOT public.is_excluded_location(a.city, a.district_only, a.address)
+         AND (a.claimed_at IS NULL OR a.claimed_at < now() - p_lease)
+       ORDER BY a.id
+       LIMIT p_limit
+         FOR UPDATE SKIP LOCKED
+    )
+    UPDATE public.ads a
+       SET claimed_by = p_worker,
+           claimed_at = now()
+      FROM claimable c
+     WHERE a.id = c.id
+    RETURNING a.id;
+    RETURN;
+  END IF;
+
+  RETURN QUERY
+  WITH claimable AS (
+    SELECT a.id
+      FROM public.ads a
+     WHERE a.processed IS FALSE
+       AND (a.claimed_at IS NULL OR a.claimed_at < now() - p_lease)
+     ORDER BY a.id
+     LIMIT p_limit
+       FOR UPDATE SKIP LOCKED
+  )
+  UPDATE public.ads a
+     SET claimed_by = p_worker,
+         claimed_at = now()
+    FROM claimable c
+   WHERE a.id = c.id
+  RETURNING a.id;
+END;
+$function$;
@@ -3,6 +3,8 @@
 CREATE OR REPLACE PROCEDURE public.batch_upsert()
  LANGUAGE plpgsql
 AS $procedure$
+DECLARE
+  missing_partitions text[];
 BEGIN
   ------------------------------------------------------------
   -- 1. Upsert into flats (add metro_id, km_do_metro)
@@ -26,45 +28,52 @@ BEGIN
   ON CONFLICT DO NOTHING;
 
 
+  ------------------------------------------------------------
+  -- 1.1. Секции flats_changes под месяцы пачки (db/migrations/008_partitioning.sql): только
+  -- проверка, создаёт их retention.py — DDL здесь блокировал бы flats_changes
+  ------------------------------------------------------------
+  SELECT public.missing_month_partitions(
+    'flats_changes', min(time_source_updated)::date, max(time_source_updated)::date
+  )
+  INTO missing_partitions
+  FROM tmp_flats_history;
+  IF cardinality(missing_partitions) > 0 THEN
+    RAISE WARNING 'flats_changes: no partitions %, rows go to DEFAULT until retention.py creates them',
+      missing_partitions;
+  END IF;
+
+
   ------------------------------------------------------------
   -- 2. Подготовка списка для snapshot
   ------------------------------------------------------------
   WITH
-  -- 2.1) выявляем старые данные для сравнения
-  old_data AS (
-    SELECT
-      avitoid,
-      source_id,
-      price      AS old_price,
-      is_actual  AS old_status,
-      description AS old_desc
-    FROM flats_history
-  ),
-  -- 2.2) определяем, кому нужен snapshot:
+  -- 2.1) snapshot нужен новым объявлениям и тем, у кого изменился отпечаток
+  -- price, is_actual, description (flats_history.content_hash, db/migrations/004_fingerprint.sql).
+  -- flats_history читается только по ключам пачки через flats_history_fingerprint_idx
+  -- (index-only), поэтому стоимость зависит от размера пачки, а не истории.
+  -- Строки, которым backfill_content_hash() ещё не заполнил отпечаток, сравниваются
+  -- по полям через частичный flats_history_content_hash_pending_idx.
   to_snapshot AS (
-    -- 2.2a) новые объявления (нет старой записи)
     SELECT
       tmp.avitoid,
       tmp.source_id
     FROM tmp_flats_history tmp
-    LEFT JOIN old_data od
-      ON od.avitoid   = tmp.avitoid
-     AND od.source_id = tmp.source_id
-    WHERE od.avitoid IS NULL
-
-    UNION ALL
-
-    -- 2.2b) уже существующие, но с изменениями в любом из трёх полей
-    SELECT
-      tmp.avitoid,
-      tmp.source_id
-    FROM tmp_flats_history tmp
-    JOIN old_data od
-      ON od.avitoid   = tmp.avitoid
-     AND od.source_id = tmp.source_id
-    WHERE od.old_price    IS DISTINCT FROM tmp.price
-       OR od.old_status   IS DISTINCT FROM tmp.is_actual
-       OR od.old_desc     IS DISTINCT FROM tmp.description
+    WHERE NOT EXISTS (
+      SELECT 1
+      FROM flats_history fh
+      WHERE fh.avitoid   = tmp.avitoid
+        AND fh.source_id = tmp.source_id
+        AND fh.content_hash = public.ad_fingerprint(tmp.price, tmp.is_actual::text, tmp.description)
+    )
+    AND NOT EXISTS (
+      SELECT 1
+      FROM flats_history fh
+      WHERE fh.avitoid   = tmp.avitoid
+        AND fh.source_id = tmp.source_id
+        AND fh.content_hash IS NULL
+        AND public.ad_fingerprint(fh.price, fh.is_actual::text, fh.description)
+          = public.ad_fingerprint(tmp.price, tmp.is_actual::text, tmp.description)
+    )
   ),
 
   ------------------------------------------------------------
@@ -92,6 +101,10 @@ BEGIN
         time_source_updated = EXCLUDED.time_source_updated,
         is_actual           = EXCLUDED.is_actual,
         description         = EXCLUDED.description
+      -- строки без изменений не переписываются (и не плодят мёртвые версии)
+      WHERE (flats_history.content_hash, flats_history.time_source_updated) IS DISTINCT FROM
+            (public.ad_fingerprint(EXCLUDED.price, EXCLUDED.is_actual::text, EXCLUDED.description),
+             EXCLUDED.time_source_updated)
 
     RETURNING
       id,
@@ -125,13 +138,7 @@ BEGIN
    AND ts.source_id = u.source_id
   ;
 
-
-  ------------------------------------------------------------
-  -- 5. Clean up processed ads
-  ------------------------------------------------------------
-  DELETE FROM ads
-  WHERE processed IS TRUE;
-
+  -- Обработанные объявления из ads удаляет retention.py (db/migrations/009_retention.sql)
 END;
 $procedure$
 ;
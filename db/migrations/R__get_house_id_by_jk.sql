@@ -1,6 +1,8 @@
--- DROP FUNCTION public.get_house_id_by_jk(text, text);
+-- DROP FUNCTION public.find_complex_id_legacy(text);
 
-CREATE OR REPLACE FUNCTION public.get_house_id_by_jk(p_jk_name text, p_full_address text)
+-- Прежний поиск ЖК (до 10 запросов без индексов). Оставлен для сравнения
+-- в bench_jk_match.py; рабочий путь — find_complex_id (db/migrations/005_complexes_trgm.sql).
+CREATE OR REPLACE FUNCTION public.find_complex_id_legacy(p_jk_name text)
  RETURNS smallint
  LANGUAGE plpgsql
 AS $function$
@@ -11,12 +13,7 @@ DECLARE
     v_words       TEXT[];
     v_n           INT;
     v_ids         SMALLINT[];
-    v_house_id    SMALLINT;
-    v_corp_raw    TEXT;
-    v_corp_clean  TEXT;
-    v_parts       TEXT[];
 BEGIN
-    -- 0. Проверка входных параметров
     IF p_jk_name IS NULL OR btrim(p_jk_name) = '' THEN
         RETURN NULL;
     END IF;
@@ -147,6 +144,34 @@ BEGIN
         LIMIT 1;
     END IF;
 
+    RETURN v_complex_id;
+END;
+$function$
+;
+
+
+-- DROP FUNCTION public.get_house_id_by_jk(text, text);
+
+CREATE OR REPLACE FUNCTION public.get_house_id_by_jk(p_jk_name text, p_full_address text)
+ RETURNS smallint
+ LANGUAGE plpgsql
+AS $function$
+DECLARE
+    v_complex_id  SMALLINT;
+    v_house_id    SMALLINT;
+    v_corp_raw    TEXT;
+    v_corp_clean  TEXT;
+    v_parts       TEXT[];
+BEGIN
+    -- 0. Проверка входных параметров
+    IF p_jk_name IS NULL OR btrim(p_jk_name) = '' THEN
+        RETURN NULL;
+    END IF;
+
+    -------------------------------------------------------------
+    -- 1-6. Один ранжированный поиск по триграммным индексам (db/migrations/005_complexes_trgm.sql)
+    v_complex_id := public.find_complex_id(p_jk_name);
+
     -------------------------------------------------------------
     -- Если ЖК не найден — уведомление и выход
     IF v_complex_id IS NULL THEN
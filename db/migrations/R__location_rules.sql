@@ -0,0 +1,18 @@
+-- Сгенерировано: python location_filter.py --sql > db/migrations/R__location_rules.sql
+-- Источник правил — location_rules.json, тот же, что у фильтра в ингестерах.
+
+CREATE OR REPLACE FUNCTION public.is_excluded_location(p_city text, p_district text, p_address text)
+ RETURNS boolean
+ LANGUAGE sql
+ IMMUTABLE PARALLEL SAFE
+AS $function$
+  SELECT coalesce(lower(p_city), '') ~ 'новая\ москва|зеленоград|область'
+      OR coalesce(lower(p_district), '') ~ 'нао|тао'
+      OR coalesce(lower(p_address), '') ~ 'новомосковский|десёновское|красногорск|зеленоград|коммунарка|балашиха|люберцы|троицк|обл\.|нао';
+$function$;
+
+-- Необработанные объявления из допустимых локаций: по нему claim_ads(..., p_skip_excluded => TRUE)
+-- (process_ads_batch) берёт очередную пачку, не перебирая отфильтрованные строки
+DROP INDEX IF EXISTS ads_pending_location_idx;
+CREATE INDEX ads_pending_location_idx ON ads (id)
+  WHERE processed IS FALSE AND NOT public.is_excluded_location(city, district_only, address);
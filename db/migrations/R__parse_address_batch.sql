@@ -0,0 +1,62 @@
+-- DROP FUNCTION public.parse_address_batch(text[]);
+
+-- Пакетный вариант parse_address: разбирает все адреса пачки одним set-based запросом.
+-- Справочник типов улиц читается один раз, алиасы каждого типа склеиваются в одно
+-- регулярное выражение (для поиска и для вырезания), повторяющиеся адреса разбираются
+-- один раз. Результат совпадает с parse_address(address) для каждого адреса;
+-- адреса без типа улицы в результат не попадают (как и пустой результат parse_address).
+-- Отличие: тип без алиасов (aliases NULL или пустые строки) узнаётся по имени, а
+-- parse_address из-за CROSS JOIN unnest(aliases) такой тип не видит вовсе, а пустой
+-- алиас у него совпадает с любым словом.
+-- Сравнение с parse_address: python bench_parse_address.py
+
+CREATE OR REPLACE FUNCTION public.parse_address_batch(p_addresses text[])
+ RETURNS TABLE(address text, street_type text, norm_name text, house_part text)
+ LANGUAGE sql
+ STABLE
+AS $function$
+  WITH kinds AS (
+    SELECT l.name AS kind,
+           l.id   AS kind_id,
+           -- NULL, если алиасов нет: тогда тип совпадает только по имени
+           '(' || string_agg(u.alias, ')|(' ORDER BY u.ord) FILTER (WHERE u.alias <> '') || ')' AS match_rx,
+           '(^|\s)((' || string_agg(u.alias, ')|(' ORDER BY u.ord) FILTER (WHERE u.alias <> '') || '))\.?($|\s)' AS strip_rx
+      FROM public.lookup_types l
+           LEFT JOIN LATERAL unnest(l.aliases) WITH ORDINALITY AS u(alias, ord) ON TRUE
+     WHERE l.category = 'street_type'
+     GROUP BY l.name, l.id
+  ),
+  cleaned AS (
+    -- 1-2. Нормализация ('ё'→'е', сворачивание точек, обрезка) и разбиение по запятым
+    SELECT raw,
+           regexp_split_to_array(
+             btrim(regexp_replace(regexp_replace(raw, '[ё]', 'е', 'g'), '\.+', '.', 'g')),
+             '\s*,\s*'
+           ) AS segments
+      FROM (SELECT DISTINCT raw FROM unnest(p_addresses) AS raw WHERE raw IS NOT NULL) src
+  ),
+  words AS (
+    SELECT c.raw, c.segments, s.seg, s.seg_idx, w.word_idx,
+           regexp_replace(w.word, '\.$', '', 'g') AS base_w
+      FROM cleaned c
+           CROSS JOIN LATERAL unnest(c.segments) WITH ORDINALITY AS s(seg, seg_idx)
+           CROSS JOIN LATERAL unnest(regexp_split_to_array(s.seg, '\s+')) WITH ORDINALITY AS w(word, word_idx)
+  ),
+  found AS (
+    -- 3. Первое слово (по сегментам и словам), совпавшее с алиасом или именем типа
+    SELECT DISTINCT ON (wd.raw) wd.raw, wd.segments, wd.seg, wd.seg_idx, k.kind, k.strip_rx
+      FROM words wd
+      JOIN kinds k ON k.kind = wd.base_w OR wd.base_w ~ k.match_rx
+     ORDER BY wd.raw, wd.seg_idx, wd.word_idx, k.kind_id
+  )
+  -- 5-6. Вырезаем алиасы и имя типа из сегмента, house_part — следующий сегмент
+  SELECT f.raw,
+         f.kind,
+         btrim(regexp_replace(
+           coalesce(regexp_replace(f.seg, f.strip_rx, ' ', 'g'), f.seg),
+           format('(^|\s)%s($|\s)', f.kind), ' ', 'g'
+         )),
+         CASE WHEN f.seg_idx < array_length(f.segments, 1) THEN f.segments[f.seg_idx + 1] END
+    FROM found f;
+$function$
+;
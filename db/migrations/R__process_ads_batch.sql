@@ -1,11 +1,28 @@
--- DROP PROCEDURE public.process_ads_batch(int4);
+-- Прежняя сигнатура без p_worker сделала бы вызов с одним аргументом неоднозначным
+DROP PROCEDURE IF EXISTS public.process_ads_batch(int4);
 
-CREATE OR REPLACE PROCEDURE public.process_ads_batch(IN p_batch_size integer DEFAULT 20)
+-- Одна пачка из очереди: захват отдельной транзакцией (аренда видна другим
+-- обработчикам), затем обработка. Из-за COMMIT внутри вызывать вне явной
+-- транзакции (claims.call_procedure).
+CREATE OR REPLACE PROCEDURE public.process_ads_batch(
+  IN p_batch_size integer  DEFAULT 20,
+  IN p_worker     text     DEFAULT pg_backend_pid()::text,
+  IN p_lease      interval DEFAULT '10 minutes'
+)
  LANGUAGE plpgsql
 AS $procedure$
 DECLARE
-  now_ts TIMESTAMP := now();
+  now_ts   TIMESTAMP;
+  v_ids    BIGINT[];
 BEGIN
+  -- 0. Захват пачки (db/migrations/010_ad_claims.sql), отсеянные location_rules.json не берутся
+  SELECT array_agg(c.id) INTO v_ids FROM public.claim_ads(p_worker, p_batch_size, p_lease, TRUE) AS c(id);
+  COMMIT;
+  IF v_ids IS NULL THEN
+    RETURN;
+  END IF;
+  now_ts := now();
+
   -- 1. Подготовка временных таблиц
   CREATE TEMP TABLE tmp_flats_history (
     ad_id               integer,
@@ -47,6 +64,15 @@ BEGIN
 
   -- 2. Подготовка обогащённых данных с фильтрацией региона
   CREATE TEMP TABLE tmp_enriched ON COMMIT DROP AS
+  WITH pending AS (
+    -- только своя, только что захваченная пачка
+    SELECT a.* FROM ads a
+    WHERE a.id = ANY(v_ids) AND a.processed IS FALSE
+  ),
+  parsed AS (
+    -- Адреса пачки разбираются одним запросом (db/migrations/R__parse_address_batch.sql)
+    SELECT * FROM public.parse_address_batch(ARRAY(SELECT address FROM pending))
+  )
   SELECT a.id AS ad_id, a.*, 
     pa.norm_name    AS street,
     pa.street_type,
@@ -60,8 +86,8 @@ BEGIN
         split_part(replace(replace(a.params->>'Название ЖК','ё','е'),'Ё','Е'),',',1),
         '\s*\(.*\)',''
       ), '') AS jk_name
-  FROM ads a
-  LEFT JOIN LATERAL public.parse_address(a.address) pa ON TRUE
+  FROM pending a
+  LEFT JOIN parsed pa ON pa.address = a.address
   LEFT JOIN lookup_types ht
     ON ht.category='house_type'
    AND lower(ht.name)=lower(a.params->>'Тип дома')
@@ -69,13 +95,15 @@ BEGIN
     ON ot.category='object_type'
    AND lower(ot.name)=lower(a.params->>'Вид объекта')
   LEFT JOIN districts d
-    ON lower(d.admin_okrug)=lower(a.district_only)
-  WHERE a.processed IS FALSE
-    AND a.city NOT ILIKE '%зеленоград%'
-    AND a.city NOT ILIKE '%новая москва%'
-    AND a.district_only NOT ILIKE '%нао%'  
-	and a.address NOT ILIKE '%Новомосковский%' and a.address NOT ILIKE '%зеленоград%' and a.address NOT ILIKE '%троицк%' and a.address NOT ILIKE '%обл.%'
-  LIMIT p_batch_size;
+    ON lower(d.admin_okrug)=lower(a.district_only);
+
+  -- 2.1. Разрешение house_id — один раз на объявление; успешные строки, debug
+  -- неудачных и статусы ads дальше берутся только отсюда
+  CREATE TEMP TABLE tmp_resolution ON COMMIT DROP AS
+  SELECT e.ad_id, r.house_id, r.jk_match_id, r.addr_match_id, r.street_found, r.house_part, r.failure
+  FROM tmp_enriched e
+  -- геокодирование через кэш (db/migrations/007_address_resolution_cache.sql)
+  LEFT JOIN LATERAL public.resolve_house(e.address, e.jk_name) r ON TRUE;
 
   -- 3. Вставка в tmp_flats_history с дедупликацией и отбором по house_id
   INSERT INTO tmp_flats_history (
@@ -90,10 +118,7 @@ BEGIN
   )
   SELECT DISTINCT ON (e.avitoid, e.source_id)
     e.ad_id,
-    COALESCE(
-      get_house_id_by_jk(e.jk_name,e.address),
-      gha.result_id
-    ) AS house_id,
+    r.house_id AS house_id,
     CASE WHEN e.params->>'Этаж' ~ '^[0-9]+$' THEN (e.params->>'Этаж')::smallint END AS floor,
     CASE WHEN e.params->>'Количество комнат' ILIKE '%студ%' THEN 0
          WHEN e.params->>'Количество комнат' ~ '^[0-9]+$' THEN (e.params->>'Количество комнат')::smallint
@@ -114,22 +139,33 @@ BEGIN
     e.time_source_created, e.time_source_updated,
     e.avitoid, e.is_actual, e.description
   FROM tmp_enriched e
-  LEFT JOIN LATERAL get_house_id_by_address(e.address) AS gha(result_id,street_found,house_part) ON TRUE
-  WHERE COALESCE(get_house_id_by_jk(e.jk_name,e.address),gha.result_id) IS NOT NULL
+  JOIN tmp_resolution r ON r.ad_id = e.ad_id
+  WHERE r.house_id IS NOT NULL
   ORDER BY e.avitoid, e.source_id, e.time_source_updated DESC;
 
+  -- 3.1. Отмечаем успешно разрешённые, иначе после истечения аренды
+  -- они снова попали бы в очередь
+  UPDATE ads a
+  SET
+    processed = TRUE,
+    proc_at   = now_ts
+  FROM tmp_resolution r
+  WHERE a.id = r.ad_id
+    AND r.house_id IS NOT NULL;
+
   -- 4. Логирование тех, у кого house_id IS NULL
   INSERT INTO tmp_debug(ad_id,debug,success)
   SELECT
     e.ad_id,
     jsonb_build_object(
-      'street_found', gha.street_found,
-      'house_part', gha.house_part
+      'street_found', r.street_found,
+      'house_part', r.house_part,
+      'failure', r.failure
     ),
     FALSE
   FROM tmp_enriched e
-  LEFT JOIN LATERAL get_house_id_by_address(e.address) AS gha(result_id,street_found,house_part) ON TRUE
-  WHERE COALESCE(get_house_id_by_jk(e.jk_name,e.address),gha.result_id) IS NULL;
+  JOIN tmp_resolution r ON r.ad_id = e.ad_id
+  WHERE r.house_id IS NULL;
 
   -- 5. Обновление ads: отмечаем неудачные как processed=NULL
   UPDATE ads a
@@ -141,7 +177,7 @@ BEGIN
   WHERE a.id = d.ad_id;
 
   -- 6. Upsert истории и основных данных
-  CALL batch_upsert_flats_and_history();
+  CALL batch_upsert();
 END;
 $procedure$
 ;
@@ -0,0 +1,176 @@
+-- Прежние сигнатуры сделали бы CALL process_all_ads() неоднозначным
+DROP PROCEDURE IF EXISTS public.process_all_ads();
+DROP PROCEDURE IF EXISTS public.process_all_ads(text, interval);
+
+-- Разбирает очередь пачками по p_batch_size, пока claim_ads что-то отдаёт.
+-- Каждая пачка сначала захватывается отдельной транзакцией (аренда видна другим
+-- обработчикам), затем обрабатывается и коммитится. Из-за COMMIT внутри вызывать
+-- вне явной транзакции: claims.call_procedure в psycopg2, asyncpg — как есть.
+CREATE OR REPLACE PROCEDURE public.process_all_ads(
+  IN p_batch_size integer  DEFAULT 5000,
+  IN p_worker     text     DEFAULT pg_backend_pid()::text,
+  IN p_lease      interval DEFAULT '10 minutes'
+)
+ LANGUAGE plpgsql
+AS $procedure$
+DECLARE
+  now_ts   TIMESTAMP;
+  v_ids    BIGINT[];
+BEGIN
+  LOOP
+    -- 0. Захват пачки (db/migrations/010_ad_claims.sql); дальше пачка берётся по её id
+    SELECT array_agg(c.id) INTO v_ids FROM public.claim_ads(p_worker, p_batch_size, p_lease) AS c(id);
+    COMMIT;
+    EXIT WHEN v_ids IS NULL;
+    now_ts := now();
+
+    -- 1. Подготовка временных таблиц: свои на каждую сессию, вместо общей
+    -- tmp_flats_history, TRUNCATE которой выстраивал обработчики в очередь
+    CREATE TEMP TABLE tmp_flats_history (LIKE public.tmp_flats_history INCLUDING ALL) ON COMMIT DROP;
+    CREATE TEMP TABLE tmp_claimed ON COMMIT DROP AS
+    SELECT id FROM ads
+     WHERE id = ANY(v_ids) AND processed IS FALSE;
+    CREATE TEMP TABLE tmp_debug (
+      ad_id    INTEGER,
+      debug    JSONB,
+      success  BOOLEAN
+    ) ON COMMIT DROP;
+
+    -- 2. Подготовка обогащённых данных захваченной пачки
+    CREATE TEMP TABLE tmp_enriched ON COMMIT DROP AS
+    WITH parsed AS (
+      -- Адреса всей пачки разбираются одним запросом (db/migrations/R__parse_address_batch.sql)
+      SELECT * FROM public.parse_address_batch(ARRAY(SELECT a.address FROM ads a JOIN tmp_claimed c ON c.id = a.id))
+    )
+    SELECT 
+      a.id            AS ad_id,
+      a.*,
+      pa.norm_name    AS street,
+      pa.street_type,
+      pa.house_part   AS house,
+      ht.id           AS house_type_id,
+      ot.id           AS object_type_id,
+      d.id            AS ao_id,
+      COALESCE(
+        regexp_replace(
+          split_part(
+            replace(replace(a.params->>'Название ЖК','ё','е'),'Ё','Е'),
+            ',',1
+          ),
+          '\s*\(.*\)',''
+        ), ''
+      ) AS jk_name
+    FROM ads a
+    JOIN tmp_claimed c ON c.id = a.id
+    LEFT JOIN parsed pa ON pa.address = a.address
+    LEFT JOIN lookup_types ht
+      ON ht.category = 'house_type'
+     AND lower(ht.name) = lower(a.params->>'Тип дома')
+    LEFT JOIN lookup_types ot
+      ON ot.category = 'object_type'
+     AND lower(ot.name) = lower(a.params->>'Вид объекта')
+    LEFT JOIN districts d
+      ON lower(d.admin_okrug) = lower(a.district_only);
+
+    -- 2.1. Разрешение house_id — один раз на объявление; успешные строки, debug
+    -- неудачных и статусы ads дальше берутся только отсюда
+    CREATE TEMP TABLE tmp_resolution ON COMMIT DROP AS
+    SELECT e.ad_id, r.house_id, r.jk_match_id, r.addr_match_id, r.street_found, r.house_part, r.failure
+    FROM tmp_enriched e
+    -- геокодирование через кэш (db/migrations/007_address_resolution_cache.sql)
+    LEFT JOIN LATERAL public.resolve_house(e.address, e.jk_name) r ON TRUE;
+
+    -- 3. Вставка в tmp_flats_history с дедупликацией и отбором по house_id
+    INSERT INTO tmp_flats_history (
+      ad_id, house_id, floor, rooms,
+      street, street_type, house,
+      town, total_floors, area, living_area, kitchen_area,
+      house_type_id, ao_id, built, metro_id, km_do_metro,
+      source_id, object_type_id, nedvigimost_type_id,
+      url, person_type_id, price,
+      time_source_created, time_source_updated,
+      avitoid, is_actual, description
+    )
+    SELECT DISTINCT ON (e.avitoid, e.source_id)
+      e.ad_id,
+      r.house_id AS house_id,
+      CASE WHEN e.params->>'Этаж' ~ '^[0-9]+$' 
+           THEN (e.params->>'Этаж')::smallint END AS floor,
+      CASE 
+        WHEN e.params->>'Количество комнат' ILIKE '%студ%' THEN 0
+        WHEN e.params->>'Количество комнат' ~ '^[0-9]+$' 
+             THEN (e.params->>'Количество комнат')::smallint
+        ELSE 0
+      END AS rooms,
+      e.street, e.street_type, e.house,
+      1 AS town,
+      CASE WHEN e.params->>'Этажей в доме' ~ '^[0-9]+$' 
+           THEN (e.params->>'Этажей в доме')::smallint END AS total_floors,
+      (e.params->>'Площадь')::numeric,
+      (e.params->>'Жилая площадь')::numeric,
+      (e.params->>'Площадь кухни')::numeric,
+      e.house_type_id, e.ao_id,
+      CASE 
+        WHEN COALESCE(
+               e.params2->'О здании'->>'Год постройки',
+               right(e.params->>'Срок сдачи',4)
+             ) ~ '^[0-9]{4}$'
+        THEN COALESCE(
+               e.params2->'О здании'->>'Год постройки',
+               right(e.params->>'Срок сдачи',4)
+             )::smallint
+      END AS built,
+      NULL AS metro_id,
+      e.km_do_metro,
+      e.source_id, e.object_type_id, e.nedvigimost_type_id,
+      e.url, e.person_type_id, e.price,
+      e.time_source_created, e.time_source_updated,
+      e.avitoid, e.is_actual, e.description
+    FROM tmp_enriched e
+    JOIN tmp_resolution r ON r.ad_id = e.ad_id
+    WHERE r.house_id IS NOT NULL
+    ORDER BY e.avitoid, e.source_id, e.time_source_updated DESC;
+
+    -- 3.1. Обновляем все успешно разрешённые объявления (включая более старые
+    -- повторы того же avitoid, вытесненные DISTINCT ON)
+    UPDATE ads a
+    SET 
+      processed = TRUE,
+      proc_at   = now_ts
+    FROM tmp_resolution r
+    WHERE a.id = r.ad_id
+      AND r.house_id IS NOT NULL;
+
+    -- 4. Логирование тех, у кого house_id IS NULL
+    INSERT INTO tmp_debug(ad_id, debug, success)
+    SELECT
+      e.ad_id,
+      jsonb_build_object(
+        'raw_jk_name',   e.jk_name,
+        'jk_match_id',   r.jk_match_id,
+        'addr_match_id', r.addr_match_id,
+        'street_found',  r.street_found,
+        'house_part',    r.house_part,
+        'failure',       r.failure
+      ),
+      FALSE
+    FROM tmp_enriched e
+    JOIN tmp_resolution r ON r.ad_id = e.ad_id
+    WHERE r.house_id IS NULL;
+
+    -- 5. Обновление ads: отмечаем неудачные как processed = NULL, сохраняем debug
+    UPDATE ads a
+    SET
+      processed = NULL,
+      proc_at   = now_ts,
+      debug     = d.debug
+    FROM tmp_debug d
+    WHERE a.id = d.ad_id;
+
+    -- 6. Upsert истории и основных данных
+    CALL batch_upsert();
+    COMMIT;
+  END LOOP;
+END;
+$procedure$
+;
@@ -0,0 +1,66 @@
+from bisect import bisect_left
+from collections import namedtuple
+
+# Улицы и дома ФИАС в памяти для Python-процессора (process.py), чтобы объявление
+# разрешалось без запросов к БД:
+#   улицы — отсортированный по norm_name массив (поиск по префиксу через bisect,
+#           как norm_name LIKE 'имя%' в find_street_objectids);
+#   дома  — parentobjid → номер дома (upper) → [House].
+# Загружаются улицы уровня 8 и дома на них, плюс дома Зеленограда, который
+# в process.py ищется по parentobjid города.
+STREET_LEVEL = 8
+
+House = namedtuple("House", "objectid addnum1 addtype1 addnum2 addtype2")
+
+
+class FiasIndex:
+    def __init__(self, streets, houses):
+        streets = sorted((norm_name, typename, objectid) for objectid, norm_name, typename in streets if norm_name)
+        self.names = [s[0] for s in streets]
+        self.typenames = [s[1] for s in streets]
+        self.objectids = [s[2] for s in streets]
+        self.houses = {}
+        for parentobjid, objectid, num, a1, t1, a2, t2 in houses:
+            if num is None:
+                continue
+            self.houses.setdefault(parentobjid, {}).setdefault(num.upper(), []).append(
+                House(objectid, str(a1) if a1 else None, t1, str(a2) if a2 else None, t2))
+
+    @classmethod
+    def load(cls, cur, extra_parents=()):
+        cur.execute("SELECT objectid, norm_name, typename FROM public.fias_objects WHERE level = %s;",
+                    (STREET_LEVEL,))
+        streets = cur.fetchall()
+        cur.execute(
+            """
+            SELECT h.parentobjid, h.objectid, h.housenum, h.addnum1, h.addtype1, h.addnum2, h.addtype2
+              FROM public.fias_houses h
+             WHERE h.parentobjid IN (SELECT objectid FROM public.fias_objects WHERE level = %s)
+                OR h.parentobjid = ANY(%s);
+            """,
+            (STREET_LEVEL, list(extra_parents))
+        )
+        return cls(streets, cur.fetchall())
+
+    def street_objectids(self, name, typename=None):
+        """objectid улиц, чьё norm_name начинается с name (и с типом typename, если задан)."""
+        prefix = name.lower().replace('ё', 'е')
+        result = []
+        i = bisect_left(self.names, prefix)
+        while i < len(self.names) and self.names[i].startswith(prefix):
+            if typename is None or self.typenames[i] == typename:
+                result.append(self.objectids[i])
+            i += 1
+        return result
+
+    def houses_by_parents(self, parentobjids):
+        """Номер дома → [House] по всем parentobjids (как get_houses_by_parents)."""
+        merged = {}
+        for parentobjid in parentobjids:
+            for num, houses in self.houses.get(parentobjid, {}).items():
+                merged.setdefault(num, []).extend(houses)
+        return merged
+
+    def stats(self) -> dict:
+        return {"streets": len(self.names), "house_parents": len(self.houses),
+                "houses": sum(len(v) for h in self.houses.values() for v in h.values())}
@@ -0,0 +1,94 @@
+import os
+import re
+import sys
+import json
+
+# Фильтр нежелательных локаций по единому файлу правил (location_rules.json).
+# Подстроки каждого поля собираются в одно регулярное выражение, поэтому проверка
+# объявления — три поиска независимо от числа правил. Тот же набор правил
+# генерируется в SQL-функцию is_excluded_location (db/migrations/R__location_rules.sql),
+# которую использует process_ads_batch, — Python и БД отсекают одно и то же.
+# Через .env задаются:
+# LOCATION_RULES: путь к файлу правил
+LOCATION_RULES = os.getenv("LOCATION_RULES", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                          "location_rules.json"))
+
+FIELDS = ("city", "district_only", "address")
+
+
+def _pattern(subs) -> str:
+    # Длинные подстроки первыми — на случай, если одна является началом другой;
+    # при равной длине по алфавиту, чтобы сгенерированный SQL не зависел от порядка множества
+    subs = sorted({s.lower() for s in subs if s}, key=lambda s: (-len(s), s))
+    return "|".join(re.escape(s) for s in subs)
+
+
+class LocationFilter:
+    """Скомпилированные правила: для каждого поля одно выражение по всем подстрокам."""
+
+    def __init__(self, rules: dict):
+        unknown = set(rules) - set(FIELDS) - {"_comment"}
+        if unknown:
+            raise ValueError(f"Unknown location rule fields: {', '.join(sorted(unknown))}")
+        self.rules = {field: list(rules.get(field, [])) for field in FIELDS}
+        self.patterns = {field: _pattern(subs) for field, subs in self.rules.items()}
+        self._compiled = [(field, re.compile(p)) for field, p in self.patterns.items() if p]
+
+    @classmethod
+    def load(cls, path=LOCATION_RULES):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def excluded(self, ad) -> bool:
+        return any(rx.search((ad.get(field) or "").lower()) for field, rx in self._compiled)
+
+    def iter(self, ads):
+        for ad in ads:
+            if not self.excluded(ad):
+                yield ad
+
+    def filter(self, ads):
+        return [ad for ad in ads if not self.excluded(ad)]
+
+    def sql(self) -> str:
+        """DDL функции is_excluded_location и частичного индекса по ней."""
+        checks = []
+        for field, arg in zip(FIELDS, ("p_city", "p_district", "p_address")):
+            if self.patterns[field]:
+                checks.append(f"coalesce(lower({arg}), '') ~ '{self.patterns[field].replace(chr(39), chr(39) * 2)}'")
+        body = "\n      OR ".join(checks) or "FALSE"
+        return f"""-- Сгенерировано: python location_filter.py --sql > db/migrations/R__location_rules.sql
+-- Источник правил — location_rules.json, тот же, что у фильтра в ингестерах.
+
+CREATE OR REPLACE FUNCTION public.is_excluded_location(p_city text, p_district text, p_address text)
+ RETURNS boolean
+ LANGUAGE sql
+ IMMUTABLE PARALLEL SAFE
+AS $function$
+  SELECT {body};
+$function$;
+
+-- Необработанные объявления из допустимых локаций: по нему claim_ads(..., p_skip_excluded => TRUE)
+-- (process_ads_batch) берёт очередную пачку, не перебирая отфильтрованные строки
+DROP INDEX IF EXISTS ads_pending_location_idx;
+CREATE INDEX ads_pending_location_idx ON ads (id)
+  WHERE processed IS FALSE AND NOT public.is_excluded_location(city, district_only, address);
+"""
+
+
+_default = None
+
+
+def default_filter() -> LocationFilter:
+    """Фильтр по LOCATION_RULES, загружается один раз на процесс."""
+    global _default
+    if _default is None:
+        _default = LocationFilter.load()
+    return _default
+
+
+if __name__ == "__main__":
+    if "--sql" in sys.argv:
+        print(default_filter().sql(), end="")
+    else:
+        print(json.dumps(default_filter().patterns, ensure_ascii=False, indent=2))
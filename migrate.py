@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import hashlib
+import logging
+import psycopg2
+from dotenv import load_dotenv
+
+# Миграции схемы: файлы db/migrations/NNN_*.sql применяются по порядку номеров,
+# каждый в своей транзакции, и записываются в schema_migrations вместе с контрольной
+# суммой (изменённый после применения файл — предупреждение, а не повторный прогон).
+# Повторяемые R__*.sql — процедуры и функции (CREATE OR REPLACE) и сгенерированные
+# правила локаций: применяются после нумерованных, заново при каждом изменении файла.
+# Тела SQL-функций не проверяются при создании (check_function_bodies = off, как в
+# pg_dump), поэтому порядок файлов не обязан следовать зависимостям между функциями.
+# Использование:
+#   python migrate.py                — применить новые миграции
+#   python migrate.py --status       — что применено, что нет
+#   python migrate.py --check-plans  — EXPLAIN горячих запросов: используют ли они
+#                                      свои индексы (код выхода 1, если нет)
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL")
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db", "migrations")
+
+logger = logging.getLogger("ads_fetcher")
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+  version    text PRIMARY KEY,
+  checksum   text NOT NULL,
+  applied_at timestamp NOT NULL DEFAULT now()
+);
+"""
+
+# Запрос → индексы, любой из которых должен появиться в плане. Таблицы справочников
+# малы, и на них планировщик законно выбирает seq scan, поэтому проверка идёт с
+# enable_seqscan = off: она отвечает на вопрос «может ли запрос взять индекс»,
+# а не «выгоден ли он на текущем объёме».
+PLAN_CHECKS = (
+    ("pending ads",
+     "SELECT id FROM ads WHERE processed IS FALSE ORDER BY id LIMIT 1000",
+     {"ads_pending_claim_idx"}),
+    ("pending ads, allowed locations",
+     "SELECT id FROM ads WHERE processed IS FALSE "
+     "AND NOT public.is_excluded_location(city, district_only, address) ORDER BY id LIMIT 1000",
+     {"ads_pending_location_idx"}),
+    ("lookup_types join",
+     "SELECT id FROM lookup_types WHERE category = 'house_type' AND lower(name) = lower('Панельный')",
+     {"lookup_types_category_lower_name_idx"}),
+    ("districts join",
+     "SELECT id FROM districts WHERE lower(admin_okrug) = lower('ЦАО')",
+     {"districts_lower_admin_okrug_idx"}),
+    ("fias street words",
+     "SELECT array_agg(f.objectid) FROM public.fias_objects f "
+     "WHERE 1=1 AND f.typename = 'ул' AND lower(f.norm_name) LIKE '%тверская%'",
+     {"fias_objects_lower_norm_name_trgm_idx"}),
+)
+
+
+def list_migrations(directory=MIGRATIONS_DIR):
+    """[(версия, путь)] по возрастанию номера; версия — имя файла без .sql."""
+    names = sorted(n for n in os.listdir(directory) if n.endswith(".sql") and n[:3].isdigit())
+    return [(n[:-4], os.path.join(directory, n)) for n in names]
+
+
+def list_repeatable(directory=MIGRATIONS_DIR):
+    """[(версия, путь)] повторяемых миграций R__*.sql по имени."""
+    names = sorted(n for n in os.listdir(directory) if n.endswith(".sql") and n.startswith("R__"))
+    return [(n[:-4], os.path.join(directory, n)) for n in names]
+
+
+def _checksum(sql) -> str:
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+def applied_migrations(cur) -> dict:
+    cur.execute(SCHEMA_SQL)
+    cur.execute("SELECT version, checksum FROM schema_migrations;")
+    return dict(cur.fetchall())
+
+
+def _read(path) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def migrate(conn) -> int:
+    """Применяет неприменённые и изменившиеся повторяемые миграции; возвращает их число."""
+    with conn.cursor() as cur:
+        applied = applied_migrations(cur)
+        cur.execute("SET check_function_bodies = off;")
+        conn.commit()
+        count = 0
+        for version, path in list_migrations():
+            sql = _read(path)
+            if version in applied:
+                if applied[version] != _checksum(sql):
+                    logger.warning(f"Migration {version} changed after it was applied")
+                continue
+            logger.info(f"Applying {version}")
+            cur.execute(sql)
+            cur.execute("INSERT INTO schema_migrations (version, checksum) VALUES (%s, %s);",
+                        (version, _checksum(sql)))
+            conn.commit()
+            count += 1
+        for version, path in list_repeatable():
+            sql = _read(path)
+            if applied.get(version) == _checksum(sql):
+                continue
+            logger.info(f"Applying {version}")
+            cur.execute(sql)
+            cur.execute("INSERT INTO schema_migrations (version, checksum) VALUES (%s, %s) "
+                        "ON CONFLICT (version) DO UPDATE SET checksum = EXCLUDED.checksum, applied_at = now();",
+                        (version, _checksum(sql)))
+            conn.commit()
+            count += 1
+    return count
+
+
+def _plan_indexes(node) -> set:
+    found = {node["Index Name"]} if "Index Name" in node else set()
+    for child in node.get("Plans", ()):
+        found |= _plan_indexes(child)
+    return found
+
+
+def check_plans(conn) -> bool:
+    ok = True
+    with conn.cursor() as cur:
+        cur.execute("SET LOCAL enable_seqscan = off;")
+        for name, sql, expected in PLAN_CHECKS:
+            cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            used = _plan_indexes(plan[0]["Plan"])
+            if used & expected:
+                logger.info(f"  ok    {name}: {', '.join(sorted(used & expected))}")
+            else:
+                ok = False
+                logger.error(f"  FAIL  {name}: expected one of {sorted(expected)}, plan uses {sorted(used) or 'no index'}")
+    conn.rollback()
+    return ok
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        if "--check-plans" in sys.argv:
+            sys.exit(0 if check_plans(conn) else 1)
+        elif "--status" in sys.argv:
+            with conn.cursor() as cur:
+                applied = applied_migrations(cur)
+            conn.rollback()
+            for version, _ in list_migrations():
+                print(f"{'applied' if version in applied else 'pending'}  {version}")
+            for version, path in list_repeatable():
+                if version not in applied:
+                    state = "pending"
+                else:
+                    state = "applied" if applied[version] == _checksum(_read(path)) else "changed"
+                print(f"{state:<8} {version}")
+        else:
+            logger.info(f"Applied {migrate(conn)} migration(s)")
+    finally:
+        conn.close()
@@ -0,0 +1,185 @@
+import os
+import time
+import queue
+import logging
+import threading
+import psycopg2
+
+# Конвейер загрузки: fetcher → writer → processor, связанные ограниченными очередями.
+# Пока writer пишет страницу N, fetcher уже качает N+1, а processor геокодирует N-1.
+# Через .env задаются:
+# PIPELINE_QUEUE_SIZE: ёмкость очереди между стадиями (в страницах)
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "2"))
+
+logger = logging.getLogger("ads_fetcher")
+
+_DONE = object()
+
+
+class StageStats:
+    """Счётчики стадии: обработанные страницы/строки, время работы и ожидания."""
+
+    def __init__(self, name):
+        self.name = name
+        self.pages = 0
+        self.rows = 0
+        self.busy = 0.0      # время собственной работы стадии
+        self.starved = 0.0   # ждали входную очередь (стадия быстрее предыдущей)
+        self.blocked = 0.0   # ждали место в выходной очереди (back-pressure)
+
+    def summary(self, elapsed):
+        rate = self.rows / self.busy if self.busy else 0
+        return (f"{self.name}: pages={self.pages} rows={self.rows} busy={self.busy:.1f}s "
+                f"({rate:.0f} rows/s busy, {self.busy / elapsed:.0%} util) "
+                f"starved={self.starved:.1f}s blocked={self.blocked:.1f}s")
+
+
+class Pipeline:
+    """
+    Запускает три стадии в отдельных потоках:
+    pages — итератор страниц объявлений (сеть),
+    write_page(cursor, ads) — вставка страницы (без commit),
+    process(cursor) — обработка вставленного (например, CALL process_all_ads()),
+    after_commit(ads) — необязательный вызов после commit страницы writer'ом.
+    У writer и processor свои соединения с БД.
+    """
+
+    def __init__(self, dsn, pages, write_page, process, queue_size=PIPELINE_QUEUE_SIZE, after_commit=None):
+        self.dsn = dsn
+        self.pages = pages
+        self.write_page = write_page
+        self.process = process
+        self.after_commit = after_commit
+        self.to_write = queue.Queue(maxsize=queue_size)
+        self.to_process = queue.Queue(maxsize=queue_size)
+        self.stats = [StageStats("fetcher"), StageStats("writer"), StageStats("processor")]
+        self.errors = []
+        self.stop = threading.Event()
+
+    def _put(self, q, item, stats):
+        started = time.perf_counter()
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        stats.blocked += time.perf_counter() - started
+
+    def _get(self, q, stats):
+        started = time.perf_counter()
+        while True:
+            try:
+                item = q.get(timeout=0.5)
+                break
+            except queue.Empty:
+                if self.stop.is_set():
+                    item = _DONE
+                    break
+        stats.starved += time.perf_counter() - started
+        return item
+
+    def _fail(self, stage, e):
+        logger.error(f"Pipeline stage {stage} failed: {e}")
+        self.errors.append(e)
+        self.stop.set()
+
+    def _fetcher(self):
+        stats = self.stats[0]
+        try:
+            pages = iter(self.pages)
+            while not self.stop.is_set():
+                started = time.perf_counter()
+                batch = next(pages, None)
+                stats.busy += time.perf_counter() - started
+                if batch is None:
+                    break
+                stats.pages += 1
+                stats.rows += len(batch)
+                self._put(self.to_write, batch, stats)
+        except Exception as e:
+            self._fail("fetcher", e)
+        finally:
+            self._put(self.to_write, _DONE, stats)
+
+    def _writer(self):
+        stats = self.stats[1]
+        conn = psycopg2.connect(self.dsn)
+        cursor = conn.cursor()
+        try:
+            while True:
+                batch = self._get(self.to_write, stats)
+                if batch is _DONE:
+                    break
+                started = time.perf_counter()
+                self.write_page(cursor, batch)
+                conn.commit()
+                if self.after_commit:
+                    self.after_commit(batch)
+                stats.busy += time.perf_counter() - started
+                stats.pages += 1
+                stats.rows += len(batch)
+                self._put(self.to_process, len(batch), stats)
+        except Exception as e:
+            conn.rollback()
+            self._fail("writer", e)
+        finally:
+            self._put(self.to_process, _DONE, stats)
+            cursor.close()
+            conn.close()
+
+    def _processor(self):
+        stats = self.stats[2]
+        conn = psycopg2.connect(self.dsn)
+        cursor = conn.cursor()
+        try:
+            finished = False
+            while not finished:
+                item = self._get(self.to_process, stats)
+                if item is _DONE:
+                    break
+                # Процедура обрабатывает всё необработанное сразу —
+                # схлопываем накопившиеся страницы в один вызов
+                pages, rows = 1, item
+                while True:
+                    try:
+                        more = self.to_process.get_nowait()
+                    except queue.Empty:
+                        break
+                    if more is _DONE:
+                        finished = True
+                        break
+                    pages += 1
+                    rows += more
+                started = time.perf_counter()
+                self.process(cursor)
+                conn.commit()
+                stats.busy += time.perf_counter() - started
+                stats.pages += pages
+                stats.rows += rows
+        except Exception as e:
+            conn.rollback()
+            self._fail("processor", e)
+        finally:
+            cursor.close()
+            conn.close()
+
+    def run(self) -> int:
+        """Запускает конвейер, ждёт окончания и возвращает число записанных строк."""
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._fetcher, name="fetcher", daemon=True),
+            threading.Thread(target=self._writer, name="writer", daemon=True),
+            threading.Thread(target=self._processor, name="processor", daemon=True),
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = max(time.perf_counter() - started, 1e-9)
+
+        for stats in self.stats:
+            logger.info(f"  {stats.summary(elapsed)}")
+        if self.errors:
+            raise self.errors[0]
+        return self.stats[1].rows
@@ -1,9 +1,17 @@
+import gc
 import os
 import re
+import time
+import multiprocessing
+from datetime import datetime
 import logging
 from dotenv import load_dotenv
 import psycopg2
-from psycopg2.extras import execute_values
+from psycopg2.extras import execute_values, Json
+
+from claims import claim_ads, worker_name
+from complex_matcher import ComplexMatcher, load_complex_houses, find_complex_house
+from fias_index import FiasIndex
 
 # Включаем DEBUG‑логирование
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
@@ -12,6 +20,10 @@ logger = logging.getLogger(__name__)
 # Загружаем переменные окружения
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Сколько необработанных объявлений захватывается (claims.py), разбирается и пишется за раз
+PROCESS_CHUNK_SIZE = int(os.getenv("PROCESS_CHUNK_SIZE", "5000"))
+# Процессов разбора адресов (0 или 1 — в основном процессе); запись в БД всегда в основном
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", "0"))
 
 # Синонимы типов улиц: ключи — возможные входы, значения — канонические коды
 TYPE_SYNONYMS = {
@@ -24,6 +36,46 @@ TYPE_SYNONYMS = {
 }
 ZELENOGRAD_PARENTOBJID = 1405230
 
+PENDING_SQL = """
+SELECT id, address, city, district_only,
+       source_id, url, person_type_id, price,
+       time_source_created, time_source_updated,
+       params, params2, is_actual, avitoid,
+       nedvigimost_type_id, description, km_do_metro
+  FROM ads
+ WHERE id = ANY(%s) AND claimed_by = %s AND processed IS FALSE
+ ORDER BY id;
+"""
+# Своя на сессию копия tmp_flats_history (db/tables.sql) — её читает batch_upsert()
+TMP_HISTORY_DDL = """
+CREATE TEMP TABLE IF NOT EXISTS tmp_flats_history (LIKE public.tmp_flats_history INCLUDING ALL) ON COMMIT DROP;
+"""
+HISTORY_COLUMNS = (
+    "ad_id", "house_id", "floor", "rooms",
+    "street", "street_type", "house",
+    "town", "total_floors", "area", "living_area", "kitchen_area",
+    "house_type_id", "ao_id", "built", "metro_id", "km_do_metro",
+    "source_id", "object_type_id", "nedvigimost_type_id",
+    "url", "person_type_id", "price",
+    "time_source_created", "time_source_updated",
+    "avitoid", "is_actual", "description",
+)
+HISTORY_INSERT_SQL = f"INSERT INTO tmp_flats_history ({', '.join(HISTORY_COLUMNS)}) VALUES %s;"
+# Справочники и индексы для разбора; воркеры пула наследуют их через fork
+_RESOLVER = None
+
+# Как в process_all_ads: неудачи — processed = NULL с причиной в debug, иначе они
+# остаются в очереди и после истечения аренды захватываются и разбираются снова
+MARK_SQL = """
+UPDATE ads a
+   SET processed = v.processed,
+       proc_at   = now(),
+       debug     = coalesce(v.debug, a.debug)
+  FROM (VALUES %s) AS v(id, processed, debug)
+ WHERE a.id = v.id;
+"""
+HOUSE_NOT_FOUND = {"failure": "house_not_found"}
+
 def to_int(v):
     try:
         return int(v)
@@ -71,33 +123,6 @@ def split_street(full, street_types):
                 return stripped, ' '.join(rest)
     return None, full.strip()
 
-def find_street_objectids(cur, name, typename):
-    name_norm = name.lower().replace('ё', 'е')
-    if typename:
-        sql = "SELECT objectid FROM public.fias_objects WHERE norm_name LIKE LOWER(%s) || '%%' AND typename=%s;"
-        params = (name_norm, typename)
-    else:
-        sql = "SELECT objectid FROM public.fias_objects WHERE norm_name LIKE LOWER(%s) || '%%';"
-        params = (name_norm,)
-    cur.execute(sql, params)
-    return [r[0] for r in cur.fetchall()]
-
-def get_houses_by_parents(cur, parentobjids):
-    cur.execute(
-        """
-        SELECT objectid, housenum, addnum1, addtype1, addnum2, addtype2
-          FROM public.fias_houses
-         WHERE parentobjid = ANY(%s);
-        """,
-        (parentobjids,)
-    )
-    houses = {}
-    for obj, num, a1, t1, a2, t2 in cur.fetchall():
-        key = num.upper()
-        houses.setdefault(key, []).append({'objectid': obj, 'addnum1': str(a1) if a1 else None,
-            'addtype1': t1, 'addnum2': str(a2) if a2 else None, 'addtype2': t2})
-    return houses
-
 def extract_addtype_num(text, addmap):
     for name in sorted(addmap, key=len, reverse=True):
         if text.startswith(name):
@@ -105,9 +130,9 @@ def extract_addtype_num(text, addmap):
             if num.isdigit(): return addmap[name], num, name
     return None, None, None
 
-def parse_and_find_house(cur, street_ids, hs_raw, addmap):
+def parse_and_find_house(fias, street_ids, hs_raw, addmap):
     hs = hs_raw.strip().lower()
-    houses_map = get_houses_by_parents(cur, street_ids)
+    houses_map = fias.houses_by_parents(street_ids)
     for add, pos in sorted(((n, hs.find(n)) for n in addmap if n in hs), key=lambda x: x[1]):
         prefix, rest = hs[:pos], hs[pos:]
         break
@@ -117,75 +142,88 @@ def parse_and_find_house(cur, street_ids, hs_raw, addmap):
     if not candidates: return None
     if not rest:
         for c in candidates:
-            if c['addnum1'] is None and c['addnum2'] is None:
-                return c['objectid']
-        return candidates[0]['objectid']
+            if c.addnum1 is None and c.addnum2 is None:
+                return c.objectid
+        return candidates[0].objectid
     a1, n1, _ = extract_addtype_num(rest, addmap)
     rem = rest[len(n1 or ''):]
     if not rem:
         for c in candidates:
-            if c['addtype1']==a1 and (c['addnum1'] or '')==n1 and c['addnum2'] is None:
-                return c['objectid']
-        return candidates[0]['objectid']
+            if c.addtype1==a1 and (c.addnum1 or '')==n1 and c.addnum2 is None:
+                return c.objectid
+        return candidates[0].objectid
     a2, n2, _ = extract_addtype_num(rem, addmap)
     for c in candidates:
-        if c['addtype1']==a1 and (c['addnum1'] or '')==n1 and a2 and c['addtype2']==a2 and (c['addnum2'] or '')==n2:
-            return c['objectid']
-    return candidates[0]['objectid']
+        if c.addtype1==a1 and (c.addnum1 or '')==n1 and a2 and c.addtype2==a2 and (c.addnum2 or '')==n2:
+            return c.objectid
+    return candidates[0].objectid
 
-def main():
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
+def clean_jk_name(params):
+    """Название ЖК из params, как jk_name в process_all_ads: до запятой, без скобок."""
+    raw = (params or {}).get('Название ЖК') or ''
+    return re.sub(r'\s*\(.*\)', '', raw.replace('ё', 'е').replace('Ё', 'Е').split(',')[0])
 
-    addmap = load_addtype_map(cur)
-    lookup_map = load_lookup_map(cur)
-    street_types = load_street_types(cur)
-    ao_map = load_ao_map(cur)
-
-    cur.execute("""
-    SELECT id, address, city, district_only,
-           source_id, url, person_type_id, price,
-           time_source_created, time_source_updated,
-           params, params2, is_actual, avitoid,
-           nedvigimost_type_id, description
-      FROM ads WHERE processed IS FALSE LIMIT 20;
-    """
-    )
-    rows = cur.fetchall()
-    logger.info(f"Processing {len(rows)} rows")
-
-    flats_rows, history_rows, processed_ids = [], [], []
-    for idx, (ad_id, address, city, district,
-              source_id, url, ptype, price,
-              tcr, tup, params, params2,
-              is_act, avitoid, nedvig_type_id, description) in enumerate(rows, 1):
-
-        parts = [p.strip() for p in address.split(',') if p.strip()]
-        if len(parts) >= 2:
-            street_part, house_str = parts[-2], parts[-1]
-        else:
-            street_part, house_str = parts[0], ''
+def find_jk_house(matcher, complex_houses, params, address):
+    complex_id = matcher.match(clean_jk_name(params))
+    if complex_id is None:
+        return None
+    return find_complex_house(complex_houses, complex_id, address)
 
-        if 'зеленоград' in city.lower():
-            street_ids = [ZELENOGRAD_PARENTOBJID]
-            m = re.search(r"(\d+)", street_part)
-            house_str = m.group(1) if m else street_part
-        else:
-            street_type, street_name = split_street(street_part, street_types)
-            if street_name is None:
-                logger.debug(f"Row {idx}: street not parsed from '{street_part}'")
-                cur.execute("UPDATE ads SET processed = NULL WHERE id = %s;", (ad_id,))
-                continue
-            street_ids = find_street_objectids(cur, street_name, street_type)
-            if not street_ids:
-                logger.debug(f"Row {idx}: no FIAS objectids for '{street_name}' (type='{street_type}')")
-                cur.execute("UPDATE ads SET processed = NULL WHERE id = %s;", (ad_id,))
-                continue
-
-        house_id = parse_and_find_house(cur, street_ids, house_str, addmap)
-        if not house_id:
-            logger.debug(f"Row {idx}: house '{house_str}' not found on {street_ids}")
-            continue
+class Resolver:
+    """Справочники и индексы, с которыми объявление разрешается без запросов к БД."""
+
+    def __init__(self, cur):
+        self.addmap = load_addtype_map(cur)
+        self.lookup_map = load_lookup_map(cur)
+        self.street_types = load_street_types(cur)
+        self.ao_map = load_ao_map(cur)
+        self.complex_matcher = ComplexMatcher.load(cur)
+        self.complex_houses = load_complex_houses(cur)
+        self.fias = FiasIndex.load(cur, extra_parents=[ZELENOGRAD_PARENTOBJID])
+        logger.info(f"FIAS index: {self.fias.stats()}")
+
+    def resolve(self, idx, row):
+        """
+        (processed, строка tmp_flats_history) для объявления:
+        processed=True — разобрано, None — не разбирается, False — дом не найден
+        (в ads пишется processed = NULL с причиной в debug, см. write_chunk).
+        """
+        (ad_id, address, city, district,
+         source_id, url, ptype, price,
+         tcr, tup, params, params2,
+         is_act, avitoid, nedvig_type_id, description, km_do_metro) = row
+
+        # Сначала ЖК (как COALESCE(get_house_id_by_jk, адрес) в process_all_ads), затем адрес
+        street_type = street_name = house_str = None
+        house_id = find_jk_house(self.complex_matcher, self.complex_houses, params, address)
+        if house_id is None:
+            parts = [p.strip() for p in (address or '').split(',') if p.strip()]
+            if not parts:
+                logger.debug(f"Row {idx}: empty address")
+                return None, None
+            if len(parts) >= 2:
+                street_part, house_str = parts[-2], parts[-1]
+            else:
+                street_part, house_str = parts[0], ''
+
+            if 'зеленоград' in (city or '').lower():
+                street_ids = [ZELENOGRAD_PARENTOBJID]
+                m = re.search(r"(\d+)", street_part)
+                house_str = m.group(1) if m else street_part
+            else:
+                street_type, street_name = split_street(street_part, self.street_types)
+                if street_name is None:
+                    logger.debug(f"Row {idx}: street not parsed from '{street_part}'")
+                    return None, None
+                street_ids = self.fias.street_objectids(street_name, street_type)
+                if not street_ids:
+                    logger.debug(f"Row {idx}: no FIAS objectids for '{street_name}' (type='{street_type}')")
+                    return None, None
+
+            house_id = parse_and_find_house(self.fias, street_ids, house_str, self.addmap)
+            if not house_id:
+                logger.debug(f"Row {idx}: house '{house_str}' not found on {street_ids}")
+                return False, None
 
         floor = to_int(params.get('Этаж')) if params else None
         rooms_raw = params.get('Количество комнат') if params else None
@@ -195,65 +233,144 @@ def main():
             rooms = to_int(rooms_raw)
         if floor is None or rooms is None:
             logger.debug(f"Row {idx}: missing floor or rooms (Этаж={params.get('Этаж')}, Комнат={params.get('Количество комнат')})")
-            cur.execute("UPDATE ads SET processed = NULL WHERE id = %s;", (ad_id,))
-            continue
+            return None, None
 
-        flats_rows.append((
-            house_id, floor, rooms,
+        return True, (
+            ad_id, house_id, floor, rooms,
             street_name, street_type, house_str,
             1, to_int(params.get('Этажей в доме')),
             float(params.get('Площадь') or 0),
             float(params.get('Жилая площадь') or 0),
             float(params.get('Площадь кухни') or 0),
-            lookup_map.get(('house_type', (params.get('Тип дома') or '').lower())),
-            ao_map.get((district or '').lower()),
-            get_built_year(params2)
-        ))
-
-        history_rows.append((
-            house_id, floor, rooms,
-            street_name, street_type, house_str,
-            1, to_int(params.get('Этажей в доме')),
-            float(params.get('Площадь') or 0),
-            float(params.get('Жилая площадь') or 0),
-            float(params.get('Площадь кухни') or 0),
-            lookup_map.get(('house_type', (params.get('Тип дома') or '').lower())),
-            ao_map.get((district or '').lower()),
+            self.lookup_map.get(('house_type', (params.get('Тип дома') or '').lower())),
+            self.ao_map.get((district or '').lower()),
             get_built_year(params2),
+            None, km_do_metro,
             source_id,
-            lookup_map.get(('object_type', (params.get('Вид объекта') or '').lower())),
+            self.lookup_map.get(('object_type', (params.get('Вид объекта') or '').lower())),
             nedvig_type_id,
             url, ptype, price,
             tcr, tup, avitoid, is_act, description
-        ))
-        processed_ids.append(ad_id)
+        )
+
+_AD_KEY = (HISTORY_COLUMNS.index("avitoid"), HISTORY_COLUMNS.index("source_id"))
+_UPDATED = HISTORY_COLUMNS.index("time_source_updated")
+
+def latest_per_ad(history_rows):
+    """
+    По одной строке на (avitoid, source_id) — самой свежей, как DISTINCT ON в process_all_ads:
+    у tmp_flats_history уникальный ключ, а ON CONFLICT в batch_upsert не примет повтор в одной пачке.
+    """
+    latest = {}
+    for row in history_rows:
+        key = (row[_AD_KEY[0]], row[_AD_KEY[1]])
+        if key not in latest or (row[_UPDATED] or datetime.min) > (latest[key][_UPDATED] or datetime.min):
+            latest[key] = row
+    return list(latest.values())
 
+def write_chunk(cur, history_rows, statuses):
+    """
+    Пишет разобранную порцию: строки истории через tmp_flats_history и CALL batch_upsert(),
+    статусы ads — одним UPDATE ... FROM (VALUES ...); processed=False (дом не найден)
+    становятся NULL с failure в debug, как в process_all_ads.
+    """
     if history_rows:
-        execute_values(cur,
-            """
-            CREATE TEMP TABLE IF NOT EXISTS tmp_flats_history (
-              house_id integer, floor smallint, rooms smallint,
-              street text, street_type varchar(9), house varchar(8),
-              town smallint, total_floors smallint,
-              area numeric, living_area numeric, kitchen_area numeric,
-              house_type_id smallint, ao_id smallint, built smallint,
-              source_id smallint, object_type smallint, nedvigimost_type_id smallint,
-              url text, person_type_id smallint, price numeric,
-              time_source_created date, time_source_updated timestamp,
-              avitoid bigint, is_actual smallint, description text
-            ) ON COMMIT DROP;
-            INSERT INTO tmp_flats_history VALUES %s;
-            """,
-            history_rows
-        )
-        cur.execute("CALL batch_upsert_flats_and_history();")
+        history_rows = latest_per_ad(history_rows)
+        cur.execute(TMP_HISTORY_DDL)
+        execute_values(cur, HISTORY_INSERT_SQL, history_rows, page_size=len(history_rows))
+        cur.execute("CALL batch_upsert();")
+
+    marks = [(ad_id, None, Json(HOUSE_NOT_FOUND)) if processed is False else (ad_id, processed, None)
+             for ad_id, processed in statuses]
+    if marks:
+        execute_values(cur, MARK_SQL, marks, template="(%s, %s::boolean, %s::jsonb)", page_size=len(marks))
+
+def resolve_rows(chunk):
+    """(ad_id, processed, строка истории) по порции (номер первой строки, строки); в воркерах пула — тоже."""
+    start, rows = chunk
+    results = []
+    for idx, row in enumerate(rows, start):
+        try:
+            results.append((row[0], *_RESOLVER.resolve(idx, row)))
+        except Exception as e:
+            # Одно кривое объявление не должно обрывать разбор всей очереди
+            logger.warning(f"Row {idx}: ad {row[0]} not resolved: {e!r}")
+            results.append((row[0], None, None))
+    return results
+
+def iter_chunks(conn, worker):
+    """
+    Порции очереди через claim_ads: захват коммитится до разбора, так что параллельные
+    process.py и CALL process_all_ads() берут разные строки. Каждая захваченная строка
+    после записи порции уходит из очереди (write_chunk), поэтому цикл конечен.
+    """
+    start = 1
+    while True:
+        ids = claim_ads(conn, worker, PROCESS_CHUNK_SIZE)
+        if not ids:
+            return
+        with conn.cursor() as cur:
+            cur.execute(PENDING_SQL, (ids, worker))
+            rows = cur.fetchall()
+        if rows:
+            yield start, rows
+            start += len(rows)
+
+def iter_resolved(chunks, workers):
+    """
+    Разобранные порции по порядку. При workers > 1 порция делится между fork-процессами,
+    которые видят _RESOLVER родителя без копирования (copy-on-write), а следующая порция
+    разбирается, пока текущая пишется в БД.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield resolve_rows(chunk)
+        return
 
-    if processed_ids:
-        cur.execute("UPDATE ads SET processed=TRUE WHERE id=ANY(%s);", (processed_ids,))
+    # Объекты индексов не должны попадать под сборщик мусора: иначе он трогает их
+    # заголовки и страницы памяти копируются в каждый воркер
+    gc.freeze()
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        in_flight = None
+        for start, rows in chunks:
+            step = -(-len(rows) // workers)
+            parts = [(start + i, rows[i:i + step]) for i in range(0, len(rows), step)]
+            submitted = pool.map_async(resolve_rows, parts)
+            if in_flight is not None:
+                yield [r for part in in_flight.get() for r in part]
+            in_flight = submitted
+        if in_flight is not None:
+            yield [r for part in in_flight.get() for r in part]
 
+def main():
+    global _RESOLVER
+    worker = worker_name("process.py")
+    conn = psycopg2.connect(DATABASE_URL, application_name=worker)
+    cur = conn.cursor()
+    _RESOLVER = Resolver(cur)
     conn.commit()
-    cur.close()
-    conn.close()
+
+    logger.info(f"Resolving in {max(PROCESS_WORKERS, 1)} process(es), chunk {PROCESS_CHUNK_SIZE}, worker {worker}")
+
+    total = resolved = 0
+    started = time.perf_counter()
+    try:
+        for results in iter_resolved(iter_chunks(conn, worker), PROCESS_WORKERS):
+            history_rows = [history_row for _, _, history_row in results if history_row]
+            write_chunk(cur, history_rows, [(ad_id, processed) for ad_id, processed, _ in results])
+            conn.commit()
+
+            total += len(results)
+            resolved += len(history_rows)
+            elapsed = time.perf_counter() - started
+            logger.info(f"Processed {total} rows, resolved {resolved} ({total / max(elapsed, 1e-9):.0f} rows/s)")
+    finally:
+        cur.close()
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Done in {elapsed:.1f}s: {total} rows, resolved {resolved} "
+                f"({total / max(elapsed, 1e-9):.0f} rows/s)")
 
 if __name__ == '__main__':
     main()
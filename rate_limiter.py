@@ -0,0 +1,128 @@
+import os
+import time
+import asyncio
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+# Адаптивный token bucket для ads-api: скорость растёт аддитивно после успешных
+# запросов и делится пополам после каждого 429 (AIMD), Retry-After блокирует
+# все запросы до указанного момента. Через .env задаются:
+# RATE_LIMIT_RPS: стартовая скорость, запросов в секунду
+# RATE_LIMIT_MIN_RPS / RATE_LIMIT_MAX_RPS: границы подстройки
+# RATE_LIMIT_STEP: прибавка к скорости после успешного запроса
+# RATE_LIMIT_BURST: ёмкость ведра (сколько запросов можно сделать подряд)
+# RETRY_BASE_DELAY / RETRY_MAX_DELAY: границы экспоненциального backoff в секундах
+RATE_LIMIT_RPS = float(os.getenv("RATE_LIMIT_RPS", "0.5"))
+RATE_LIMIT_MIN_RPS = float(os.getenv("RATE_LIMIT_MIN_RPS", "0.05"))
+RATE_LIMIT_MAX_RPS = float(os.getenv("RATE_LIMIT_MAX_RPS", "5"))
+RATE_LIMIT_STEP = float(os.getenv("RATE_LIMIT_STEP", "0.05"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "1"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "60"))
+
+
+def parse_retry_after(value):
+    """Retry-After в секундах или в формате HTTP-date → секунды ожидания (или None)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return max(0.0, (dt - datetime.now(timezone.utc)).total_seconds())
+
+
+class RateLimiter:
+    """Потокобезопасный token bucket с подстройкой скорости по 429."""
+
+    def __init__(self, rate=RATE_LIMIT_RPS, min_rate=RATE_LIMIT_MIN_RPS, max_rate=RATE_LIMIT_MAX_RPS,
+                 step=RATE_LIMIT_STEP, burst=RATE_LIMIT_BURST,
+                 base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.step = step
+        self.burst = burst
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+        # Счётчики
+        self.requests = 0
+        self.throttles = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _try_take(self) -> float:
+        """Берёт токен и возвращает 0 или сколько ещё ждать до следующей попытки."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self._blocked_until and self._tokens >= 1:
+                self._tokens -= 1
+                self.requests += 1
+                return 0.0
+            delay = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+            self.wait_seconds += delay
+            return delay
+
+    def acquire(self):
+        """Блокирует до появления токена и учитывает время ожидания."""
+        while True:
+            delay = self._try_take()
+            if not delay:
+                return
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """То же, что acquire, но не блокирует event loop (ads_async.py)."""
+        while True:
+            delay = self._try_take()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.step)
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Jittered экспоненциальный backoff (full jitter) по номеру попытки."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def on_throttle(self, attempt: int, retry_after=None) -> float:
+        """
+        Учитывает 429: уменьшает скорость вдвое и блокирует ведро на время паузы.
+        Пауза — Retry-After, если сервер его прислал, иначе backoff_delay(attempt).
+        """
+        delay = self.backoff_delay(attempt) if retry_after is None else retry_after
+        with self._lock:
+            self.throttles += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        return delay
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "throttles": self.throttles,
+                "wait_seconds": round(self.wait_seconds, 1),
+                "rate_rps": round(self.rate, 3),
+            }
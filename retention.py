@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import logging
+import psycopg2
+from psycopg2.errors import LockNotAvailable
+from dotenv import load_dotenv
+
+from claims import CLAIM_LEASE
+
+# Фоновая очистка ads (db/migrations/009_retention.sql): обработанные объявления удаляются,
+# неудачные переносятся в ads_failed_archive. Работает порциями по одной
+# транзакции и уступает обработке: пока идёт CALL process_* или подключён обработчик,
+# держащий аренду очереди (process.py, claims.py), порции не берутся — но не дольше
+# RETENTION_MAX_WAIT, после чего запуск завершается до следующего раза.
+# Заодно заранее создаёт месячные секции flats_changes (db/migrations/008_partitioning.sql): batch_upsert
+# их только проверяет, чтобы не брать блокировки DDL в горячей транзакции; и порциями
+# заполняет flats_history.content_hash у старых строк (db/migrations/004_fingerprint.sql).
+# Запуск по расписанию: python retention.py (выходит, когда чистить нечего).
+# Через .env задаются:
+# RETENTION_PROCESSED_DAYS: сколько дней хранить обработанные объявления в ads
+# RETENTION_FAILED_DAYS: через сколько дней неудачные уходят в архив
+# RETENTION_CHUNK: строк каждого вида за одну транзакцию
+# RETENTION_PAUSE: пауза между порциями и при занятой БД, секунды
+# RETENTION_MAX_WAIT: сколько секунд подряд ждать обработчиков, прежде чем выйти
+# PARTITION_MONTHS_AHEAD: на сколько месяцев вперёд держать секции flats_changes
+# PARTITION_LOCK_TIMEOUT: сколько ждать блокировку при подключении секции
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL")
+RETENTION_PROCESSED_DAYS = int(os.getenv("RETENTION_PROCESSED_DAYS", "7"))
+RETENTION_FAILED_DAYS = int(os.getenv("RETENTION_FAILED_DAYS", "30"))
+RETENTION_CHUNK = int(os.getenv("RETENTION_CHUNK", "5000"))
+RETENTION_PAUSE = float(os.getenv("RETENTION_PAUSE", "1"))
+RETENTION_MAX_WAIT = float(os.getenv("RETENTION_MAX_WAIT", "600"))
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "2"))
+PARTITION_LOCK_TIMEOUT = os.getenv("PARTITION_LOCK_TIMEOUT", "5s")
+
+logger = logging.getLogger("ads_fetcher")
+
+# Обработчики — только живые сессии: активные CALL process_* и подключённые
+# держатели неистёкшей аренды (application_name = claimed_by, см. claims.worker_name).
+# Аренда упавшего обработчика сессии не имеет и ожидание не продлевает.
+BUSY_SQL = """
+SELECT count(*) FROM pg_stat_activity s
+ WHERE s.pid <> pg_backend_pid()
+   AND ((s.state = 'active' AND s.query ILIKE 'CALL process_%%')
+        OR s.application_name IN (SELECT a.claimed_by FROM ads a
+                                    WHERE a.processed IS FALSE
+                                      AND a.claimed_at > now() - %s::interval));
+"""
+PURGE_SQL = "SELECT * FROM public.purge_ads_chunk(%s * interval '1 day', %s * interval '1 day', %s);"
+PARTITIONS_SQL = "SELECT public.maintain_month_partitions('public.flats_changes', %s);"
+FINGERPRINTS_SQL = "SELECT public.backfill_content_hash(%s);"
+
+
+def maintain_partitions(conn, months_ahead=PARTITION_MONTHS_AHEAD, lock_timeout=PARTITION_LOCK_TIMEOUT):
+    """
+    Создаёт недостающие секции flats_changes; возвращает их число. lock_timeout не даёт
+    ATTACH PARTITION встать в очередь блокировок перед обработчиками: при таймауте
+    секции создадутся при следующем запуске.
+    """
+    with conn.cursor() as cur:
+        try:
+            cur.execute("SET LOCAL lock_timeout = %s;", (lock_timeout,))
+            cur.execute(PARTITIONS_SQL, (months_ahead,))
+            created = cur.fetchone()[0]
+            conn.commit()
+        except LockNotAvailable:
+            conn.rollback()
+            logger.warning("Partitions: flats_changes is busy, retrying on the next run")
+            return 0
+    if created:
+        logger.info(f"Partitions: created {created} flats_changes partition(s)")
+    return created
+
+
+def backfill_fingerprints(conn, chunk=RETENTION_CHUNK, pause=RETENTION_PAUSE) -> int:
+    """Заполняет content_hash у строк flats_history, оставшихся от миграции; возвращает их число."""
+    total = 0
+    with conn.cursor() as cur:
+        while True:
+            cur.execute(FINGERPRINTS_SQL, (chunk,))
+            filled = cur.fetchone()[0]
+            conn.commit()
+            total += filled
+            if filled < chunk:
+                break
+            logger.info(f"Fingerprints: filled {total} flats_history rows so far")
+            time.sleep(pause)
+    if total:
+        logger.info(f"Fingerprints: filled {total} flats_history rows")
+    return total
+
+
+def purge(conn, processed_days=RETENTION_PROCESSED_DAYS, failed_days=RETENTION_FAILED_DAYS,
+          chunk=RETENTION_CHUNK, pause=RETENTION_PAUSE, max_wait=RETENTION_MAX_WAIT, lease=CLAIM_LEASE):
+    """
+    Чистит ads порциями, пока есть что чистить; возвращает (удалено, в архиве).
+    Если обработчики заняты дольше max_wait секунд подряд, выходит с тем, что успел.
+    """
+    deleted = archived = 0
+    waiting_since = None
+    with conn.cursor() as cur:
+        while True:
+            cur.execute(BUSY_SQL, (lease,))
+            busy = cur.fetchone()[0]
+            conn.commit()
+            if busy:
+                waiting_since = waiting_since or time.monotonic()
+                if time.monotonic() - waiting_since >= max_wait:
+                    logger.warning(f"Retention: processors busy for {max_wait:.0f}s, giving up until the next run "
+                                   f"(total {deleted}/{archived})")
+                    return deleted, archived
+                logger.info(f"Retention: {busy} processor(s) running, waiting")
+                time.sleep(pause)
+                continue
+            waiting_since = None
+
+            cur.execute(PURGE_SQL, (processed_days, failed_days, chunk))
+            chunk_deleted, chunk_archived = cur.fetchone()
+            conn.commit()
+            deleted += chunk_deleted
+            archived += chunk_archived
+            logger.info(f"Retention: deleted {chunk_deleted} processed, archived {chunk_archived} failed "
+                        f"(total {deleted}/{archived})")
+            if chunk_deleted < chunk and chunk_archived < chunk:
+                return deleted, archived
+            time.sleep(pause)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if not DATABASE_URL:
+        sys.exit("DATABASE_URL is not set")
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        maintain_partitions(conn)
+        backfill_fingerprints(conn)
+        purge(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,221 @@
+import os
+import sys
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from dotenv import load_dotenv
+
+# Кэш уже записанных объявлений (SQLite на диске), чтобы не гонять в БД
+# то, что ON CONFLICT всё равно выбросит:
+#   seen_ids  — id объявлений ads-api, уже попавшие в ads;
+#   seen_keys — (avitoid, source_id) → отпечаток цены, статуса, времени обновления и описания.
+# Объявление отбрасывается, если его id уже видели или отпечаток по (avitoid, source_id)
+# не изменился. В кэш объявление попадает только после commit страницы (remember),
+# поэтому откатанная вставка не прячет объявления при следующем запуске.
+# Прогрев из ads и flats_history: python seen_cache.py --warm
+# Через .env задаются:
+# SEEN_CACHE_PATH: файл кэша (пусто — кэш выключен)
+load_dotenv()
+SEEN_CACHE_PATH = os.getenv("SEEN_CACHE_PATH", "")
+
+logger = logging.getLogger("ads_fetcher")
+
+_SQLITE_MAX_PARAMS = 900
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_ids (id INTEGER PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS seen_keys (
+  avitoid   TEXT    NOT NULL,
+  source_id INTEGER NOT NULL,
+  fp        INTEGER NOT NULL,
+  PRIMARY KEY (avitoid, source_id)
+) WITHOUT ROWID;
+"""
+
+
+def _norm_price(value):
+    try:
+        d = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return str(value)
+    return str(int(d)) if d == d.to_integral_value() else str(d.normalize())
+
+
+def _norm_time(value):
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def fingerprint(price, is_actual, time_source_updated, description) -> int:
+    """64-битный отпечаток полей, изменение которых batch_upsert пишет в историю."""
+    parts = (
+        "" if price is None else _norm_price(price),
+        "" if is_actual is None else str(is_actual),
+        "" if time_source_updated is None else _norm_time(time_source_updated),
+        description or "",
+    )
+    digest = hashlib.blake2b("\x1f".join(parts).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def _ad_key(ad):
+    if ad.get("avitoid") is None or ad.get("source_id") is None:
+        return None
+    return str(ad["avitoid"]), int(ad["source_id"])
+
+
+def _ad_fingerprint(ad) -> int:
+    return fingerprint(ad.get("price"), ad.get("is_actual"), ad.get("time_source_updated"), ad.get("description"))
+
+
+def _chunks(items, size=_SQLITE_MAX_PARAMS):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class SeenCache:
+    """Потокобезопасный кэш записанных объявлений со счётчиками отсечённого объёма."""
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;" + SCHEMA)
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.skipped_by_id = 0
+        self.skipped_by_key = 0
+        self.skipped_bytes = 0
+
+    def _known_ids(self, ids):
+        known = set()
+        for chunk in _chunks(ids):
+            rows = self._db.execute(
+                f"SELECT id FROM seen_ids WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            known.update(r[0] for r in rows)
+        return known
+
+    def _known_fps(self, keys):
+        known = {}
+        for chunk in _chunks(keys, _SQLITE_MAX_PARAMS // 2):
+            values = ",".join("(?, ?)" for _ in chunk)
+            rows = self._db.execute(
+                f"SELECT avitoid, source_id, fp FROM seen_keys WHERE (avitoid, source_id) IN (VALUES {values})",
+                [v for key in chunk for v in key])
+            known.update(((a, s), fp) for a, s, fp in rows)
+        return known
+
+    def check(self, ads):
+        """Объявления страницы, которых в кэше нет или которые изменились."""
+        ads = list(ads)
+        ids = {ad["id"] for ad in ads if ad.get("id") is not None}
+        keys = {k for k in map(_ad_key, ads) if k}
+        with self._lock:
+            known_ids = self._known_ids(ids)
+            known_fps = self._known_fps(keys)
+
+        fresh = []
+        by_id = by_key = skipped_bytes = 0
+        for ad in ads:
+            if ad.get("id") in known_ids:
+                by_id += 1
+            else:
+                key = _ad_key(ad)
+                if key is None or known_fps.get(key) != _ad_fingerprint(ad):
+                    fresh.append(ad)
+                    continue
+                by_key += 1
+            skipped_bytes += len(ad.get("description") or "") + len(str(ad.get("params") or ""))
+        # Счётчики общие для потоков бэкфилла и конвейера: += не атомарен
+        with self._lock:
+            self.skipped_by_id += by_id
+            self.skipped_by_key += by_key
+            self.skipped_bytes += skipped_bytes
+            self.checked += len(ads)
+        return fresh
+
+    def remember(self, ads):
+        """Запоминает объявления закоммиченной страницы."""
+        ids = [(ad["id"],) for ad in ads if ad.get("id") is not None]
+        keys = [(*key, _ad_fingerprint(ad)) for ad in ads for key in [_ad_key(ad)] if key]
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR IGNORE INTO seen_ids (id) VALUES (?)", ids)
+            self._db.executemany("INSERT OR REPLACE INTO seen_keys (avitoid, source_id, fp) VALUES (?, ?, ?)", keys)
+
+    def warm(self, pg_conn, itersize=50000) -> int:
+        """Заполняет кэш из ads и flats_history (серверными курсорами, порциями)."""
+        total = 0
+        queries = (
+            ("warm_ads", "SELECT id, avitoid, source_id, price, is_actual, time_source_updated, description FROM ads"),
+            ("warm_history", "SELECT NULL, avitoid, source_id, price, is_actual, time_source_updated, description "
+                             "FROM flats_history"),
+        )
+        for name, sql in queries:
+            with pg_conn.cursor(name=name) as cur:
+                cur.itersize = itersize
+                cur.execute(sql)
+                while True:
+                    rows = cur.fetchmany(itersize)
+                    if not rows:
+                        break
+                    self.remember([
+                        {"id": r[0], "avitoid": r[1], "source_id": r[2], "price": r[3],
+                         "is_actual": r[4], "time_source_updated": r[5], "description": r[6]}
+                        for r in rows
+                    ])
+                    total += len(rows)
+            pg_conn.rollback()
+            logger.info(f"Seen cache: warmed from {name[5:]}, {total} rows so far")
+        return total
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "skipped_by_id": self.skipped_by_id,
+                "skipped_by_key": self.skipped_by_key,
+                "skipped_rows": self.skipped_by_id + self.skipped_by_key,
+                "skipped_text_bytes": self.skipped_bytes,
+            }
+
+    def close(self):
+        self._db.close()
+
+
+class _NoCache:
+    """Заглушка при пустом SEEN_CACHE_PATH: пропускает всё."""
+
+    def check(self, ads):
+        return list(ads)
+
+    def remember(self, ads):
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+def open_seen_cache(path=SEEN_CACHE_PATH):
+    return SeenCache(path) if path else _NoCache()
+
+
+if __name__ == "__main__":
+    import psycopg2
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if "--warm" not in sys.argv or not SEEN_CACHE_PATH:
+        sys.exit("usage: SEEN_CACHE_PATH=... python seen_cache.py --warm")
+    conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+    cache = SeenCache(SEEN_CACHE_PATH)
+    try:
+        logger.info(f"Seen cache: {cache.warm(conn)} rows from ads and flats_history → {SEEN_CACHE_PATH}")
+    finally:
+        cache.close()
+        conn.close()
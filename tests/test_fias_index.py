@@ -0,0 +1,66 @@
+from fias_index import FiasIndex, House
+
+STREETS = [
+    (1, "ленина", "ул"),
+    (2, "ленинский", "пр-кт"),
+    (3, "ленинградское", "ш"),
+    (4, "лесная", "ул"),
+    (5, "королева", "ул"),
+    (6, "ленина", "пер"),
+    (7, None, "ул"),
+]
+HOUSES = [
+    (1, 101, "10", None, None, None, None),
+    (1, 102, "10", 2, "корп", None, None),
+    (1, 103, "12а", None, None, 1, "стр"),
+    (6, 104, "10", None, None, None, None),
+    (2, 105, None, None, None, None, None),
+]
+
+
+def index():
+    return FiasIndex(STREETS, HOUSES)
+
+
+def test_street_prefix_search():
+    idx = index()
+    assert sorted(idx.street_objectids("ленин")) == [1, 2, 3, 6]
+    assert sorted(idx.street_objectids("ленина")) == [1, 6]
+    assert idx.street_objectids("лес") == [4]
+    assert idx.street_objectids("мира") == []
+
+
+def test_street_prefix_stops_at_first_mismatch():
+    # бинарный поиск не должен захватывать соседей по сортировке
+    assert index().street_objectids("лени") == index().street_objectids("ленин")
+    assert index().street_objectids("ленинградск") == [3]
+    assert index().street_objectids("я") == []
+
+
+def test_street_search_normalizes_case_and_yo():
+    idx = FiasIndex([(8, "королева", "ул"), (9, "семеновская", "ул")], [])
+    assert idx.street_objectids("Королёва") == [8]
+    assert idx.street_objectids("СЕМЁНОВСКАЯ") == [9]
+
+
+def test_street_search_filters_by_typename():
+    idx = index()
+    assert idx.street_objectids("ленина", "ул") == [1]
+    assert idx.street_objectids("ленин", "пр-кт") == [2]
+    assert idx.street_objectids("ленин", "б-р") == []
+
+
+def test_streets_without_name_are_skipped():
+    assert index().stats()["streets"] == 6
+
+
+def test_houses_by_parents_merges_numbers():
+    merged = index().houses_by_parents([1, 6, 42])
+    assert merged["10"] == [House(101, None, None, None, None), House(102, "2", "корп", None, None),
+                            House(104, None, None, None, None)]
+    assert merged["12А"] == [House(103, None, None, "1", "стр")]
+    assert index().houses_by_parents([]) == {}
+
+
+def test_stats():
+    assert index().stats() == {"streets": 6, "house_parents": 2, "houses": 4}
@@ -0,0 +1,120 @@
+import pytest
+
+import ads_api
+from ads_api import KeysetCursor, _iter_query_pages
+
+SECOND = "2024-05-01 10:00:00"
+
+
+def ad(id, time, source="1"):
+    return {"id": id, "time": time, "source_id": source}
+
+
+def test_accept_drops_ads_already_seen_at_the_boundary():
+    cursor = KeysetCursor("2024-05-01 00:00:00", 3)
+    page = [ad(1, "2024-05-01 09:00:00"), ad(2, SECOND), ad(3, SECOND)]
+    assert cursor.advance(page)
+    assert cursor.next_start == SECOND
+    assert cursor.overfull is None
+
+    nxt = [ad(2, SECOND), ad(3, SECOND), ad(4, SECOND)]
+    assert [a["id"] for a in cursor.accept(nxt)] == [4]
+    assert cursor.advance(nxt)
+    assert cursor.boundary_ids == {2, 3, 4}
+
+
+def test_advance_stops_on_short_page():
+    cursor = KeysetCursor("2024-05-01 00:00:00", 3)
+    assert not cursor.advance([ad(1, SECOND)])
+    assert cursor.overfull is None
+
+
+def test_overfull_second_skips_to_the_next_one():
+    cursor = KeysetCursor(SECOND, 2)
+    page = [ad(1, SECOND), ad(2, SECOND)]
+    assert cursor.advance(page)
+    assert cursor.advance(page)
+    assert cursor.overfull == SECOND
+    assert cursor.overfull_ids == {1, 2}
+    assert cursor.next_start == "2024-05-01 10:00:01"
+    assert cursor.overfull_window() == (SECOND, "2024-05-01 10:00:01")
+    assert cursor.in_overfull(ad(3, SECOND))
+    assert not cursor.in_overfull(ad(1, SECOND))
+    assert not cursor.in_overfull(ad(4, "2024-05-01 10:00:01"))
+
+
+ADS = [
+    ad(1, "2024-05-01 09:59:59", "1"),
+    # 5 объявлений одной секунды при limit=3: секунда переполнена
+    ad(10, SECOND, "1"), ad(11, SECOND, "2"), ad(12, SECOND, "3"), ad(13, SECOND, "1"), ad(14, SECOND, "2"),
+    ad(20, "2024-05-01 10:00:01", "2"),
+    ad(21, "2024-05-01 10:00:02", "3"),
+]
+
+
+def fake_api(inclusive_date2):
+    calls = []
+
+    def fetch_ads_batch(date1, date2, city=None, source=None, limit=None, **filters):
+        calls.append((date1, date2, source))
+        sources = set(source.split(",")) if source else None
+        batch = [a for a in ADS
+                 if a["time"] >= date1 and (a["time"] <= date2 if inclusive_date2 else a["time"] < date2)
+                 and (sources is None or a["source_id"] in sources)]
+        return batch[:limit]
+
+    return fetch_ads_batch, calls
+
+
+@pytest.mark.parametrize("inclusive_date2", [False, True])
+def test_overfull_second_is_split_by_source(monkeypatch, inclusive_date2):
+    fetch, calls = fake_api(inclusive_date2)
+    monkeypatch.setattr(ads_api, "fetch_ads_batch", fetch)
+
+    pages = list(_iter_query_pages("2024-05-01 00:00:00", "2024-05-01 11:00:00", source="1,2,3", limit=3))
+    ids = [a["id"] for page in pages for a in page]
+    assert sorted(ids) == [a["id"] for a in ADS]
+    assert len(ids) == len(set(ids))
+    # дробление идёт окном в одну секунду, а не пустым date1 = date2
+    split = [c for c in calls if c[2] in ("1", "2", "3")]
+    assert split and all(c[:2] == (SECOND, "2024-05-01 10:00:01") for c in split)
+
+
+def test_overfull_second_with_single_source_is_skipped(monkeypatch):
+    fetch, _ = fake_api(False)
+    monkeypatch.setattr(ads_api, "fetch_ads_batch", fetch)
+
+    pages = list(_iter_query_pages("2024-05-01 00:00:00", "2024-05-01 11:00:00", limit=3))
+    ids = [a["id"] for page in pages for a in page]
+    assert ids == [1, 10, 11, 12, 20, 21]
+
+
+class FakeResponse:
+    def __init__(self, ads):
+        self.ads = ads
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize("inclusive_date2", [False, True])
+def test_streamed_overfull_split_stays_inside_the_second(monkeypatch, inclusive_date2):
+    fetch, calls = fake_api(inclusive_date2)
+    def request_page(params, stream=False):
+        return FakeResponse(fetch(params["date1"], params["date2"], source=params.get("source"),
+                                  limit=params["limit"]))
+
+    monkeypatch.setattr(ads_api, "_request_page", request_page)
+    monkeypatch.setattr(ads_api, "iter_response_ads", lambda resp: iter(resp.ads))
+
+    ids, keys = [], []
+    for page in ads_api.iter_ads_streams("2024-05-01 00:00:00", "2024-05-01 11:00:00", source="1,2,3", limit=3):
+        ids.extend(a["id"] for a in page)
+        if calls[-1][2] != "1,2,3":
+            keys.extend(page.keys)
+    assert sorted(ids) == [a["id"] for a in ADS]
+    assert len(ids) == len(set(ids))
+    # вложенные обходы не листают следующую секунду и не отдают её в keys (чекпоинты)
+    split = [c for c in calls if c[2] in ("1", "2", "3")]
+    assert split and all(c[0] == SECOND for c in split)
+    assert keys and all(k["time"] == SECOND for k in keys)
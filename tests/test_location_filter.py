@@ -0,0 +1,84 @@
+import json
+import os
+import random
+import re
+
+import pytest
+
+from location_filter import FIELDS, LocationFilter, default_filter, _pattern
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RULES_SQL = os.path.join(ROOT, "db", "migrations", "R__location_rules.sql")
+FIXTURES = ["sell.json", "sdam.json", "buy.json"]
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+def fixture_ads():
+    ads = []
+    for name in FIXTURES:
+        with open(os.path.join(ROOT, name), encoding="utf-8") as f:
+            ads.extend(json.load(f).get("data", []))
+    return ads
+
+
+def test_pattern_is_deterministic():
+    subs = ["нао", "тао", "обл.", "зеленоград", "троицк", "люберцы"]
+    expected = _pattern(subs)
+    for seed in range(20):
+        shuffled = subs[:]
+        random.Random(seed).shuffle(shuffled)
+        assert _pattern(shuffled) == expected
+    assert expected == "зеленоград|люберцы|троицк|обл\\.|нао|тао"
+
+
+def test_pattern_prefers_longer_substrings():
+    assert _pattern(["нао", "наобум", "", "НАО"]) == "наобум|нао"
+
+
+def test_excluded_matches_any_field_case_insensitively():
+    f = LocationFilter({"city": ["зеленоград"], "address": ["обл."]})
+    assert f.excluded({"city": "Зеленоград"})
+    assert f.excluded({"address": "Московская Обл., Люберцы"})
+    assert not f.excluded({"address": "Москва, облепиховая ул."})
+    assert not f.excluded({"city": None, "district_only": None, "address": None})
+    assert f.filter([{"city": "Москва"}, {"city": "Зеленоград"}]) == [{"city": "Москва"}]
+
+
+def test_unknown_fields_are_rejected():
+    with pytest.raises(ValueError):
+        LocationFilter({"town": ["x"]})
+
+
+def test_patterns_are_portable_to_postgres_regex():
+    # В ARE (Postgres) обратный слэш перед буквой или цифрой — класс или escape (\d, \m...),
+    # поэтому Python-выражение совпадает по смыслу, только если экранируются лишь спецсимволы
+    for pattern in default_filter().patterns.values():
+        assert not re.search(r"\\[0-9A-Za-zА-Яа-яЁё]", pattern)
+
+
+def test_sql_quotes_literals():
+    sql = LocationFilter({"address": ["д'артаньян"]}).sql()
+    assert "~ 'д''артаньян'" in sql
+
+
+def test_committed_rules_sql_is_up_to_date():
+    with open(RULES_SQL, encoding="utf-8") as f:
+        assert f.read() == default_filter().sql(), "run: python location_filter.py --sql > " + RULES_SQL
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+def test_python_and_sql_exclude_the_same_ads():
+    import psycopg2
+
+    ads = fixture_ads()
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(default_filter().sql().split("-- Необработанные объявления")[0])
+            for ad in ads:
+                cur.execute("SELECT public.is_excluded_location(%s, %s, %s);",
+                            tuple(ad.get(field) for field in FIELDS))
+                assert cur.fetchone()[0] == default_filter().excluded(ad), ad.get("address")
+    finally:
+        conn.rollback()
+        conn.close()
@@ -0,0 +1,55 @@
+import os
+import re
+
+import psycopg2
+import pytest
+
+import migrate
+
+# База с исходной схемой (db/tables.sql и справочники), на которой можно прогнать миграции
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+CREATE_INDEX = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?(\w+)",
+                          re.IGNORECASE)
+
+
+def migration_indexes():
+    names = set()
+    for _, path in migrate.list_migrations() + migrate.list_repeatable():
+        with open(path, encoding="utf-8") as f:
+            names.update(CREATE_INDEX.findall(f.read()))
+    return names
+
+
+def test_plan_check_indexes_are_created_by_migrations():
+    created = migration_indexes()
+    for name, _, expected in migrate.PLAN_CHECKS:
+        assert expected <= created, f"{name}: {sorted(expected - created)} not created by any migration"
+
+
+def test_migration_versions_are_unique():
+    numbers = [version[:3] for version, _ in migrate.list_migrations()]
+    assert len(numbers) == len(set(numbers))
+    assert numbers == sorted(numbers)
+
+
+def test_plan_indexes_walks_nested_plans():
+    plan = {
+        "Node Type": "Aggregate",
+        "Plans": [{
+            "Node Type": "Bitmap Heap Scan",
+            "Relation Name": "fias_objects",
+            "Plans": [{"Node Type": "Bitmap Index Scan", "Index Name": "fias_objects_lower_norm_name_trgm_idx"}],
+        }],
+    }
+    assert migrate._plan_indexes(plan) == {"fias_objects_lower_norm_name_trgm_idx"}
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+def test_hot_queries_use_their_indexes():
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    try:
+        migrate.migrate(conn)
+        assert migrate.check_plans(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,132 @@
+import asyncio
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, parse_retry_after
+
+
+class FakeClock:
+    """time.monotonic / time.sleep без реального ожидания."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(rate_limiter.time, "sleep", clock.sleep)
+    return clock
+
+
+def limiter(**kwargs):
+    params = dict(rate=2.0, min_rate=0.5, max_rate=3.0, step=0.5, burst=1, base_delay=1, max_delay=8)
+    params.update(kwargs)
+    return RateLimiter(**params)
+
+
+def test_bucket_spaces_requests_by_rate(clock):
+    rl = limiter()
+    rl.acquire()
+    rl.acquire()
+    rl.acquire()
+    assert clock.slept == [0.5, 0.5]
+    assert rl.stats()["requests"] == 3
+    assert rl.stats()["wait_seconds"] == 1.0
+
+
+def test_burst_allows_back_to_back_requests(clock):
+    rl = limiter(burst=3)
+    for _ in range(3):
+        rl.acquire()
+    assert clock.slept == []
+
+
+def test_success_increases_rate_additively_up_to_max(clock):
+    rl = limiter()
+    rl.on_success()
+    assert rl.rate == 2.5
+    for _ in range(5):
+        rl.on_success()
+    assert rl.rate == 3.0
+
+
+def test_throttle_halves_rate_down_to_min(clock):
+    rl = limiter()
+    rl.on_throttle(0, retry_after=0)
+    assert rl.rate == 1.0
+    rl.on_throttle(0, retry_after=0)
+    rl.on_throttle(0, retry_after=0)
+    assert rl.rate == 0.5
+    assert rl.stats()["throttles"] == 3
+
+
+def test_retry_after_blocks_the_bucket(clock):
+    rl = limiter()
+    rl.acquire()
+    assert rl.on_throttle(0, retry_after=5) == 5
+    rl.acquire()
+    assert sum(clock.slept) == pytest.approx(5)
+
+
+def test_throttle_without_retry_after_uses_backoff(clock, monkeypatch):
+    monkeypatch.setattr(rate_limiter.random, "uniform", lambda a, b: b)
+    rl = limiter()
+    assert rl.on_throttle(2) == 4
+    assert rl._blocked_until == clock.now + 4
+
+
+def test_backoff_is_capped(monkeypatch):
+    monkeypatch.setattr(rate_limiter.random, "uniform", lambda a, b: b)
+    rl = limiter()
+    assert [rl.backoff_delay(n) for n in range(6)] == [1, 2, 4, 8, 8, 8]
+
+
+def test_backoff_is_jittered():
+    rl = limiter()
+    delays = [rl.backoff_delay(3) for _ in range(50)]
+    assert all(0 <= d <= 8 for d in delays)
+    assert len(set(delays)) > 1
+
+
+def test_acquire_async_waits_without_blocking(clock, monkeypatch):
+    slept = []
+
+    async def fake_sleep(seconds):
+        slept.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", fake_sleep)
+    rl = limiter()
+
+    async def run():
+        await rl.acquire_async()
+        await rl.acquire_async()
+
+    asyncio.run(run())
+    assert slept == [0.5]
+    assert clock.slept == []
+
+
+@pytest.mark.parametrize("value, expected", [(None, None), ("", None), ("7", 7.0), ("-3", 0.0), ("junk", None)])
+def test_parse_retry_after_seconds(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date():
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert parse_retry_after(format_datetime(when, usegmt=True)) == pytest.approx(30, abs=2)
+    past = datetime.now(timezone.utc) - timedelta(seconds=30)
+    assert parse_retry_after(format_datetime(past, usegmt=True)) == 0.0